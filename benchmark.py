@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Đo hiệu năng toàn bộ quy trình PDF → Excel, không cần mạng hay API key
+- Tạo PDF bảng tổng hợp: N trang, số dòng/cột thay đổi theo trang, dạng digital (có lớp text)
+  hoặc dạng scan (chỉ có ảnh)
+- Chạy server AI giả lập (mock_ai_server.py) theo định dạng Claude / Gemini / DeepSeek,
+  độ trễ và tỉ lệ lỗi cấu hình được
+- Chạy PDFToExcelConverter từ đầu đến cuối, báo cáo trang/giây, độ trễ mỗi trang p50/p95,
+  RSS đỉnh theo từng giai đoạn; kết quả ghi ra JSON/CSV để so sánh giữa các phiên bản
+
+Cách dùng:
+    python benchmark.py --pages 50 --kinds digital,scanned --providers anthropic,gemini,deepseek
+    python benchmark.py --pages 100 --workers 8 --latency 1.0 --jitter 0.5 --error-rate 0.05
+    python benchmark.py --pages 100 --async --in-flight 32 --batch-pages 4 --no-text-layer
+"""
+
+import io
+import os
+import gc
+import csv
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import contextlib
+from pathlib import Path
+from datetime import datetime
+
+from PIL import Image, ImageDraw, ImageFont
+from pypdf import PdfWriter, PdfReader
+from pypdf.generic import DictionaryObject, NameObject, DecodedStreamObject
+
+from pipeline import PDFToExcelConverter
+
+# Giai đoạn đo RSS: tạo PDF, chuẩn bị (tách trang, lớp text), xử lý trang, lưu Excel + báo cáo
+PHASES = ("generate", "prepare", "convert", "finish")
+KINDS = ("digital", "scanned", "mixed")
+
+# Biến môi trường trỏ từng nhà cung cấp vào server giả lập
+PROVIDER_ENV = {
+    "anthropic": ("CLAUDE_API_URL", "/v1/messages", "CLAUDE_API_KEY"),
+    "deepseek": ("DEEPSEEK_API_URL", "/chat/completions", "DEEPSEEK_API_KEY"),
+    "gemini": ("GEMINI_API_URL", "", "GEMINI_API_KEY"),
+}
+
+
+def _table_cells(rng, page_number, rows, cols):
+    """Nội dung 1 bảng giả: dòng tiêu đề + `rows` dòng số liệu"""
+    header = ["STT"] + [f"Cot {c}" for c in range(1, cols)]
+    body = [[str(r)] + [f"{rng.randint(0, 999999):,}" for _ in range(1, cols)] for r in range(1, rows + 1)]
+    return [header] + body
+
+
+def _page_shapes(pages, rows, cols, seed):
+    """(số dòng, số cột) ngẫu nhiên của từng trang trong khoảng cho trước"""
+    rng = random.Random(seed)
+    return [(rng.randint(*rows), rng.randint(*cols)) for _ in range(pages)], rng
+
+
+def make_digital_pdf(path, pages=10, rows=(8, 30), cols=(3, 8), seed=0):
+    """PDF có lớp text: mỗi trang 1 bảng vẽ bằng lệnh text Helvetica (A4)"""
+    shapes, rng = _page_shapes(pages, rows, cols, seed)
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for page_number, (n_rows, n_cols) in enumerate(shapes, 1):
+        page = writer.add_blank_page(595, 842)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+        })
+        col_width = min(100, 500 // n_cols)
+        row_height = min(18, 740 // (n_rows + 1))
+        ops = [f"BT /F1 14 Tf 50 800 Td (Bang so lieu trang {page_number}) Tj ET"]
+        for r, row in enumerate(_table_cells(rng, page_number, n_rows, n_cols)):
+            for c, text in enumerate(row):
+                ops.append(f"BT /F1 8 Tf {50 + c * col_width} {770 - r * row_height} Td ({text}) Tj ET")
+        stream = DecodedStreamObject()
+        stream.set_data("\n".join(ops).encode("latin-1"))
+        page[NameObject("/Contents")] = writer._add_object(stream)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return path
+
+
+def _scanned_page(rng, page_number, n_rows, n_cols, dpi):
+    """Ảnh 1 trang scan A4: bảng có kẻ ô, nghiêng nhẹ, có nhiễu"""
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    margin = int(0.6 * dpi)
+    col_width = (width - 2 * margin) // n_cols
+    row_height = min(int(0.3 * dpi), (height - 3 * margin) // (n_rows + 1))
+    draw.text((margin, margin), f"Bang so lieu trang {page_number}", fill=0, font=font)
+    top = margin + int(0.4 * dpi)
+    for r, row in enumerate(_table_cells(rng, page_number, n_rows, n_cols)):
+        y = top + r * row_height
+        for c, text in enumerate(row):
+            x = margin + c * col_width
+            draw.rectangle([x, y, x + col_width, y + row_height], outline=0)
+            draw.text((x + 4, y + row_height // 3), text, fill=0, font=font)
+    # Nhiễu và độ nghiêng giống bản scan
+    for _ in range(width * height // 2000):
+        draw.point((rng.randrange(width), rng.randrange(height)), fill=rng.randint(80, 200))
+    return image.rotate(rng.uniform(-0.8, 0.8), fillcolor=255)
+
+
+def make_scanned_pdf(path, pages=10, rows=(8, 30), cols=(3, 8), seed=0, dpi=150):
+    """PDF dạng scan (không có lớp text): mỗi trang là 1 ảnh JPEG.
+
+    Ghi từng trang rồi ghép lại để không giữ ảnh của mọi trang trong bộ nhớ.
+    """
+    shapes, rng = _page_shapes(pages, rows, cols, seed)
+    writer = PdfWriter()
+    for page_number, (n_rows, n_cols) in enumerate(shapes, 1):
+        buffer = io.BytesIO()
+        _scanned_page(rng, page_number, n_rows, n_cols, dpi).save(buffer, "PDF", resolution=dpi)
+        writer.add_page(PdfReader(buffer).pages[0])
+    with open(path, "wb") as f:
+        writer.write(f)
+    return path
+
+
+def make_mixed_pdf(path, pages=10, rows=(8, 30), cols=(3, 8), seed=0, dpi=150):
+    """PDF xen kẽ trang digital (lẻ) và trang scan (chẵn)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        digital = PdfReader(make_digital_pdf(Path(tmp) / "d.pdf", (pages + 1) // 2, rows, cols, seed))
+        scanned = PdfReader(make_scanned_pdf(Path(tmp) / "s.pdf", pages // 2, rows, cols, seed + 1, dpi))
+        writer = PdfWriter()
+        for i in range(pages):
+            source = digital if i % 2 == 0 else scanned
+            writer.add_page(source.pages[i // 2])
+        with open(path, "wb") as f:
+            writer.write(f)
+    return path
+
+
+MAKERS = {"digital": make_digital_pdf, "scanned": make_scanned_pdf, "mixed": make_mixed_pdf}
+
+
+def current_rss():
+    """RSS hiện tại của tiến trình (byte), None nếu hệ điều hành không hỗ trợ"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # Không có /proc (macOS): chỉ đọc được RSS đỉnh từ đầu tiến trình (byte trên macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+class RssSampler:
+    """Luồng nền lấy mẫu RSS định kỳ, ghi nhận giá trị đỉnh theo giai đoạn đang chạy.
+
+    Chỉ đo tiến trình Python; tiến trình poppler (pdftoppm) con không được tính.
+    """
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.phase = None
+        self.peaks = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+        self.sample()
+
+    def set_phase(self, phase):
+        self.sample()
+        self.phase = phase
+        self.sample()
+
+    def sample(self):
+        rss = current_rss()
+        if rss is not None and self.phase is not None:
+            self.peaks[self.phase] = max(self.peaks.get(self.phase, 0), rss)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+
+def percentile(values, q):
+    """Phân vị q (0..100) nội suy tuyến tính, None nếu không có giá trị"""
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def start_mock_server(latency, jitter, error_rate, seed=None, max_output_tokens=None):
+    """Chạy mock_ai_server.py ở tiến trình riêng (không tranh GIL với quy trình cần đo)"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    command = [sys.executable, str(Path(__file__).with_name("mock_ai_server.py")), "--port", str(port),
+               "--latency", str(latency), "--jitter", str(jitter), "--error-rate", str(error_rate)]
+    if seed is not None:
+        command += ["--seed", str(seed)]
+    if max_output_tokens:
+        command += ["--max-output-tokens", str(max_output_tokens)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    # Dòng đầu tiên server in ra nghĩa là đã sẵn sàng nhận request
+    if not process.stdout.readline():
+        raise RuntimeError("Không khởi động được server AI giả lập")
+    return process, f"http://127.0.0.1:{port}"
+
+
+def point_providers_at(server_url):
+    """Trỏ mọi nhà cung cấp vào server giả lập, dùng key giả (key thật không bao giờ bị gửi đi)"""
+    for url_env, path, key_env in PROVIDER_ENV.values():
+        os.environ[url_env] = server_url + path
+        os.environ[key_env] = "benchmark"
+
+
+def run_scenario(pdf_path, kind, provider, options, verbose=False):
+    """Chạy 1 kịch bản (1 file PDF × 1 nhà cung cấp) và trả về dict kết quả"""
+    gc.collect()
+    with tempfile.TemporaryDirectory(prefix="pdf2excel_bench_") as output_dir, RssSampler() as sampler:
+        converter = PDFToExcelConverter(pdf_path, provider=provider, output_dir=output_dir,
+                                        use_cache=False, **options)
+        # Đánh dấu giai đoạn cho bộ lấy mẫu RSS (mọi chế độ chạy đều qua prepare_run / finish_run)
+        prepare_run, finish_run = converter.prepare_run, converter.finish_run
+
+        def tracked_prepare():
+            sampler.set_phase("prepare")
+            try:
+                return prepare_run()
+            finally:
+                sampler.set_phase("convert")
+
+        def tracked_finish():
+            sampler.set_phase("finish")
+            return finish_run()
+
+        converter.prepare_run, converter.finish_run = tracked_prepare, tracked_finish
+        output = None if verbose else open(os.devnull, "w", encoding="utf-8")
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+                result = converter.run_full_process()
+        finally:
+            if output:
+                output.close()
+        elapsed = time.perf_counter() - start
+        report = converter.metrics.report()
+
+    pages = report["pages"].values()
+    done = [page for page in pages if page["status"] == "done"]
+    # Độ trễ 1 trang = tổng thời gian thực các bước của trang đó (render → ghi Excel)
+    latencies = [sum(stage["wall"] for stage in page["stages"].values()) for page in done]
+    ai_latencies = [latency for latency, page in zip(latencies, done) if page["method"] == "ai"]
+    counters = report["totals"]["counters"]
+    return {
+        "kind": kind,
+        "provider": provider,
+        "pages": len(converter.page_numbers),
+        "pages_done": len(done),
+        "pages_ai": sum(1 for page in done if page["method"] == "ai"),
+        "pages_text": sum(1 for page in done if page["method"] == "text"),
+        "ok": result is not None,
+        "seconds": round(elapsed, 3),
+        "pages_per_second": round(len(done) / elapsed, 3) if elapsed else None,
+        "latency_p50": _round(percentile(latencies, 50)),
+        "latency_p95": _round(percentile(latencies, 95)),
+        "ai_latency_p50": _round(percentile(ai_latencies, 50)),
+        "ai_latency_p95": _round(percentile(ai_latencies, 95)),
+        "peak_rss_mb": {phase: round(peak / 2 ** 20, 1) for phase, peak in sampler.peaks.items()},
+        "stages": {name: round(stage["wall"], 3) for name, stage in report["totals"]["stages"].items()},
+        "requests": counters.get("requests", 0),
+        "retries": counters.get("retries", 0),
+    }
+
+
+def _round(value, digits=3):
+    return None if value is None else round(value, digits)
+
+
+def _int_range(text):
+    """"8-30" → (8, 30); "12" → (12, 12)"""
+    low, _, high = text.partition("-")
+    low, high = int(low), int(high or low)
+    if low < 1 or high < low:
+        raise argparse.ArgumentTypeError(f"Khoảng không hợp lệ: '{text}'")
+    return low, high
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def write_results(results, settings, output_dir):
+    """Ghi bench_<thời gian>.json (đủ chi tiết) và .csv (1 dòng mỗi kịch bản)"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    stem = f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    json_file = output_dir / f"{stem}.json"
+    with open(json_file, "w", encoding="utf-8") as f:
+        json.dump({"revision": _git_revision(), "settings": settings, "results": results},
+                  f, ensure_ascii=False, indent=2)
+
+    csv_file = output_dir / f"{stem}.csv"
+    columns = ["kind", "provider", "pages", "pages_done", "pages_ai", "pages_text", "seconds",
+               "pages_per_second", "latency_p50", "latency_p95", "ai_latency_p50", "ai_latency_p95",
+               "requests", "retries"]
+    with open(csv_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns + [f"peak_rss_mb_{phase}" for phase in PHASES])
+        for result in results:
+            writer.writerow([result[c] for c in columns] + [result["peak_rss_mb"].get(p) for p in PHASES])
+    return json_file, csv_file
+
+
+def print_results(results):
+    print(f"\n{'Kịch bản':<22}{'trang':>7}{'trang/s':>9}{'p50 (s)':>9}{'p95 (s)':>9}{'thử lại':>9}"
+          f"   RSS đỉnh (MB) prepare/convert/finish")
+    for r in results:
+        rss = "/".join(f"{r['peak_rss_mb'].get(p, 0):.0f}" for p in PHASES[1:])
+        p50 = f"{r['latency_p50']:.3f}" if r["latency_p50"] is not None else "-"
+        p95 = f"{r['latency_p95']:.3f}" if r["latency_p95"] is not None else "-"
+        print(f"{r['kind'] + ' / ' + r['provider']:<22}{r['pages_done']:>4}/{r['pages']:<2}"
+              f"{r['pages_per_second']:>9}{p50:>9}{p95:>9}{r['retries']:>9}   {rss}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo hiệu năng PDF → Excel với server AI giả lập")
+    parser.add_argument("--pages", type=int, default=20, help="Số trang mỗi PDF tổng hợp (mặc định: 20)")
+    parser.add_argument("--rows", type=_int_range, default=(8, 30), help="Số dòng mỗi bảng, vd. 8-30")
+    parser.add_argument("--cols", type=_int_range, default=(3, 8), help="Số cột mỗi bảng, vd. 3-8")
+    parser.add_argument("--kinds", default="digital,scanned",
+                        help=f"Loại PDF cần đo ({', '.join(KINDS)}), cách nhau dấu phẩy")
+    parser.add_argument("--providers", default="anthropic",
+                        help=f"Định dạng API cần đo ({', '.join(PROVIDER_ENV)}), cách nhau dấu phẩy")
+    parser.add_argument("--pdf", default=None, help="Đo trên file PDF có sẵn thay vì PDF tổng hợp")
+    parser.add_argument("--latency", type=float, default=0.5, help="Độ trễ mỗi request giả lập (giây)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Độ lệch ngẫu nhiên ± của độ trễ (giây)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ request lỗi 429/500 (0..1)")
+    parser.add_argument("--max-output-tokens", type=int, default=None,
+                        help="Server giả lập cắt response dài hơn N token (đo việc gọi tiếp bảng bị cắt)")
+    parser.add_argument("--server", default=None,
+                        help="URL server giả lập đang chạy sẵn (mặc định: tự khởi động mock_ai_server.py)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed ngẫu nhiên cho PDF và server giả lập")
+    parser.add_argument("--workers", type=int, default=4, help="Số trang xử lý song song (mặc định: 4)")
+    parser.add_argument("--async", dest="async_mode", action="store_true", help="Chạy chế độ asyncio")
+    parser.add_argument("--in-flight", type=int, default=16, help="Số request đồng thời ở chế độ asyncio")
+    parser.add_argument("--batch-pages", type=int, default=1, help="Gộp tối đa K trang vào 1 request")
+    parser.add_argument("--stream", action="store_true", help="Render trực tiếp, không tạo file trung gian")
+    parser.add_argument("--stream-response", action="store_true", help="Đọc response AI dạng stream")
+    parser.add_argument("--tiles", type=int, default=1, help="Cắt mỗi trang thành tối đa N dải ảnh ngang")
+    parser.add_argument("--render-workers", type=int, default=0, help="Số tiến trình render trước trang")
+    parser.add_argument("--no-text-layer", action="store_true", help="Gửi mọi trang lên AI")
+    parser.add_argument("--rpm", type=int, default=100000, help="Giới hạn request/phút (mặc định: 100000)")
+    parser.add_argument("--tpm", type=int, default=10 ** 9, help="Giới hạn token/phút")
+    parser.add_argument("--output-dir", default="benchmark_results",
+                        help="Thư mục ghi kết quả (mặc định: benchmark_results)")
+    parser.add_argument("--verbose", action="store_true", help="Hiện log của quy trình chuyển đổi")
+    args = parser.parse_args()
+
+    kinds = [k.strip() for k in args.kinds.split(",") if k.strip()]
+    providers = [p.strip() for p in args.providers.split(",") if p.strip()]
+    for name, allowed in ((kinds, KINDS), (providers, PROVIDER_ENV)):
+        unknown = [n for n in name if n not in allowed]
+        if unknown:
+            parser.error(f"Không hỗ trợ: {', '.join(unknown)} (chọn trong: {', '.join(allowed)})")
+
+    options = dict(workers=args.workers, async_mode=args.async_mode, in_flight=args.in_flight,
+                   batch_pages=args.batch_pages, stream=args.stream, use_text_layer=not args.no_text_layer,
+                   rpm=args.rpm, tpm=args.tpm, render_workers=args.render_workers,
+                   stream_response=args.stream_response, tiles=args.tiles)
+    settings = dict(vars(args), kinds=kinds, providers=providers)
+
+    process = None
+    server_url = args.server
+    if server_url is None:
+        process, server_url = start_mock_server(args.latency, args.jitter, args.error_rate, args.seed,
+                                                args.max_output_tokens)
+    point_providers_at(server_url.rstrip("/"))
+    print(f"🧪 Server AI giả lập: {server_url} (độ trễ {args.latency}±{args.jitter}s, "
+          f"lỗi {args.error_rate:.0%})")
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="pdf2excel_bench_pdf_") as pdf_dir:
+            for kind in ([Path(args.pdf).stem] if args.pdf else kinds):
+                with RssSampler() as sampler:
+                    sampler.set_phase("generate")
+                    if args.pdf:
+                        pdf_path = Path(args.pdf)
+                    else:
+                        pdf_path = MAKERS[kind](Path(pdf_dir) / f"{kind}.pdf", args.pages,
+                                                args.rows, args.cols, args.seed)
+                print(f"📄 {kind}: {pdf_path.name} ({pdf_path.stat().st_size / 1024:.0f} KB)")
+                for provider in providers:
+                    print(f"   ⏱️  Đang đo {kind} / {provider}...", flush=True)
+                    result = run_scenario(pdf_path, kind, provider, options, args.verbose)
+                    result["peak_rss_mb"]["generate"] = round(sampler.peaks.get("generate", 0) / 2 ** 20, 1)
+                    results.append(result)
+                    print(f"      {result['pages_done']}/{result['pages']} trang trong {result['seconds']}s "
+                          f"({result['pages_per_second']} trang/s)")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    print_results(results)
+    json_file, csv_file = write_results(results, settings, args.output_dir)
+    print(f"\n📈 Kết quả: {json_file} (.csv)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Ghi file Excel kết quả theo kiểu streaming (openpyxl write-only)
+- Mỗi trang được ghi thẳng thành 1 sheet của file cuối ngay khi có kết quả
+- Không tạo file Excel riêng từng trang rồi đọc lại để ghép
+- Dòng đã ghi được openpyxl đẩy ra file tạm, bộ nhớ không tăng theo số trang
+- Trang đang nhận response stream (--stream-response) được ghi từng hàng nếu đã tới lượt
+"""
+
+import threading
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+
+# Độ rộng cột tối đa khi tự căn theo nội dung
+MAX_COLUMN_WIDTH = 50
+# Số hàng gom trước khi tạo sheet cho trang đang stream (để căn độ rộng cột)
+LIVE_WIDTH_SAMPLE = 20
+
+
+class StreamingWorkbookWriter:
+    """Ghi các trang vào 1 workbook write-only, giữ đúng thứ tự trang.
+
+    Trang xong sớm (khi chạy song song) được giữ tạm tới khi các trang trước
+    nó xong, nên chỉ khoảng `workers` bảng nằm trong bộ nhớ cùng lúc.
+    """
+
+    def __init__(self, output_file, page_numbers):
+        self.output_file = output_file
+        self.workbook = Workbook(write_only=True)
+        self.lock = threading.Lock()
+        self.order = list(page_numbers)
+        self.position = 0
+        # {số trang: bảng hoặc None (trang lỗi)} chờ tới lượt ghi
+        self.pending = {}
+        # {số trang: [sheet, số hàng đã ghi]} của trang đang được ghi dần theo stream
+        self.live = {}
+        self.sheet_count = 0
+        self.bold_font = Font(bold=True)
+
+    def add_page(self, page_number, data):
+        """Nhận kết quả 1 trang (None = trang lỗi, bỏ qua) và ghi các trang đã tới lượt"""
+        with self.lock:
+            self.pending[page_number] = data
+            while self.position < len(self.order) and self.order[self.position] in self.pending:
+                page = self.order[self.position]
+                self._write_sheet(page, self.pending.pop(page))
+                self.position += 1
+
+    def stream_rows(self, page_number, headers, rows):
+        """Ghi ngay các hàng mới của trang đang nhận response stream, nếu trang đã tới lượt ghi.
+
+        `rows` là danh sách mọi hàng đã nhận (cộng dồn). Trang chưa tới lượt thì không làm gì:
+        các hàng sẽ được ghi khi add_page nhận bảng đầy đủ.
+        """
+        with self.lock:
+            if self.position >= len(self.order) or self.order[self.position] != page_number:
+                return
+            live = self.live.get(page_number)
+            if live is None:
+                if headers is None or len(rows) < LIVE_WIDTH_SAMPLE:
+                    return
+                live = self.live[page_number] = [self._create_sheet(page_number, headers, rows), 0]
+            self._append_rows(live, rows)
+
+    def _write_sheet(self, page_number, data):
+        live = self.live.pop(page_number, None)
+        if data is None and live is None:
+            return
+        rows = (data or {}).get("rows") or []
+        if live is None:
+            live = [self._create_sheet(page_number, data.get("headers"), rows), 0]
+        elif data is None:
+            print(f"  ⚠️  Trang {page_number} lỗi giữa chừng: sheet chỉ có {live[1]} hàng đã nhận")
+        self._append_rows(live, rows)
+        self.sheet_count += 1
+        print(f"  📑 Đã ghi sheet 'Trang {page_number}' ({live[1]} hàng)")
+
+    def _append_rows(self, live, rows):
+        """Ghi các hàng từ vị trí đã ghi tới cuối `rows` vào sheet"""
+        ws, written = live
+        for row in rows[written:]:
+            ws.append(row if isinstance(row, list) else [str(row)])
+        live[1] = max(written, len(rows))
+
+    def _create_sheet(self, page_number, headers, rows):
+        """Tạo sheet của trang, căn độ rộng cột theo `rows` và ghi dòng header"""
+        if not headers:
+            headers = [f"Trang {page_number}"]
+        elif not isinstance(headers, list):
+            headers = [str(headers)]
+        rows = [row if isinstance(row, list) else [str(row)] for row in rows]
+
+        ws = self.workbook.create_sheet(title=f"Trang {page_number}")
+
+        # Write-only: độ rộng cột phải đặt trước khi ghi dòng đầu tiên
+        widths = {}
+        for row in [headers] + rows:
+            for col, value in enumerate(row, 1):
+                if value:
+                    widths[col] = max(widths.get(col, 0), len(str(value)))
+        for col, width in widths.items():
+            ws.column_dimensions[get_column_letter(col)].width = min(width + 2, MAX_COLUMN_WIDTH)
+
+        # Header in đậm
+        header_cells = []
+        for value in headers:
+            cell = WriteOnlyCell(ws, value=value)
+            cell.font = self.bold_font
+            header_cells.append(cell)
+        ws.append(header_cells)
+        return ws
+
+    def close(self):
+        """Ghi nốt các trang còn chờ (bỏ qua trang không bao giờ tới) và lưu file.
+
+        Trả về đường dẫn file, hoặc None nếu không có sheet nào.
+        """
+        with self.lock:
+            for page in sorted(set(self.pending) | set(self.live)):
+                self._write_sheet(page, self.pending.get(page))
+            self.pending.clear()
+            if not self.sheet_count:
+                return None
+            self.workbook.save(self.output_file)
+            return self.output_file
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Server giả lập API job batch để chạy thử --batch-submit không cần mạng/API key
+- Claude Message Batches: POST /v1/messages/batches, GET /v1/messages/batches/{id}[/results]
+- Gemini batch: POST /v1beta/models/{model}:batchGenerateContent, GET /v1beta/batches/{id}
+- Job kết thúc sau `--delay` giây; bảng trả về xác định theo nội dung ảnh của từng request
+
+Cách dùng:
+    python fake_batch_server.py --port 8765 --delay 5
+    CLAUDE_API_URL=http://127.0.0.1:8765/v1/messages CLAUDE_API_KEY=test \\
+        python pipeline.py input.pdf --batch-submit --batch-poll 2
+    GEMINI_API_URL=http://127.0.0.1:8765 GEMINI_API_KEY=test \\
+        python pipeline.py input.pdf --provider gemini --batch-submit --batch-poll 2
+"""
+
+import re
+import gzip
+import json
+import time
+import uuid
+import base64
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def fake_table(img_bytes, rows=5, cols=4):
+    """Bảng giả lập xác định theo nội dung ảnh (cùng ảnh → cùng bảng)"""
+    digest = hashlib.sha256(img_bytes).hexdigest()[:8]
+    return {
+        "headers": [f"Cột {c + 1}" for c in range(cols)],
+        "rows": [[f"{digest}-{r + 1}.{c + 1}" for c in range(cols)] for r in range(rows)]
+    }
+
+
+def _decode_base64(data):
+    # Gemini SDK có thể gửi base64 dạng URL-safe
+    return base64.b64decode(data.replace("-", "+").replace("_", "/") + "=" * (-len(data) % 4))
+
+
+class FakeBatchServer(ThreadingHTTPServer):
+    """Server HTTP giữ các job batch trong bộ nhớ (mất khi tắt server)"""
+
+    daemon_threads = True
+
+    def __init__(self, address, delay=5.0, error_every=0):
+        super().__init__(address, FakeBatchHandler)
+        self.delay = delay
+        # Cứ mỗi `error_every` request thì 1 request lỗi (0 = không lỗi)
+        self.error_every = error_every
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def add_job(self, images, **info):
+        """Tạo job từ danh sách ảnh (None = request không có ảnh) kèm thông tin riêng của API; trả về id"""
+        results = []
+        for i, img_bytes in enumerate(images, 1):
+            if img_bytes is None or (self.error_every and i % self.error_every == 0):
+                results.append(None)
+            else:
+                results.append(json.dumps(fake_table(img_bytes), ensure_ascii=False))
+        job_id = uuid.uuid4().hex[:16]
+        with self.lock:
+            self.jobs[job_id] = dict(info, created=time.time(), results=results)
+        return job_id
+
+    def get_job(self, job_id):
+        """Trả về (job, đã xong chưa) hoặc (None, False) nếu không có job"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None, False
+        return job, time.time() - job["created"] >= self.delay
+
+
+class FakeBatchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return json.loads(body or b"{}")
+
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, data):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+    def _not_found(self):
+        self._send_json(404, {"error": {"code": 404, "message": f"Không tìm thấy: {self.path}"}})
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        body = self._read_json()
+        if path == "/v1/messages/batches":
+            self._claude_create(body)
+        elif re.fullmatch(r"/v1beta/models/[^/:]+:batchGenerateContent", path):
+            self._gemini_create(body)
+        else:
+            self._not_found()
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        match = re.fullmatch(r"/v1/messages/batches/(\w+)(/results)?", path)
+        if match:
+            return self._claude_get(match.group(1), results=bool(match.group(2)))
+        match = re.fullmatch(r"/v1beta/batches/(\w+)", path)
+        if match:
+            return self._gemini_get(match.group(1))
+        self._not_found()
+
+    # --- Claude Message Batches ---
+
+    def _claude_create(self, body):
+        requests = body.get("requests", [])
+        images = []
+        for request in requests:
+            blocks = request["params"]["messages"][0]["content"]
+            data = next((b["source"]["data"] for b in blocks if b.get("type") == "image"), None)
+            images.append(_decode_base64(data) if data else None)
+        job_id = self.server.add_job(images, custom_ids=[request["custom_id"] for request in requests])
+        self._claude_get(job_id)
+
+    def _claude_get(self, job_id, results=False):
+        job, done = self.server.get_job(job_id)
+        if job is None:
+            return self._not_found()
+        if results:
+            if not done:
+                return self._send_json(400, {"error": {"message": "Batch chưa kết thúc"}})
+            lines = []
+            for custom_id, text in zip(job["custom_ids"], job["results"]):
+                if text is None:
+                    result = {"type": "errored", "error": {"type": "error", "error": {
+                        "type": "invalid_request_error", "message": "Lỗi giả lập"}}}
+                else:
+                    result = {"type": "succeeded", "message": {
+                        "type": "message", "role": "assistant", "stop_reason": "end_turn",
+                        "content": [{"type": "text", "text": text}],
+                        "usage": {"input_tokens": 1000, "output_tokens": len(text) // 4}}}
+                lines.append(json.dumps({"custom_id": custom_id, "result": result}, ensure_ascii=False))
+            return self._send(200, "\n".join(lines).encode("utf-8"), "application/binary")
+
+        total = len(job["results"])
+        errored = sum(1 for text in job["results"] if text is None) if done else 0
+        self._send_json(200, {
+            "id": job_id,
+            "type": "message_batch",
+            "processing_status": "ended" if done else "in_progress",
+            "request_counts": {
+                "processing": 0 if done else total,
+                "succeeded": total - errored if done else 0,
+                "errored": errored,
+                "canceled": 0,
+                "expired": 0
+            },
+            "created_at": datetime.fromtimestamp(job["created"], timezone.utc).isoformat(),
+            "results_url": f"http://{self.headers['Host']}/v1/messages/batches/{job_id}/results" if done else None
+        })
+
+    # --- Gemini batch ---
+
+    def _gemini_create(self, body):
+        requests = body["batch"]["inputConfig"]["requests"]["requests"]
+        images = []
+        for request in requests:
+            parts = [part for content in request["request"]["contents"] for part in content.get("parts", [])]
+            data = next((p["inlineData"]["data"] for p in parts if "inlineData" in p), None)
+            images.append(_decode_base64(data) if data else None)
+        job_id = self.server.add_job(images, metadata=[request.get("metadata") for request in requests])
+        self._gemini_get(job_id)
+
+    def _gemini_get(self, job_id):
+        job, done = self.server.get_job(job_id)
+        if job is None:
+            return self._not_found()
+        metadata = {"name": f"batches/{job_id}", "displayName": "fake-batch",
+                    "state": "BATCH_STATE_SUCCEEDED" if done else "BATCH_STATE_RUNNING"}
+        if done:
+            responses = []
+            for text, request_metadata in zip(job["results"], job["metadata"]):
+                if text is None:
+                    item = {"error": {"code": 400, "message": "Lỗi giả lập"}}
+                else:
+                    item = {"response": {
+                        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                                        "finishReason": "STOP"}],
+                        "usageMetadata": {"totalTokenCount": 258 + len(text) // 4}}}
+                if request_metadata:
+                    item["metadata"] = request_metadata
+                responses.append(item)
+            metadata["output"] = {"inlinedResponses": {"inlinedResponses": responses}}
+        self._send_json(200, {"name": f"batches/{job_id}", "metadata": metadata, "done": done})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server giả lập API job batch (Claude, Gemini)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=5.0,
+                        help="Số giây từ lúc gửi tới lúc job kết thúc (mặc định: 5)")
+    parser.add_argument("--error-every", type=int, default=0,
+                        help="Cứ N request thì 1 request lỗi (mặc định: 0 - không lỗi)")
+    args = parser.parse_args()
+
+    server = FakeBatchServer((args.host, args.port), delay=args.delay, error_every=args.error_every)
+    print(f"🧪 Server job batch giả lập: http://{args.host}:{args.port}")
+    print(f"   Claude: CLAUDE_API_URL=http://{args.host}:{args.port}/v1/messages")
+    print(f"   Gemini: GEMINI_API_URL=http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹️  Đã dừng server")
+
+
+if __name__ == "__main__":
+    main()
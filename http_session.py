@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Session HTTP dùng chung cho các provider gọi API qua requests
+- Pool kết nối keep-alive (không bắt tay TCP+TLS lại cho mỗi trang)
+- Timeout kết nối/đọc cho mọi request, tránh socket treo làm đứng cả job
+- Tùy chọn nén gzip thân request (payload base64 của ảnh khá lớn)
+- Bản async dùng httpx.AsyncClient cho chế độ --async
+- Đọc response stream dạng Server-Sent Events (--stream-response)
+"""
+
+import gzip
+import json
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Timeout mặc định (giây): thời gian chờ kết nối, thời gian chờ đọc response
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 120
+# Mức nén gzip: ưu tiên tốc độ, ảnh đã nén nên nén thêm chỉ lợi ở phần base64
+GZIP_LEVEL = 5
+
+
+def create_session(pool_size=10):
+    """requests.Session với pool `pool_size` kết nối giữ sống tới mỗi host"""
+    session = requests.Session()
+    # pool_block: khi mọi kết nối đang bận thì chờ, không mở thêm kết nối ngoài pool
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+
+def create_async_client(pool_size=10, timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)):
+    """httpx.AsyncClient với pool `pool_size` kết nối; phải tạo và đóng trong cùng event loop"""
+    import httpx
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+    return httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(timeout[1], connect=timeout[0]))
+
+
+def _encode_body(headers, payload, gzip_body):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = dict(headers, **{"Content-Type": "application/json"})
+    if gzip_body:
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return headers, body
+
+
+def post_json(session, url, headers, payload, timeout, gzip_body=False, stream=False):
+    """POST payload JSON qua session; nén gzip thân request nếu `gzip_body`.
+
+    `stream=True`: trả về ngay khi có header, thân response đọc dần (người gọi phải đọc hết hoặc close()).
+    """
+    headers, body = _encode_body(headers, payload, gzip_body)
+    return session.post(url, data=body, headers=headers, timeout=timeout, stream=stream)
+
+
+async def post_json_async(client, url, headers, payload, gzip_body=False, stream=False):
+    """Bản async của post_json qua httpx.AsyncClient (timeout đặt sẵn trên client)"""
+    headers, body = _encode_body(headers, payload, gzip_body)
+    request = client.build_request("POST", url, content=body, headers=headers)
+    return await client.send(request, stream=stream)
+
+
+def _sse_line(line, event, data):
+    """Xử lý 1 dòng SSE; trả về (event, data) mới, hoặc None khi gặp dòng trống kết thúc 1 event"""
+    if not line:
+        return None
+    if line.startswith("event:"):
+        event = line[6:].strip()
+    elif line.startswith("data:"):
+        data.append(line[5:].lstrip())
+    return event, data
+
+
+def iter_sse(lines):
+    """Sinh (tên event hoặc None, data) từ các dòng text của response Server-Sent Events"""
+    event, data = None, []
+    for line in lines:
+        state = _sse_line(line, event, data)
+        if state is None:
+            if data:
+                yield event, "\n".join(data)
+            event, data = None, []
+        else:
+            event, data = state
+    if data:
+        yield event, "\n".join(data)
+
+
+async def aiter_sse(lines):
+    """Bản async của iter_sse (các dòng từ httpx Response.aiter_lines())"""
+    event, data = None, []
+    async for line in lines:
+        state = _sse_line(line, event, data)
+        if state is None:
+            if data:
+                yield event, "\n".join(data)
+            event, data = None, []
+        else:
+            event, data = state
+    if data:
+        yield event, "\n".join(data)
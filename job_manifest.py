@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Manifest theo dõi tiến độ xử lý từng trang để có thể chạy tiếp (--resume)
+Mỗi trang lưu: hash nội dung trang, trạng thái, file output, số lần thử
+Kèm danh sách job batch (--batch-submit) đang chờ kết quả
+"""
+
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from datetime import datetime
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 của nội dung file"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_bytes(data):
+    """SHA-256 của dữ liệu trong bộ nhớ (vd. ảnh trang ở chế độ --stream)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_image(image, strip_rows=256):
+    """SHA-256 điểm ảnh của ảnh PIL, bằng hash_bytes(image.tobytes()) nhưng đọc theo dải ngang
+    để không tạo thêm 1 bản sao cả ảnh trong bộ nhớ"""
+    h = hashlib.sha256()
+    width, height = image.size
+    for top in range(0, height, strip_rows):
+        h.update(image.crop((0, top, width, min(top + strip_rows, height))).tobytes())
+    return h.hexdigest()
+
+
+class JobManifest:
+    """Manifest JSON của một lần chuyển đổi, ghi lại sau mỗi thay đổi trạng thái"""
+
+    def __init__(self, path, input_pdf, resume=False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.source_hash = hash_file(input_pdf)
+        self.data = None
+
+        if resume and self.path.exists():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("source_hash") == self.source_hash:
+                    self.data = data
+                else:
+                    print("⚠️  File PDF đã thay đổi so với lần chạy trước, bắt đầu lại từ đầu")
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Không đọc được manifest cũ ({e}), bắt đầu lại từ đầu")
+
+        if self.data is None:
+            self.data = {
+                "source": str(input_pdf),
+                "source_hash": self.source_hash,
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "pages": {}
+            }
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def completed_output(self, page_number, page_hash):
+        """Trả về file output nếu trang đã xử lý xong và file vẫn còn, ngược lại None"""
+        with self.lock:
+            entry = self.data["pages"].get(str(page_number))
+        if not entry or entry["status"] != STATUS_DONE or entry["page_hash"] != page_hash:
+            return None
+        output = Path(entry["output"]) if entry.get("output") else None
+        return output if output and output.exists() else None
+
+    def mark_started(self, page_number, page_hash):
+        with self.lock:
+            entry = self.data["pages"].setdefault(str(page_number), {"attempts": 0})
+            entry.update({
+                "page_hash": page_hash,
+                "status": STATUS_PENDING,
+                "output": None,
+                "attempts": entry.get("attempts", 0) + 1
+            })
+            self._save()
+
+    def mark_finished(self, page_number, output_file, method=None, complete=True):
+        """Ghi nhận kết quả (có file output = done, None = failed) và cách xử lý: text/ai.
+
+        `complete`=False: bảng chỉ có 1 phần (bị cắt, gọi tiếp không đủ) - giữ file output nhưng
+        tính là failed để --resume xử lý lại.
+        """
+        with self.lock:
+            entry = self.data["pages"][str(page_number)]
+            entry["status"] = STATUS_DONE if output_file and complete else STATUS_FAILED
+            entry["output"] = str(output_file) if output_file else None
+            entry["method"] = method
+            if output_file and not complete:
+                entry["partial"] = True
+            else:
+                entry.pop("partial", None)
+            self._save()
+
+    def add_batch_job(self, provider, job_id, pages, cache_keys=None):
+        """Ghi nhận job batch đã gửi (--batch-submit) để lần chạy sau tiếp tục chờ thay vì gửi lại;
+        `cache_keys` {trang: key cache} để kết quả lấy ở lần chạy sau vẫn được cache"""
+        keys = {str(page): key for page, key in (cache_keys or {}).items() if page in pages and key}
+        with self.lock:
+            self.data.setdefault("batch_jobs", []).append(
+                {"provider": provider, "id": job_id, "pages": list(pages), "cache_keys": keys}
+            )
+            self._save()
+
+    def batch_jobs(self, provider):
+        """Các job batch của provider chưa lấy kết quả"""
+        with self.lock:
+            return [dict(job) for job in self.data.get("batch_jobs", []) if job["provider"] == provider]
+
+    def remove_batch_job(self, job_id):
+        with self.lock:
+            self.data["batch_jobs"] = [job for job in self.data.get("batch_jobs", []) if job["id"] != job_id]
+            self._save()
+
+    def summary(self, page_numbers=None):
+        """Đếm số trang theo trạng thái (chỉ trong `page_numbers` nếu có)"""
+        if page_numbers is not None:
+            page_numbers = set(page_numbers)
+        with self.lock:
+            counts = {STATUS_PENDING: 0, STATUS_DONE: 0, STATUS_FAILED: 0}
+            for page, entry in self.data["pages"].items():
+                if page_numbers is None or int(page) in page_numbers:
+                    counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+            return counts
+
+    def all_done(self, page_numbers):
+        """Mọi trang trong `page_numbers` đã xử lý xong?"""
+        with self.lock:
+            pages = self.data["pages"]
+            return all(pages.get(str(page), {}).get("status") == STATUS_DONE for page in page_numbers)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Kiểm tra và đo tốc độ bước đọc JSON bảng từ response của model (json_stream.extract_json)
+- Kiểm tra bộ response lỗi mẫu trong fixtures/malformed_responses (expected.json ghi kết quả đúng)
+- Đo thời gian trên response giả lớn (mặc định 0.25-4 MB): JSON sạch, JSON có lỗi model hay mắc,
+  JSON bị cắt giữa chừng; so với cách cũ (regex tham lam + sửa lỗi bằng thay thế chuỗi)
+- Thời gian/MB gần như không đổi khi response lớn dần = quét tuyến tính
+
+Cách dùng:
+    python json_benchmark.py
+    python json_benchmark.py --sizes 1,4,16 --repeat 5 --output json_benchmark.json
+    python json_benchmark.py --check-only
+"""
+
+import gc
+import re
+import sys
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+
+from json_stream import TableStreamParser, extract_json
+
+FIXTURES = Path(__file__).parent / "fixtures" / "malformed_responses"
+KINDS = ("clean", "dirty", "truncated")
+KIND_LABELS = {"clean": "sạch", "dirty": "có lỗi", "truncated": "bị cắt"}
+
+
+def legacy_extract(content, opening="{"):
+    """Cách đọc JSON cũ của pipeline (giữ lại để so sánh): regex tham lam lấy từ dấu ngoặc mở đầu
+    tiên tới dấu đóng cuối cùng, bỏ markdown, json.loads; lỗi thì thay thế chuỗi rồi thử lại"""
+    pattern = r'\{.*\}' if opening == "{" else r'\[.*\]'
+    json_match = re.search(pattern, content.strip(), re.DOTALL)
+    if not json_match:
+        return None
+    json_str = json_match.group().strip()
+    json_str = re.sub(r'^```json\s*', '', json_str)
+    json_str = re.sub(r'^```\s*', '', json_str)
+    json_str = re.sub(r'\s*```$', '', json_str)
+    try:
+        return json.loads(json_str)
+    except json.JSONDecodeError:
+        pass
+    try:
+        json_str = json_str.replace('\n', '\\n').replace('\t', '\\t').replace('\r', '\\r')
+        json_str = re.sub(r'([{,]\s*)([a-zA-Z_][a-zA-Z0-9_]*)(\s*:)', r'\1"\2"\3', json_str)
+        json_str = json_str.replace("'", '"')
+        json_str = re.sub(r',\s*}', '}', json_str)
+        json_str = re.sub(r',\s*]', ']', json_str)
+        return json.loads(json_str)
+    except json.JSONDecodeError:
+        return None
+
+
+def check_fixtures(directory=FIXTURES):
+    """Chạy extract_json (và cách cũ) trên bộ response mẫu, trả về số mẫu extract_json đọc sai"""
+    cases = json.loads((directory / "expected.json").read_text(encoding="utf-8"))
+    failures = legacy_ok = 0
+    print(f"📂 Response mẫu: {directory} ({len(cases)} mẫu)")
+    for case in cases:
+        text = (directory / case["file"]).read_text(encoding="utf-8")
+        result = extract_json(text, case["opening"])
+        ok = result == case["expected"]
+        note = ""
+        if "salvaged_rows" in case:
+            parser = TableStreamParser()
+            parser.feed(text)
+            ok = ok and len(parser.rows) == case["salvaged_rows"]
+            note = f" (giữ lại {len(parser.rows)} hàng đã đủ)"
+        legacy = legacy_extract(text, case["opening"]) == case["expected"]
+        failures += not ok
+        legacy_ok += legacy
+        print(f"  {'✅' if ok else '❌'} {case['file']:<28} cách cũ: {'đúng' if legacy else 'sai'}{note}")
+    print(f"  → extract_json đúng {len(cases) - failures}/{len(cases)}, cách cũ đúng {legacy_ok}/{len(cases)}")
+    return failures
+
+
+def make_response(size, kind, seed=0):
+    """Response giả dài khoảng `size` byte: câu dẫn + khối ```json bảng``` + ghi chú.
+
+    dirty: rải rác (vài chục hàng 1 lỗi) dấu phẩy thừa, chuỗi nháy đơn, tên riêng có dấu '
+    và xuống dòng trong ô;
+    truncated: bảng sạch bị cắt giữa 1 hàng (như khi hết max_tokens).
+    """
+    rng = random.Random(seed)
+    lines = []
+    length = 0
+    while length < size:
+        number = len(lines) + 1
+        cells = [f'"{number}"', f'"Mã {rng.randint(0, 99999):05d}"', f'"{rng.randint(0, 999999):,}"']
+        if kind == "dirty" and number % 37 == 0:
+            cells[1] = "'Hàng \"nhập\" khẩu'"
+        if kind == "dirty" and number % 53 == 0:
+            cells[1] = '"Công ty O\'Brien\nchi nhánh 2"'
+        line = "    [" + ", ".join(cells) + ("," if kind == "dirty" and number % 29 == 0 else "") + "]"
+        lines.append(line)
+        length += len(line.encode("utf-8")) + 2
+    body = '{\n  "headers": ["STT", "Mã hàng", "Số tiền"],\n  "rows": [\n' + ",\n".join(lines)
+    body += (",\n  ],\n}" if kind == "dirty" else "\n  ]\n}")
+    text = f"Dưới đây là bảng [trang 1]:\n```json\n{body}\n```\nGhi chú: số tiền giữ nguyên định dạng."
+    if kind == "truncated":
+        text = body[:len(body) - len(lines[-1]) // 2]
+    return text, len(lines)
+
+
+def best_time(fn, text, repeat):
+    """Thời gian nhanh nhất trong `repeat` lần chạy fn(text), tắt gc trong lúc đo (như timeit)"""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            fn(text)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_benchmark(sizes, repeat, seed=0):
+    """Đo extract_json và cách cũ trên từng kích thước/loại response, trả về danh sách kết quả"""
+    results = []
+    print(f"\n⏱️  {'Loại':<8} {'MB':>6} {'Hàng':>8} {'extract_json':>14} {'MB/s':>8} {'Cách cũ':>10} {'MB/s':>8}"
+          f"  Đúng (mới/cũ)")
+    for kind in KINDS:
+        for size_mb in sizes:
+            text, rows = make_response(int(size_mb * 1024 * 1024), kind, seed)
+            mb = len(text.encode("utf-8")) / (1024 * 1024)
+            value, legacy = extract_json(text, "{"), legacy_extract(text)
+            correct = value is None if kind == "truncated" else len(value["rows"]) == rows
+            legacy_correct = legacy == value
+            new = best_time(lambda t: extract_json(t, "{"), text, repeat)
+            old = best_time(legacy_extract, text, repeat)
+            results.append({"kind": kind, "mb": round(mb, 3), "rows": rows,
+                            "correct": correct, "legacy_correct": legacy_correct,
+                            "extract_json_seconds": round(new, 6), "legacy_seconds": round(old, 6)})
+            print(f"   {KIND_LABELS[kind]:<8} {mb:>6.2f} {rows:>8} {new:>13.4f}s {mb / new:>8.1f} "
+                  f"{old:>9.4f}s {mb / old:>8.1f}  {'✅' if correct else '❌'}/{'✅' if legacy_correct else '❌'}")
+    for kind in KINDS:
+        runs = [r for r in results if r["kind"] == kind]
+        if len(runs) > 1:
+            first, last = runs[0], runs[-1]
+            scale = (last["extract_json_seconds"] / last["mb"]) / (first["extract_json_seconds"] / first["mb"])
+            print(f"   📈 {KIND_LABELS[kind]}: thời gian/MB ở {last['mb']:.2f} MB gấp {scale:.2f} lần "
+                  f"ở {first['mb']:.2f} MB (≈1 = tuyến tính)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm tra và đo tốc độ đọc JSON bảng từ response của model")
+    parser.add_argument("--sizes", default="0.25,0.5,1,2,4",
+                        help="Kích thước response giả (MB), phân cách bằng dấu phẩy (mặc định: 0.25,0.5,1,2,4)")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần đo mỗi mục, lấy lần nhanh nhất (mặc định: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed sinh dữ liệu giả (mặc định: 0)")
+    parser.add_argument("--fixtures", default=str(FIXTURES), help="Thư mục response mẫu có expected.json")
+    parser.add_argument("--check-only", action="store_true", help="Chỉ kiểm tra response mẫu, không đo tốc độ")
+    parser.add_argument("--output", help="Ghi kết quả đo ra file JSON")
+    args = parser.parse_args()
+
+    failures = check_fixtures(Path(args.fixtures))
+    if not args.check_only:
+        sizes = [float(s) for s in args.sizes.split(",") if s.strip()]
+        results = run_benchmark(sizes, max(1, args.repeat), args.seed)
+        if args.output:
+            Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+            print(f"\n💾 Đã ghi kết quả: {args.output}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Đọc JSON bảng {"headers": [...], "rows": [[...], ...]} từ text model trả về
+- TableStreamParser: parse dần response stream, hàng nào đóng ngoặc xong là dùng được ngay
+  (ghi Excel sớm); response bị cắt giữa chừng (hết max_tokens) vẫn còn các hàng đã đủ
+- extract_json: tìm và parse giá trị JSON đầu tiên trong cả response, sửa các lỗi model hay mắc
+  (dấu phẩy thừa, key không có ngoặc kép, chuỗi nháy đơn, xuống dòng trong chuỗi...)
+- Cả hai bỏ qua text/markdown trước dấu ngoặc mở đầu, quét 1 lượt (thời gian tuyến tính theo độ dài)
+"""
+
+import re
+import json
+
+# Ký tự cấu trúc của JSON (ngoài chuỗi) và ký tự cần xét bên trong chuỗi
+_STRUCTURAL = re.compile(r'[][{}",:]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SINGLE_STRING_SPECIAL = re.compile(r"['\\]")
+# Token extract_json cần xét ngoài chuỗi: chuỗi nháy kép hợp lệ / cả hàng phẳng gồm chuỗi hợp lệ
+# và số (bỏ qua luôn 1 lần), dấu phẩy thừa trước ] hoặc }, ngoặc, dấu nháy còn lại,
+# từ (key không ngoặc kép, True/None...)
+_JSON_STRING = r'"[^"\\\x00-\x1f]*(?:\\.[^"\\\x00-\x1f]*)*"'
+_JSON_SCALAR = rf'(?:{_JSON_STRING}|-?\d[\d.eE+-]*)'
+_TOKEN = re.compile(
+    rf"""({_JSON_STRING}|\[\s*(?:{_JSON_SCALAR}\s*,\s*)*{_JSON_SCALAR}\s*\])|(,)\s*[]}}]|[][{{}}"']|[A-Za-z_$][\w$]*""",
+    re.S,
+)
+_KEY_COLON = re.compile(r"\s*:")
+_CONTROL = re.compile(r"[\x00-\x1f]")
+_UNESCAPED_QUOTE = re.compile(r'(?<!\\)((?:\\\\)*)"')
+# Hằng của Python/JS model hay viết thay cho true/false/null
+_LITERALS = {"True": "true", "False": "false", "None": "null", "undefined": "null"}
+# Số lần thử lại từ dấu ngoặc mở tiếp theo khi giá trị tìm được không parse được / không đúng
+# loại cần tìm (vd. "[1]" trong câu dẫn trước JSON)
+MAX_EXTRACT_ATTEMPTS = 3
+_DECODER = json.JSONDecoder()
+
+
+class TableStreamParser:
+    """Parse dần JSON bảng theo từng đoạn text.
+
+    `headers` có giá trị khi mảng headers đóng ngoặc, `rows` dài thêm mỗi khi
+    1 hàng đóng ngoặc; `complete` = đã đọc hết object bảng.
+    """
+
+    def __init__(self):
+        self.headers = None
+        self.rows = []
+        self.complete = False
+        # Người đọc stream đặt True khi model dừng vì hết max_tokens
+        self.truncated = False
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        # Key hiện tại của object bảng (cấp 1) và trạng thái đang chờ key
+        self._key = None
+        self._expect_key = False
+        self._key_start = None
+        # Vị trí và cấp của giá trị đang thu (cấp 1: mảng headers, cấp 2: 1 hàng)
+        self._value_start = None
+        self._value_depth = None
+
+    def feed(self, text):
+        """Nhận thêm 1 đoạn text, trả về số hàng mới đọc được"""
+        if self.complete:
+            return 0
+        buf = self._buf + text
+        i, n, new_rows = self._pos, len(buf), 0
+        while i < n and not self.complete:
+            if self._in_string:
+                m = _STRING_SPECIAL.search(buf, i)
+                if m is None:
+                    i = n
+                    break
+                if m.group() == "\\":
+                    if m.end() >= n:
+                        # Ký tự escape nằm ở đoạn sau: đọc lại từ dấu \ khi có thêm text
+                        i = m.start()
+                        break
+                    i = m.end() + 1
+                    continue
+                i = m.end()
+                self._in_string = False
+                if self._key_start is not None:
+                    self._key = _loads(buf[self._key_start:i])
+                    self._key_start = None
+                continue
+
+            m = _STRUCTURAL.search(buf, i)
+            if m is None:
+                i = n
+                break
+            c, start, i = m.group(), m.start(), m.end()
+            if self._depth == 0:
+                # Ngoài object bảng: chỉ chờ dấu { mở đầu
+                if c == "{":
+                    self._depth, self._expect_key = 1, True
+                continue
+            if c == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_start = start
+            elif c == ":":
+                if self._depth == 1:
+                    self._expect_key = False
+            elif c == ",":
+                if self._depth == 1:
+                    self._expect_key, self._key = True, None
+            elif c in "[{":
+                if (self._depth == 1 and self._key == "headers") or (self._depth == 2 and self._key == "rows"):
+                    self._value_start, self._value_depth = start, self._depth
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._value_start is not None and self._depth == self._value_depth:
+                    value = _loads(buf[self._value_start:i])
+                    self._value_start = None
+                    if self._depth == 1:
+                        self.headers = value if isinstance(value, list) else None
+                    elif value is not None:
+                        self.rows.append(value)
+                        new_rows += 1
+                elif self._depth == 0:
+                    self.complete = True
+
+        # Bỏ phần text đã xử lý xong, chỉ giữ từ đầu key/giá trị đang đọc dở
+        keep = min(p for p in (self._key_start, self._value_start, i) if p is not None)
+        self._buf = buf[keep:]
+        self._pos = i - keep
+        if self._key_start is not None:
+            self._key_start -= keep
+        if self._value_start is not None:
+            self._value_start -= keep
+        return new_rows
+
+    def table(self):
+        """Bảng đọc được tới lúc này, None nếu chưa có headers lẫn hàng nào"""
+        if self.headers is None and not self.rows:
+            return None
+        return {"headers": self.headers or [], "rows": list(self.rows)}
+
+
+def extract_json(text, opening="{[", accept=None):
+    """Giá trị JSON (object/mảng) đầu tiên trong `text`, bắt đầu bằng 1 ký tự của `opening`
+    (và thỏa `accept(giá trị)` nếu có, vd. đúng là mảng các bảng).
+
+    Vị trí kết thúc tìm theo cân bằng ngoặc (bỏ qua ngoặc trong chuỗi) nên text/markdown
+    trước và sau JSON không ảnh hưởng. JSON đúng chuẩn được parse thẳng bằng bộ parse C của
+    thư viện json; nếu lỗi, quét lại 1 lượt và sửa tại chỗ các lỗi hay gặp: dấu phẩy thừa
+    trước ] hoặc }, key không có ngoặc kép, chuỗi nháy đơn, ký tự điều khiển (xuống dòng, tab)
+    trong chuỗi, True/False/None. Dấu nháy đơn bên trong chuỗi nháy kép (vd. tên riêng có
+    dấu ') được giữ nguyên.
+
+    Trả về None nếu không có JSON hoặc JSON chưa đóng đủ ngoặc (response bị cắt).
+    """
+    start = _find_opening(text, opening, 0)
+    for _ in range(MAX_EXTRACT_ATTEMPTS):
+        if start == -1:
+            return None
+        try:
+            value = _DECODER.raw_decode(text, start)[0]
+        except ValueError as e:
+            # Lỗi ở cuối text = hết text khi chưa đóng ngoặc (bị cắt), sửa lỗi cũng không đóng được
+            fixed = _scan_value(text, start) if getattr(e, "pos", 0) < len(text) else None
+            value = _loads(fixed) if fixed is not None else None
+        if value is not None and (accept is None or accept(value)):
+            return value
+        start = _find_opening(text, opening, start + 1)
+    return None
+
+
+def _find_opening(text, opening, pos):
+    positions = [i for i in (text.find(c, pos) for c in opening) if i != -1]
+    return min(positions) if positions else -1
+
+
+def _scan_value(text, start):
+    """Quét 1 lượt giá trị JSON bắt đầu tại `start`; trả về text đã sửa của giá trị, None nếu chưa đóng"""
+    out = []
+    # Vị trí đầu đoạn text chưa chép sang `out`
+    copied = start
+    depth, pos = 0, start
+    while True:
+        m = _TOKEN.search(text, pos)
+        if m is None:
+            return None
+        token, i, pos = m.group(), m.start(), m.end()
+        if m.group(1) is not None:
+            # Chuỗi / hàng hợp lệ: giữ nguyên
+            continue
+        if m.group(2) is not None:
+            # Dấu phẩy thừa ngay trước dấu đóng ngoặc: bỏ dấu phẩy, xét dấu đóng ngoặc ở lượt sau
+            out.append(text[copied:i])
+            copied, pos = i + 1, pos - 1
+        elif token == '"':
+            # Chuỗi có ký tự điều khiển (hoặc chưa đóng)
+            end = _string_end(text, pos, _STRING_SPECIAL)
+            if end == -1:
+                return None
+            out.append(text[copied:i])
+            out.append(_CONTROL.sub(_escape_control, text[i:end]))
+            copied = pos = end
+        elif token == "'":
+            end = _string_end(text, pos, _SINGLE_STRING_SPECIAL)
+            if end == -1:
+                return None
+            inner = text[pos:end - 1].replace("\\'", "'")
+            out.append(text[copied:i])
+            out.append('"' + _CONTROL.sub(_escape_control, _UNESCAPED_QUOTE.sub(r'\1\\"', inner)) + '"')
+            copied = pos = end
+        elif token in "{[":
+            depth += 1
+        elif token in "}]":
+            depth -= 1
+            if depth == 0:
+                out.append(text[copied:pos])
+                return "".join(out)
+        elif token in _LITERALS:
+            out.append(text[copied:i])
+            out.append(_LITERALS[token])
+            copied = pos
+        elif _KEY_COLON.match(text, pos):
+            # Key không có ngoặc kép
+            out.append(text[copied:i])
+            out.append(f'"{token}"')
+            copied = pos
+
+
+def _string_end(text, pos, special):
+    """Vị trí ngay sau dấu nháy đóng của chuỗi bắt đầu trước `pos`, -1 nếu chuỗi chưa đóng"""
+    while True:
+        m = special.search(text, pos)
+        if m is None:
+            return -1
+        if m.group() == "\\":
+            pos = m.end() + 1
+            continue
+        return m.end()
+
+
+def _escape_control(match):
+    return json.dumps(match.group())[1:-1]
+
+
+def _loads(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Server giả lập API AI (gọi đồng bộ) để đo hiệu năng / chạy thử không cần mạng hay API key
+- Claude: POST /v1/messages
+- DeepSeek: POST /chat/completions
+- Gemini: POST /v1beta/models/{model}:generateContent (:streamGenerateContent?alt=sse khi stream)
+- Request có "stream": true (Claude, DeepSeek) nhận response SSE chia nhiều đoạn trong suốt thời gian trễ
+- Độ trễ mỗi request và tỉ lệ lỗi (429 có Retry-After, 500) cấu hình được
+- --rpm giả lập quota như API thật (token bucket đầy sau 1 phút): vượt quota nhận 429 kèm Retry-After
+- Bảng trả về xác định theo nội dung ảnh; request nhiều ảnh (--batch-pages) nhận {"tables": [...]}
+- Request Claude có tool (structured output) nhận block tool_use thay cho text
+- --max-output-tokens giả lập giới hạn max_tokens: response dài bị cắt (stop reason max_tokens),
+  request gọi tiếp ("Đã nhận được N hàng đầu tiên") nhận các hàng sau hàng N
+
+Cách dùng:
+    python mock_ai_server.py --port 8766 --latency 0.5 --jitter 0.2 --error-rate 0.05
+    CLAUDE_API_URL=http://127.0.0.1:8766/v1/messages CLAUDE_API_KEY=test python pipeline.py input.pdf
+    DEEPSEEK_API_URL=http://127.0.0.1:8766/chat/completions DEEPSEEK_API_KEY=test \\
+        python pipeline.py input.pdf --provider deepseek
+    GEMINI_API_URL=http://127.0.0.1:8766 GEMINI_API_KEY=test python pipeline.py input.pdf --provider gemini
+"""
+
+import re
+import gzip
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import functools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from fake_batch_server import fake_table, _decode_base64
+from rate_limiter import TokenBucket
+
+
+# Số đoạn text của response stream; đoạn đầu tiên tới sau STREAM_FIRST_DELAY phần độ trễ
+STREAM_CHUNKS = 8
+STREAM_FIRST_DELAY = 0.2
+# Số hàng đã nhận trong prompt gọi tiếp bảng bị cắt (CONTINUATION_PROMPT của providers.py)
+CONTINUATION_MARK = re.compile(r"Đã nhận được (\d+) hàng đầu tiên")
+
+
+class MockAIServer(ThreadingHTTPServer):
+    """Server HTTP trả lời theo định dạng của từng nhà cung cấp, có độ trễ và lỗi giả lập"""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.5, jitter=0.0, error_rate=0.0, rows=10, cols=4, seed=None,
+                 max_output_tokens=None, rpm=None, quota_window=60.0):
+        super().__init__(address, MockAIHandler)
+        # Độ trễ mỗi request: latency ± jitter giây (phân bố đều)
+        self.latency = latency
+        self.jitter = jitter
+        # Tỉ lệ request lỗi (0..1), chia đều giữa 429 và 500
+        self.error_rate = error_rate
+        self.rows = rows
+        self.cols = cols
+        # Số token đầu ra tối đa mỗi response (~4 ký tự / token), None = không cắt
+        self.max_output_tokens = max_output_tokens
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "images": 0, "errors": 0, "throttled": 0}
+        # Quota `rpm` request mỗi `quota_window` giây (mặc định 1 phút), nạp lại liên tục như API thật
+        self.quota = TokenBucket(rpm * 60.0 / quota_window, capacity=rpm) if rpm else None
+
+    def throttle(self):
+        """Số giây phải chờ nếu request vượt quota (server trả 429), None nếu còn quota"""
+        if self.quota is None or self.quota.try_acquire():
+            return None
+        with self.lock:
+            self.counts["throttled"] += 1
+        return self.quota.wait_time()
+
+    def next_delay_and_error(self):
+        """Độ trễ và mã lỗi (None = thành công) cho 1 request"""
+        with self.lock:
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            error = None
+            if self.random.random() < self.error_rate:
+                error = self.random.choice((429, 500))
+            return delay, error
+
+    def record(self, images, error):
+        with self.lock:
+            self.counts["requests"] += 1
+            self.counts["images"] += images
+            if error:
+                self.counts["errors"] += 1
+
+
+class MockAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return json.loads(body or b"{}")
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self):
+        """Gửi header của response SSE (chunked, giữ kết nối keep-alive)"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _send_event(self, data, event=None):
+        payload = (f"event: {event}\n" if event else "") + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+        body = payload.encode("utf-8")
+        self.wfile.write(f"{len(body):x}\r\n".encode() + body + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self, final=None):
+        if final is not None:
+            body = f"data: {final}\n\n".encode()
+            self.wfile.write(f"{len(body):x}\r\n".encode() + body + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _stream_text(self, text, delay, send_chunk):
+        """Chia `text` thành STREAM_CHUNKS đoạn, rải đều trong thời gian trễ còn lại sau đoạn đầu"""
+        size = max(1, -(-len(text) // STREAM_CHUNKS))
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        time.sleep(delay * STREAM_FIRST_DELAY)
+        for piece in pieces:
+            send_chunk(piece)
+            time.sleep(delay * (1 - STREAM_FIRST_DELAY) / len(pieces))
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        body = self._read_json()
+        stream = bool(body.get("stream"))
+        if path.endswith("/v1/messages"):
+            content = body["messages"][0]["content"]
+            images = [_decode_base64(block["source"]["data"]) for block in content if block.get("type") == "image"]
+            prompt = " ".join(block.get("text", "") for block in content if block.get("type") == "text")
+            tool = (body.get("tools") or [{}])[0].get("name")
+            respond = functools.partial(self._claude_stream if stream else self._claude_response, tool=tool)
+        elif path.endswith("/chat/completions"):
+            # DeepSeek chỉ nhận text: mỗi trang là 1 đoạn base64 đã cắt ngắn
+            text = prompt = body["messages"][0]["content"]
+            images = [chunk.encode() for chunk in re.findall(r"\(truncated\):\s*(\S+)", text)] or [text.encode()]
+            respond = self._deepseek_stream if stream else self._deepseek_response
+        elif re.fullmatch(r".*/models/[^/:]+:(generateContent|streamGenerateContent)", path):
+            parts = [part for content in body["contents"] for part in content.get("parts", [])]
+            images = [_decode_base64((part.get("inlineData") or part.get("inline_data"))["data"])
+                      for part in parts if "inlineData" in part or "inline_data" in part]
+            prompt = " ".join(part.get("text", "") for part in parts)
+            stream = path.endswith(":streamGenerateContent")
+            respond = self._gemini_stream if stream else self._gemini_response
+        else:
+            return self._send_json(404, {"error": {"code": 404, "message": f"Không tìm thấy: {self.path}"}})
+
+        retry_after = self.server.throttle()
+        if retry_after is not None:
+            self.server.record(len(images), 429)
+            return self._error(429, retry_after)
+        delay, error = self.server.next_delay_and_error()
+        self.server.record(len(images), error)
+        if error:
+            time.sleep(delay)
+            return self._error(error)
+        if not stream:
+            time.sleep(delay)
+        tables = [fake_table(img_bytes, self.server.rows, self.server.cols) for img_bytes in images]
+        continuation = CONTINUATION_MARK.search(prompt)
+        if continuation and len(tables) == 1:
+            tables = [{"headers": [], "rows": tables[0]["rows"][int(continuation.group(1)):]}]
+        if len(tables) == 1:
+            text = json.dumps(tables[0], ensure_ascii=False)
+        else:
+            text = json.dumps({"tables": [dict(table, table_index=i) for i, table in enumerate(tables, 1)]},
+                              ensure_ascii=False)
+        # Token ước tính: ~1 token / 4 ký tự đầu ra, số token ảnh theo từng nhà cung cấp
+        max_tokens = self.server.max_output_tokens
+        truncated = bool(max_tokens) and len(text) // 4 > max_tokens
+        if truncated:
+            text = text[:max_tokens * 4]
+        if stream:
+            respond(text, len(images), len(text) // 4, truncated, delay)
+        else:
+            respond(text, len(images), len(text) // 4, truncated)
+
+    def _error(self, status, retry_after=1):
+        message = "Rate limit giả lập" if status == 429 else "Lỗi server giả lập"
+        # Retry-After là số giây nguyên như API thật
+        headers = {"Retry-After": str(max(1, math.ceil(retry_after)))} if status == 429 else None
+        self._send_json(status, {"error": {"code": status, "message": message,
+                                           "status": "RESOURCE_EXHAUSTED" if status == 429 else "INTERNAL",
+                                           "type": "rate_limit_error" if status == 429 else "api_error"}},
+                        headers)
+
+    def _claude_response(self, text, images, output_tokens, truncated, tool=None):
+        if tool:
+            # Như API thật: input của tool_use bị cắt giữa chừng không giữ lại được
+            block = {"type": "tool_use", "id": "toolu_mock", "name": tool,
+                     "input": {} if truncated else json.loads(text)}
+        else:
+            block = {"type": "text", "text": text}
+        self._send_json(200, {
+            "id": "msg_" + hashlib.sha256(text.encode()).hexdigest()[:16],
+            "type": "message", "role": "assistant",
+            "stop_reason": "max_tokens" if truncated else ("tool_use" if tool else "end_turn"),
+            "content": [block],
+            "usage": {"input_tokens": 1600 * images + 300, "output_tokens": output_tokens}
+        })
+
+    def _deepseek_response(self, text, images, output_tokens, truncated):
+        input_tokens = 250 * images + 300
+        self._send_json(200, {
+            "id": "chatcmpl-mock", "object": "chat.completion",
+            "choices": [{"index": 0, "finish_reason": "length" if truncated else "stop",
+                         "message": {"role": "assistant", "content": text}}],
+            "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                      "total_tokens": input_tokens + output_tokens}
+        })
+
+    def _claude_stream(self, text, images, output_tokens, truncated, delay, tool=None):
+        self._start_stream()
+        self._send_event({"type": "message_start", "message": {
+            "id": "msg_" + hashlib.sha256(text.encode()).hexdigest()[:16], "type": "message", "role": "assistant",
+            "content": [], "usage": {"input_tokens": 1600 * images + 300, "output_tokens": 1}}}, "message_start")
+        if tool:
+            # Input của tool_use được stream dần dạng JSON (input_json_delta)
+            block = {"type": "tool_use", "id": "toolu_mock", "name": tool, "input": {}}
+            delta = lambda piece: {"type": "input_json_delta", "partial_json": piece}
+        else:
+            block = {"type": "text", "text": ""}
+            delta = lambda piece: {"type": "text_delta", "text": piece}
+        self._send_event({"type": "content_block_start", "index": 0, "content_block": block}, "content_block_start")
+        self._stream_text(text, delay, lambda piece: self._send_event(
+            {"type": "content_block_delta", "index": 0, "delta": delta(piece)}, "content_block_delta"))
+        self._send_event({"type": "content_block_stop", "index": 0}, "content_block_stop")
+        stop_reason = "max_tokens" if truncated else ("tool_use" if tool else "end_turn")
+        self._send_event({"type": "message_delta", "delta": {"stop_reason": stop_reason},
+                          "usage": {"output_tokens": output_tokens}}, "message_delta")
+        self._send_event({"type": "message_stop"}, "message_stop")
+        self._end_stream()
+
+    def _deepseek_stream(self, text, images, output_tokens, truncated, delay):
+        input_tokens = 250 * images + 300
+        self._start_stream()
+        self._stream_text(text, delay, lambda piece: self._send_event(
+            {"id": "chatcmpl-mock", "object": "chat.completion.chunk",
+             "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}))
+        self._send_event({"id": "chatcmpl-mock", "object": "chat.completion.chunk",
+                          "choices": [{"index": 0, "delta": {},
+                                       "finish_reason": "length" if truncated else "stop"}]})
+        self._send_event({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "choices": [],
+                          "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                                    "total_tokens": input_tokens + output_tokens}})
+        self._end_stream("[DONE]")
+
+    def _gemini_stream(self, text, images, output_tokens, truncated, delay):
+        input_tokens = 258 * images + 300
+        self._start_stream()
+        self._stream_text(text, delay, lambda piece: self._send_event(
+            {"candidates": [{"content": {"role": "model", "parts": [{"text": piece}]}}]}))
+        self._send_event({
+            "candidates": [{"content": {"role": "model", "parts": [{"text": ""}]},
+                            "finishReason": "MAX_TOKENS" if truncated else "STOP"}],
+            "usageMetadata": {"promptTokenCount": input_tokens, "candidatesTokenCount": output_tokens,
+                              "totalTokenCount": input_tokens + output_tokens}
+        })
+        self._end_stream()
+
+    def _gemini_response(self, text, images, output_tokens, truncated):
+        input_tokens = 258 * images + 300
+        self._send_json(200, {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                            "finishReason": "MAX_TOKENS" if truncated else "STOP"}],
+            "usageMetadata": {"promptTokenCount": input_tokens, "candidatesTokenCount": output_tokens,
+                              "totalTokenCount": input_tokens + output_tokens}
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server giả lập API AI (Claude, DeepSeek, Gemini)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.5, help="Độ trễ mỗi request (giây, mặc định: 0.5)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Độ lệch ngẫu nhiên ± của độ trễ (giây)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Tỉ lệ request lỗi 429/500 (0..1, mặc định: 0)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed ngẫu nhiên (để lặp lại được)")
+    parser.add_argument("--rows", type=int, default=10, help="Số hàng mỗi bảng trả về (mặc định: 10)")
+    parser.add_argument("--cols", type=int, default=4, help="Số cột mỗi bảng trả về (mặc định: 4)")
+    parser.add_argument("--max-output-tokens", type=int, default=None,
+                        help="Cắt response dài hơn N token như khi model hết max_tokens (mặc định: không cắt)")
+    parser.add_argument("--rpm", type=int, default=None,
+                        help="Quota số request/phút, vượt quota trả 429 kèm Retry-After (mặc định: không giới hạn)")
+    args = parser.parse_args()
+
+    server = MockAIServer((args.host, args.port), latency=args.latency, jitter=args.jitter,
+                          error_rate=args.error_rate, rows=args.rows, cols=args.cols, seed=args.seed,
+                          max_output_tokens=args.max_output_tokens, rpm=args.rpm)
+    print(f"🧪 Server AI giả lập: http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹️  Đã dừng server")
+
+
+if __name__ == "__main__":
+    main()
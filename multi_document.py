@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Chế độ nhiều tài liệu: xử lý cả thư mục / glob / danh sách file PDF trong 1 lần chạy
+- Một tiến trình, một bộ client/pool kết nối, rate limiter và cache cho mọi file
+- Trang của nhiều file được đưa vào chung 1 pool luồng theo vòng tròn,
+  file lớn không chiếm hết pool khiến các file nhỏ phải chờ
+- Mỗi file có 1 thư mục output riêng (file Excel kết quả, manifest, thư mục tạm)
+"""
+
+import glob
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+from pipeline import PDFToExcelConverter
+from run_metrics import RunMetrics
+
+# Đuôi file danh sách: mỗi dòng 1 đường dẫn PDF (dòng trống / bắt đầu bằng # bỏ qua)
+LIST_SUFFIXES = (".txt", ".lst")
+
+
+def collect_pdf_files(source):
+    """Danh sách file PDF từ 1 nguồn: file PDF, thư mục, mẫu glob hoặc file danh sách"""
+    path = Path(source)
+    if path.is_dir():
+        return sorted(p for p in path.iterdir() if p.is_file() and p.suffix.lower() == ".pdf")
+    if path.is_file() and path.suffix.lower() in LIST_SUFFIXES:
+        files = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    # Đường dẫn tương đối tính từ thư mục chứa file danh sách
+                    files.append(path.parent / line if not Path(line).is_absolute() else Path(line))
+        return files
+    if path.is_file():
+        return [path]
+    if glob.has_magic(str(source)):
+        return sorted(Path(p) for p in glob.glob(str(source), recursive=True)
+                      if p.lower().endswith(".pdf"))
+    return []
+
+
+def is_multi_document(source):
+    """Nguồn đầu vào là thư mục, glob hay danh sách (thay vì 1 file PDF)?"""
+    path = Path(source)
+    if path.is_dir():
+        return True
+    if path.is_file():
+        return path.suffix.lower() in LIST_SUFFIXES
+    return glob.has_magic(str(source))
+
+
+class _Document:
+    """Trạng thái của 1 file trong lúc chạy"""
+
+    def __init__(self, pdf_file, output_name):
+        self.pdf_file = pdf_file
+        self.output_name = output_name
+        self.converter = None
+        self.items = None
+        self.outstanding = 0
+        self.exhausted = False
+        self.result = None
+        self.failed_pages = 0
+        self.error = None
+
+
+class _SharedState:
+    """Phần dùng chung giữa các tài liệu (đọc qua share_from=): provider (client, pool kết nối),
+    rate limiter, cache, ngân sách và pool render; không giữ converter của tài liệu nào"""
+
+    def __init__(self, converter):
+        self.providers = converter.providers
+        self.rate_limiters = converter.rate_limiters
+        self.cache = converter.cache
+        self.budget = converter.budget
+        self.render_pool = converter.render_pool
+
+
+class MultiDocumentRunner:
+    """Chạy nhiều file PDF trên 1 pool `workers` luồng dùng chung.
+
+    Tối đa `open_documents` file được mở (tách trang, tạo file kết quả) cùng lúc;
+    trang của các file đang mở được đưa vào pool lần lượt từng file một.
+    """
+
+    def __init__(self, pdf_files, output_dir="output", workers=4, open_documents=None, metrics_file=None,
+                 **converter_kwargs):
+        self.output_dir = Path(output_dir)
+        self.workers = max(1, int(workers))
+        self.open_documents = max(1, open_documents or self.workers)
+        self.converter_kwargs = converter_kwargs
+        self.shared = None
+        # Số mục đã đưa vào pool mà chưa xong (backpressure khi render/tách trang), tính chung cho mọi
+        # tài liệu; chốt theo --max-in-memory khi mở tài liệu đầu tiên (xem _open)
+        self.max_queued = self.workers * 2
+        # Số liệu cộng dồn mọi tài liệu (báo cáo chi tiết nằm trong thư mục của từng tài liệu)
+        self.metrics = RunMetrics(keep_pages=False)
+        self.metrics_file = metrics_file
+        self.documents = []
+        used = set()
+        for pdf_file in pdf_files:
+            pdf_file = Path(pdf_file)
+            # Tên thư mục output theo tên file, thêm hậu tố nếu trùng (a/x.pdf, b/x.pdf)
+            name, n = pdf_file.stem, 1
+            while name in used:
+                n += 1
+                name = f"{pdf_file.stem}_{n}"
+            used.add(name)
+            self.documents.append(_Document(pdf_file, name))
+
+    def run(self):
+        """Xử lý mọi file, trả về {file PDF: file Excel kết quả hoặc None}"""
+        print(f"📚 {len(self.documents)} tài liệu, {self.workers} luồng dùng chung, "
+              f"tối đa {self.open_documents} tài liệu mở cùng lúc")
+        waiting = deque(self.documents)
+        active = deque()
+        futures = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while waiting or active or futures:
+                while len(futures) < self.max_queued:
+                    while waiting and len(active) < self.open_documents:
+                        document = waiting.popleft()
+                        if self._open(document):
+                            active.append(document)
+                    if not active:
+                        break
+                    # Vòng tròn: mỗi lượt lấy 1 trang của 1 file rồi chuyển sang file kế tiếp
+                    document = active.popleft()
+                    try:
+                        item = next(document.items, None)
+                    except Exception as e:
+                        # Lỗi khi tách/render trang tiếp theo: dừng nhận trang của file này
+                        print(f"❌ {document.pdf_file.name}: lỗi khi đọc trang: {type(e).__name__}: {e}")
+                        item = None
+                    if item is None:
+                        document.exhausted = True
+                        self._finish_if_done(document)
+                        continue
+                    future = executor.submit(document.converter.convert_item, item)
+                    futures[future] = document
+                    document.outstanding += 1
+                    active.append(document)
+
+                if not futures:
+                    continue
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    document = futures.pop(future)
+                    document.outstanding -= 1
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"❌ {document.pdf_file.name}: lỗi khi xử lý trang: {type(e).__name__}: {e}")
+                    self._finish_if_done(document)
+
+        if self.shared is not None and self.shared.render_pool is not None:
+            self.shared.render_pool.close()
+        self._print_summary()
+        if self.metrics_file:
+            self.metrics.write_prometheus(self.metrics_file)
+        return {document.pdf_file: document.result for document in self.documents}
+
+    def _open(self, document):
+        """Tạo converter (dùng chung provider/rate limiter/cache) và tách trang của 1 file"""
+        print(f"\n📂 Bắt đầu tài liệu: {document.pdf_file}")
+        try:
+            document.converter = PDFToExcelConverter(
+                document.pdf_file, output_dir=self.output_dir / document.output_name,
+                workers=self.workers, cache_dir=self.output_dir / "cache",
+                share_from=self.shared, **self.converter_kwargs
+            )
+            if self.shared is None:
+                self.shared = _SharedState(document.converter)
+                self.max_queued = document.converter._items_in_memory(self.workers * 2)
+            document.items = iter(document.converter.prepare_run())
+            return True
+        except Exception as e:
+            document.error = f"{type(e).__name__}: {e}"
+            print(f"❌ Không mở được {document.pdf_file}: {document.error}")
+            return False
+
+    def _finish_if_done(self, document):
+        """Lưu file Excel của tài liệu khi mọi trang đã được đưa vào pool và đã xong"""
+        if not document.exhausted or document.outstanding:
+            return
+        print(f"\n📗 Hoàn tất tài liệu: {document.pdf_file}")
+        try:
+            document.result = document.converter.finish_run()
+            document.failed_pages = document.converter.manifest.summary(document.converter.page_numbers)["failed"]
+        except Exception as e:
+            document.error = f"{type(e).__name__}: {e}"
+            print(f"❌ Không lưu được kết quả của {document.pdf_file}: {document.error}")
+        self.metrics.merge(document.converter.metrics)
+        # Giải phóng trạng thái của file đã xong (bảng text, thống kê...)
+        document.converter = None
+        document.items = None
+
+    def _print_summary(self):
+        ok = sum(1 for d in self.documents if d.result)
+        print("\n" + "=" * 60)
+        print(f"📚 KẾT QUẢ: {ok}/{len(self.documents)} tài liệu có file Excel")
+        print(f"⏱️  Thời gian theo bước (cộng mọi tài liệu): {self.metrics.stage_summary()}")
+        print("=" * 60)
+        for document in self.documents:
+            if document.error:
+                print(f"   ❌ {document.pdf_file}: {document.error}")
+            elif document.result and document.failed_pages:
+                print(f"   ⚠️  {document.pdf_file} → {document.result} ({document.failed_pages} trang lỗi, "
+                      f"chạy lại với --resume)")
+            elif document.result:
+                print(f"   ✅ {document.pdf_file} → {document.result}")
+            else:
+                print(f"   ⚠️  {document.pdf_file}: không có sheet nào")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Cắt trang dài/dày đặc thành các dải ảnh ngang gối lên nhau (--tiles), gửi AI song song rồi ghép bảng
+- Đường cắt đặt ở khoảng trắng giữa 2 hàng (dòng điểm ảnh ít mực nhất) gần vị trí chia đều
+- Các dải liền kề gối lên nhau 1 đoạn nhỏ: hàng sát đường cắt vẫn nằm trọn trong ít nhất 1 dải
+- Ghép: tiêu đề của dải đầu tiên có tiêu đề dùng cho cả bảng, bỏ các hàng bị đọc lặp ở chỗ gối
+Mỗi request chỉ phải trả 1 phần bảng: nhanh hơn và không vượt giới hạn token đầu ra
+"""
+
+from PIL import Image
+
+# Dải thấp nhất (px): ảnh thấp hơn thì cắt ít dải hơn yêu cầu
+MIN_TILE_HEIGHT = 400
+# Phần gối lên nhau giữa 2 dải liền kề, theo tỉ lệ chiều cao dải
+TILE_OVERLAP = 0.03
+# Đường cắt được tìm trong khoảng ± tỉ lệ này của chiều cao dải quanh vị trí chia đều
+CUT_SEARCH = 0.15
+# Số hàng tối đa bị đọc lặp ở chỗ nối 2 phần bảng
+MAX_REPEATED_ROWS = 3
+
+
+def _ink_profile(image, radius):
+    """Lượng mực của từng dòng điểm ảnh (0 = trắng hoàn toàn), làm mượt trong ± `radius` dòng
+    để điểm thấp nhất rơi vào giữa khoảng trắng chứ không sát mép chữ"""
+    gray = image.convert("L")
+    try:
+        # Thu về ảnh rộng 1 px: mỗi dòng còn lại độ sáng trung bình của cả dòng
+        column = gray.resize((1, gray.height), Image.Resampling.BOX)
+    finally:
+        gray.close()
+    prefix = [0]
+    for value in column.getdata():
+        prefix.append(prefix[-1] + 255 - value)
+    height = len(prefix) - 1
+    return [(prefix[min(height, y + radius + 1)] - prefix[max(0, y - radius)]) for y in range(height)]
+
+
+def tile_boxes(image, tiles, overlap=TILE_OVERLAP):
+    """Các vùng (trái, trên, phải, dưới) của tối đa `tiles` dải ngang phủ hết ảnh, từ trên xuống"""
+    width, height = image.size
+    count = max(1, min(int(tiles), height // MIN_TILE_HEIGHT))
+    if count == 1:
+        return [(0, 0, width, height)]
+    step = height / count
+    ink = _ink_profile(image, max(1, int(step * 0.01)))
+    window = max(1, int(step * CUT_SEARCH))
+    cuts = [0]
+    for i in range(1, count):
+        target = int(step * i)
+        low, high = max(cuts[-1] + 1, target - window), min(height - 1, target + window)
+        cuts.append(min(range(low, high + 1), key=lambda y: (ink[y], abs(y - target))))
+    cuts.append(height)
+    pad = int(step * overlap)
+    return [(0, max(0, top - pad), width, min(height, bottom + pad)) for top, bottom in zip(cuts, cuts[1:])]
+
+
+def skip_repeated_rows(rows, more, max_overlap=MAX_REPEATED_ROWS):
+    """Bỏ các hàng đầu của `more` trùng với các hàng cuối của `rows` (hàng bị đọc lặp ở chỗ nối)"""
+    for k in range(min(len(rows), len(more), max_overlap), 0, -1):
+        if more[:k] == rows[-k:]:
+            return more[k:]
+    return more
+
+
+def merge_tiles(tables):
+    """Ghép bảng {"headers", "rows"} của các dải (theo thứ tự từ trên xuống) thành bảng của cả trang.
+
+    Chỉ dải chứa dòng tiêu đề mới có headers; dải sau trả headers khác tiêu đề chung thường là
+    hàng dữ liệu đầu dải bị model lấy nhầm làm tiêu đề, nên được giữ lại như 1 hàng.
+    """
+    headers = next((table["headers"] for table in tables if table.get("headers")), [])
+    rows = []
+    for table in tables:
+        more = list(table.get("rows") or [])
+        if table.get("headers") and table["headers"] != headers:
+            more.insert(0, table["headers"])
+        # Dải sau có thể đọc lại dòng tiêu đề (bảng có tiêu đề lặp lại, phần gối)
+        more = [row for row in more if row != headers]
+        rows.extend(skip_repeated_rows(rows, more))
+    return {"headers": headers, "rows": rows}
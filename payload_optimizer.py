@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Tối ưu ảnh gửi lên AI để giảm kích thước request
+- Chọn DPI theo kích thước trang và mật độ chữ (không render nét hơn mức AI dùng được)
+- Thu nhỏ về độ phân giải tối đa hữu ích của từng nhà cung cấp
+- Tùy chọn chuyển ảnh xám, chọn PNG/WebP/JPEG theo đặc điểm ảnh (chỉ mã hóa 1 lần)
+- Dung lượng PNG của ảnh gốc (để báo cáo mức tiết kiệm) được ước tính trên vài dải ảnh, không mã hóa cả ảnh
+"""
+
+import math
+import zlib
+from collections import namedtuple
+
+from PIL import Image
+
+from rasterizer import encode_image
+
+# Cạnh dài tối đa (px) mà mỗi nhà cung cấp thực sự dùng; ảnh lớn hơn sẽ bị
+# server tự thu nhỏ nên gửi to hơn chỉ tốn băng thông và token
+PROVIDER_PROFILES = {
+    "anthropic": {"max_long_edge": 1568, "formats": ("PNG", "WEBP", "JPEG")},
+    "gemini": {"max_long_edge": 2048, "formats": ("PNG", "WEBP", "JPEG")},
+    "deepseek": {"max_long_edge": 1568, "formats": ("PNG", "JPEG")},
+    "mock": {"max_long_edge": 1568, "formats": ("PNG", "WEBP", "JPEG")},
+}
+
+MIME_TYPES = {"PNG": "image/png", "WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+MIN_DPI = 100
+MAX_DPI = 300
+# Trang nhiều chữ nhỏ cần tối thiểu DPI này để chữ còn đọc được
+DENSE_MIN_DPI = 150
+# Số ký tự / inch² để coi là trang dày đặc
+DENSE_CHARS_PER_SQIN = 30
+# Số màu của PNG bảng màu (ảnh màu / ảnh xám)
+PALETTE_COLORS = 64
+PALETTE_COLORS_GRAY = 16
+# Chọn định dạng: ảnh mẫu (lấy điểm ảnh, không nội suy) có cạnh dài tối đa bấy nhiêu px;
+# tỉ lệ điểm ảnh thuộc các màu phổ biến nhất để coi là ảnh ít màu (trang bảng, chữ trên nền trơn)
+FORMAT_SAMPLE_EDGE = 512
+FLAT_COVERAGE = 0.9
+# Ước tính PNG gốc: nén thử 1 dải BASELINE_STRIP_ROWS dòng trong mỗi BASELINE_STRIP_EVERY dải
+BASELINE_STRIP_ROWS = 32
+BASELINE_STRIP_EVERY = 8
+
+OptimizedImage = namedtuple(
+    "OptimizedImage", ["data", "mime_type", "format", "size", "baseline_bytes"]
+)
+
+
+def is_dense(width_pt, height_pt, text_chars):
+    """Trang có mật độ chữ cao (dựa trên số ký tự của lớp text, nếu có)"""
+    area_sqin = (width_pt / 72.0) * (height_pt / 72.0)
+    return area_sqin > 0 and text_chars / area_sqin >= DENSE_CHARS_PER_SQIN
+
+
+def choose_dpi(width_pt, height_pt, provider, dense=False):
+    """DPI nhỏ nhất để cạnh dài của ảnh vừa đạt độ phân giải tối đa của nhà cung cấp"""
+    profile = PROVIDER_PROFILES[provider]
+    long_edge_in = max(width_pt, height_pt) / 72.0
+    if long_edge_in <= 0:
+        return MAX_DPI
+    dpi = math.ceil(profile["max_long_edge"] / long_edge_in)
+    return max(DENSE_MIN_DPI if dense else MIN_DPI, min(MAX_DPI, dpi))
+
+
+def estimate_png_bytes(image):
+    """Dung lượng ước tính của ảnh khi lưu PNG (zlib như PNG, trên khoảng 1/8 số dòng của ảnh).
+
+    Chỉ dùng để báo cáo mức tiết kiệm: mã hóa PNG cả ảnh vừa render tốn 0.1-0.5s mỗi trang.
+    """
+    width, height = image.size
+    if not width or not height:
+        return 0
+    compressed = sampled = 0
+    for top in range(0, height, BASELINE_STRIP_ROWS * BASELINE_STRIP_EVERY):
+        bottom = min(top + BASELINE_STRIP_ROWS, height)
+        compressed += len(zlib.compress(image.crop((0, top, width, bottom)).tobytes(), 6))
+        sampled += bottom - top
+    return round(compressed * height / sampled)
+
+
+def choose_format(image, formats, dense=False):
+    """Chọn định dạng mã hóa theo đặc điểm ảnh thay vì mã hóa thử mọi định dạng rồi lấy file nhỏ nhất.
+
+    Trang dày đặc: PNG bảng màu (nén có mất dữ liệu làm nhòe chữ nhỏ). Còn lại WebP nếu nhà cung cấp
+    nhận (nhỏ nhất với trang bảng, cả bản vẽ lẫn bản scan); không có WebP thì ảnh ít màu dùng PNG bảng màu,
+    ảnh nhiều màu (ảnh chụp) dùng JPEG.
+    """
+    if dense:
+        return "PNG"
+    if "WEBP" in formats:
+        return "WEBP"
+    if "JPEG" not in formats:
+        return "PNG"
+    colors = PALETTE_COLORS_GRAY if image.mode == "L" else PALETTE_COLORS
+    return "PNG" if _palette_coverage(image, colors) >= FLAT_COVERAGE else "JPEG"
+
+
+def _palette_coverage(image, colors):
+    """Tỉ lệ điểm ảnh thuộc `colors` màu phổ biến nhất, đo trên ảnh mẫu thu nhỏ kiểu lấy điểm"""
+    step = max(1, math.ceil(max(image.width, image.height) / FORMAT_SAMPLE_EDGE))
+    sample = image.resize((max(1, image.width // step), max(1, image.height // step)),
+                          resample=Image.Resampling.NEAREST)
+    pixels = sample.width * sample.height
+    counts = sorted((count for count, _ in sample.getcolors(pixels)), reverse=True)
+    return sum(counts[:colors]) / pixels
+
+
+def encode_as(image, fmt, quality=85):
+    """Mã hóa ảnh (đã thu nhỏ) theo định dạng `fmt` với tham số tối ưu của định dạng đó"""
+    if fmt == "PNG":
+        # PNG bảng màu: giữ nét chữ, thường nhỏ hơn nhiều so với PNG 24-bit
+        palette = image.quantize(colors=PALETTE_COLORS_GRAY if image.mode == "L" else PALETTE_COLORS)
+        return encode_image(palette, "PNG", optimize=True)
+    if fmt == "WEBP":
+        return encode_image(image, "WEBP", quality=quality, method=4)
+    return encode_image(image, "JPEG", quality=quality, optimize=True)
+
+
+def optimize_image(image, provider, grayscale=False, dense=False, quality=85):
+    """Thu nhỏ, (tùy chọn) chuyển xám và mã hóa ảnh 1 lần theo định dạng do choose_format chọn.
+
+    Trả về OptimizedImage kèm dung lượng PNG ước tính của ảnh gốc để báo cáo mức tiết kiệm.
+    """
+    profile = PROVIDER_PROFILES[provider]
+    # Mốc so sánh: PNG không tối ưu của ảnh vừa render (cách làm trước đây), chỉ ước tính
+    baseline = estimate_png_bytes(image)
+
+    scale = profile["max_long_edge"] / max(image.width, image.height)
+    if scale < 1:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, resample=Image.Resampling.LANCZOS)
+
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    if grayscale:
+        image = image.convert("L")
+
+    fmt = choose_format(image, profile["formats"], dense)
+    return OptimizedImage(encode_as(image, fmt, quality), MIME_TYPES[fmt], fmt, image.size, baseline)
+
+
+def format_bytes(n):
+    """Hiển thị dung lượng dễ đọc"""
+    for unit in ("B", "KB", "MB"):
+        if n < 1024 or unit == "MB":
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
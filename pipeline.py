@@ -0,0 +1,1918 @@
+#!/usr/bin/env python3
+"""
+Công cụ chuyển đổi PDF sang Excel bằng AI - pipeline dùng chung cho mọi nhà cung cấp
+Workflow: PDF → Tách trang → AI OCR → Excel → Ghép file
+Phần riêng của từng nhà cung cấp (Claude, Gemini, DeepSeek, mock) nằm trong providers.py
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from pypdf import PdfWriter
+from pdf2image import convert_from_path
+
+from providers import Provider, create_provider, PROVIDERS
+from http_session import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from rate_limiter import RateLimiter
+from response_cache import ResponseCache
+from job_manifest import JobManifest, hash_file, hash_bytes, hash_image
+from text_layer import extract_table
+from excel_writer import StreamingWorkbookWriter
+from payload_optimizer import optimize_image, choose_dpi, is_dense, format_bytes
+from rasterizer import iter_page_images, iter_page_windows, count_pages, encode_image, DEFAULT_BATCH_SIZE
+from run_limits import RunBudget, parse_page_ranges
+from run_metrics import RunMetrics, message_sizes, request_size
+from render_pool import RenderPool, RenderedPage, render_ahead, decode_page
+from json_stream import TableStreamParser, extract_json
+from page_tiling import tile_boxes, merge_tiles, skip_repeated_rows
+from table_schema import SCHEMA_VERSION, table_errors, order_tables
+
+# Số request gọi tiếp tối đa cho 1 bảng bị cắt do hết max_tokens
+MAX_CONTINUATIONS = 4
+
+
+class PDFToExcelConverter:
+    """Chuyển PDF sang Excel với một hoặc nhiều provider.
+    
+    `provider` là tên, đối tượng Provider hoặc danh sách các provider. Khi có
+    nhiều provider, mỗi trang được gửi tới provider đứng trước trong danh sách
+    (ưu tiên, vd. rẻ nhất) trừ khi provider đó đang phải chờ quota lâu hơn.
+    """
+    
+    def __init__(self, input_pdf, provider="anthropic", output_dir="output", workers=1,
+                 rpm=None, tpm=None, use_cache=True, cache_max_mb=500, resume=False,
+                 stream=False, use_text_layer=True, optimize_payload=True, grayscale=False,
+                 keep_temp=False, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, gzip_body=False, async_mode=False,
+                 in_flight=16, batch_pages=1, batch_submit=False, batch_job=None, batch_poll=60,
+                 cache_dir=None, share_from=None, pages=None, max_pages=None, max_cost=None,
+                 metrics_file=None, max_in_memory=None, render_workers=0, stream_response=False, tiles=1):
+        self.input_pdf = Path(input_pdf)
+        self.output_dir = Path(output_dir)
+        self.workers = max(1, int(workers))
+        # Chế độ asyncio: số request API đồng thời, độc lập với số luồng render
+        self.async_mode = async_mode
+        self.in_flight = max(1, int(in_flight))
+        # Số trang tối đa gộp vào 1 request AI (1 = mỗi trang 1 request)
+        self.batch_pages = max(1, int(batch_pages))
+        # Đọc response dạng stream, ghi từng hàng ngay khi nhận (chỉ request 1 trang)
+        self.stream_response = stream_response
+        # Số dải ảnh ngang tối đa mỗi trang AI, gửi song song rồi ghép bảng (1 = gửi cả trang)
+        self.tiles = max(1, int(tiles))
+        # Số trang tối đa nằm trong bộ nhớ cùng lúc (đã tách/render, chờ AI, chờ ghi); None = tự chọn
+        self.max_in_memory = max(1, int(max_in_memory)) if max_in_memory else None
+        # Job batch của provider (--batch-submit): id job chỉ định sẵn, chu kỳ hỏi trạng thái (giây)
+        self.batch_submit = batch_submit or batch_job is not None
+        self.batch_job = batch_job
+        self.batch_poll = max(1, batch_poll)
+        if share_from is not None:
+            # Chế độ nhiều file / dịch vụ: dùng chung provider (client, pool kết nối), rate limiter,
+            # cache và ngân sách (nếu nơi chia sẻ không có ngân sách chung thì mỗi converter 1 ngân sách)
+            self.providers = share_from.providers
+            self.rate_limiters = share_from.rate_limiters
+            self.cache = share_from.cache
+            self.budget = getattr(share_from, "budget", None) or RunBudget(max_pages, max_cost)
+            self.render_pool = share_from.render_pool
+        else:
+            if not isinstance(provider, (list, tuple)):
+                provider = [provider]
+            self.providers = [p if isinstance(p, Provider) else create_provider(p) for p in provider]
+            # Mỗi luồng (hoặc mỗi request async) giữ 1 kết nối keep-alive tới API; --tiles: mỗi dải 1 luồng
+            pool_size = self.in_flight if async_mode else self.workers * self.tiles
+            for p in self.providers:
+                p.configure_http(pool_size=pool_size, connect_timeout=connect_timeout,
+                                 read_timeout=read_timeout, gzip_body=gzip_body)
+            self.rate_limiters = {p.name: RateLimiter(p.name, rpm=rpm, tpm=tpm) for p in self.providers}
+            self.cache = None if not use_cache else ResponseCache(
+                Path(cache_dir) if cache_dir else self.output_dir / "cache",
+                max_bytes=cache_max_mb * 1024 * 1024
+            )
+            self.budget = RunBudget(max_pages, max_cost)
+            # Pool tiến trình render trước các trang (--render-workers); None = render trong luồng xử lý trang
+            self.render_pool = RenderPool(render_workers) if render_workers else None
+        self.owns_render_pool = share_from is None
+        self.provider = self.providers[0]
+        self.resume = resume
+        self.stream = stream
+        self.use_text_layer = use_text_layer
+        self.text_tables = {}
+        self.page_methods = {}
+        self.page_providers = {}
+        # Trang có bảng bị cắt chưa gọi tiếp được hết: ghi các hàng đã nhận nhưng tính là lỗi
+        self.incomplete_pages = set()
+        # Trang render lỗi ở chế độ --stream (không có file trang để render lại): tính là lỗi
+        self.render_failed = set()
+        self.optimize_payload = optimize_payload
+        self.grayscale = grayscale
+        self.page_dpi = {}
+        self.page_dense = {}
+        self.payload_stats = {}
+        # Các trang cần xử lý (--pages "1-50,80"; None = mọi trang), chốt lại khi đọc PDF
+        self.pages = parse_page_ranges(pages) if isinstance(pages, str) else (sorted(set(pages)) if pages else None)
+        self.page_numbers = []
+        # Giữ thư mục tạm sau khi xong
+        self.keep_temp = keep_temp
+        self.manifest = None
+        self.temp_dir = self.output_dir / "temp"
+        self.pages_dir = self.temp_dir / "pages"
+        self.tables_dir = self.temp_dir / "tables"
+        self.writer = None
+        self.total_pages = 0
+        self.run_id = None
+        # Số liệu từng trang/từng bước (báo cáo JSON/CSV trong output/reports/) và file bộ đếm Prometheus
+        self.metrics = RunMetrics()
+        self.metrics_file = metrics_file
+        
+        # Tạo thư mục
+        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        self.pages_dir.mkdir(exist_ok=True)
+        self.tables_dir.mkdir(exist_ok=True)
+    
+    def step1_split_pdf(self):
+        """Bước 1: Tách PDF thành từng trang (tách hết 1 lượt, dùng khi chạy từng bước;
+        quy trình chính tách dần từng trang qua _page_items)"""
+        self._open_pdf("BƯỚC 1: TÁCH PDF THÀNH TỪNG TRANG")
+        page_files = [page_file for page_file, _, _ in self._iter_page_items(split=True)]
+        print(f"\n✅ Hoàn thành! Đã tách {len(page_files)} trang")
+        return page_files
+    
+    def _open_pdf(self, title):
+        """Đọc số trang của file và chốt danh sách trang cần xử lý"""
+        print("=" * 60)
+        print(title)
+        print("=" * 60)
+        
+        total_pages = count_pages(self.input_pdf)
+        print(f"📄 Tổng số trang: {total_pages}")
+        self._select_pages(total_pages)
+        return total_pages
+    
+    def _select_pages(self, total_pages):
+        """Chốt danh sách trang cần xử lý theo --pages (bỏ trang vượt quá số trang của file)"""
+        self.total_pages = total_pages
+        if self.pages is None:
+            self.page_numbers = list(range(1, total_pages + 1))
+            return
+        self.page_numbers = [i for i in self.pages if i <= total_pages]
+        skipped = len(self.pages) - len(self.page_numbers)
+        if skipped:
+            print(f"⚠️  Bỏ qua {skipped} trang ngoài phạm vi (file chỉ có {total_pages} trang)")
+        print(f"📑 Xử lý {len(self.page_numbers)}/{total_pages} trang theo --pages")
+    
+    def _iter_page_items(self, split):
+        """Sinh lần lượt (file trang, số trang, ảnh) theo thứ tự trang, chỉ đọc PDF khi được lấy tới.
+        
+        File được đọc theo cửa sổ vài chục trang: tiền xử lý (lớp text, DPI) rồi tách trang
+        (`split`) hoặc render thẳng từ file gốc (--stream) cho các trang của cửa sổ.
+        Người gọi lấy trang chậm thì việc đọc/render cũng dừng lại (backpressure), nên bộ nhớ
+        không tăng theo số trang của file.
+        """
+        render_batch = min(DEFAULT_BATCH_SIZE, self.max_in_memory or DEFAULT_BATCH_SIZE)
+        for window in iter_page_windows(self.input_pdf, self.page_numbers):
+            for i, page in window:
+                with self.metrics.stage(i, "prepass"):
+                    self._prepass_page(page, i)
+            
+            if split:
+                for i, page in window:
+                    yield self._split_page(page, i), i, None
+            elif self.render_pool is not None:
+                # Ảnh do pool render đảm nhận (xem _render_ahead)
+                for i, _ in window:
+                    yield None, i, None
+            else:
+                # Chỉ render các trang cần gọi AI; trang dùng lớp text đi thẳng
+                ai_pages = [i for i, _ in window if i not in self.text_tables]
+                images = None
+                for i, _ in window:
+                    if i in self.text_tables:
+                        yield None, i, None
+                        continue
+                    try:
+                        with self.metrics.stage(i, "render"):
+                            if images is None:
+                                images = iter_page_images(self.input_pdf, dpi=self.provider.default_dpi,
+                                                          batch_size=render_batch, page_dpi=self.page_dpi,
+                                                          page_numbers=[n for n in ai_pages if n >= i])
+                            entry = next(images)
+                    except Exception as e:
+                        # Chỉ trang này lỗi: bước 2 đánh dấu trang lỗi, các trang sau render lại từ lô mới
+                        print(f"  ⚠️  Lỗi khi render trang {i}: {type(e).__name__}: {e}")
+                        images = None
+                        self.render_failed.add(i)
+                        yield None, i, None
+                        continue
+                    yield (None,) + entry
+                    entry = None
+            # Bỏ tham chiếu tới các trang (và PdfReader) của cửa sổ này trước khi đọc cửa sổ sau
+            window = None
+    
+    def _split_page(self, page, i):
+        """Ghi 1 trang ra file PDF riêng trong temp/pages/"""
+        with self.metrics.stage(i, "split"):
+            writer = PdfWriter()
+            writer.add_page(page)
+            
+            output_file = self.pages_dir / f"page_{i:03d}.pdf"
+            with open(output_file, "wb") as f:
+                writer.write(f)
+        
+        print(f"  ✓ Trang {i}/{self.total_pages}: {output_file.name}")
+        return output_file
+    
+    def _prepass_page(self, page, i):
+        stats = {}
+        if self.use_text_layer:
+            table, _ = extract_table(page, stats=stats)
+            if table:
+                self.text_tables[i] = table
+                return
+        if self.optimize_payload:
+            width, height = float(page.mediabox.width), float(page.mediabox.height)
+            dense = is_dense(width, height, stats.get("text_chars", 0))
+            self.page_dense[i] = dense
+            # DPI theo provider chính; ảnh được thu nhỏ lại cho provider thực sự nhận trang
+            self.page_dpi[i] = choose_dpi(width, height, self.provider.name, dense)
+    
+    def step2_convert_page_to_excel(self, page_pdf, page_number, image=None):
+        """Bước 2: Chuyển đổi 1 trang PDF sang Excel bằng AI
+        
+        Ở chế độ --stream, `image` đã được render sẵn từ file PDF gốc.
+        """
+        print(f"\n📊 Xử lý trang {page_number}...")
+        
+        # Trang có lớp text tin cậy: dựng bảng trực tiếp, không render ảnh/gọi AI
+        if page_number in self.text_tables:
+            return self._save_text_table(page_number)
+        
+        provider = self._start_ai_page(page_number)
+        prepared = self._prepare_page_image(page_pdf, page_number, image, provider, self.tiles)
+        if prepared is None:
+            return None
+        
+        # Gọi AI để OCR
+        print(f"  🤖 Đang gọi {provider.label} để phân tích bảng...")
+        if self.tiles > 1:
+            excel_data = self._call_provider_tiles(provider, prepared, page_number)
+        else:
+            img_bytes, media_type = prepared
+            excel_data = self._call_provider(provider, img_bytes, media_type, page_number)
+            del img_bytes
+        # Ảnh đã gửi xong, không giữ trong lúc ghi Excel
+        prepared = None
+        return self._save_ai_table(excel_data, page_number)
+    
+    def _save_text_table(self, page_number):
+        # Bảng đã ghi ra file thì không cần giữ trong bộ nhớ nữa
+        table = self.text_tables.pop(page_number)
+        print(f"  📝 Dùng lớp text của PDF: {len(table['headers'])} cột, {len(table['rows'])} hàng")
+        self.page_methods[page_number] = "text"
+        return self._save_page_table(table, page_number)
+    
+    def _start_ai_page(self, *page_numbers):
+        """Đánh dấu các trang đi đường AI và chọn chung 1 provider cho chúng"""
+        provider = self._pick_provider()
+        for page_number in page_numbers:
+            self.page_methods[page_number] = "ai"
+            self.page_providers[page_number] = provider.name
+        return provider
+    
+    def _save_ai_table(self, excel_data, page_number):
+        if not excel_data:
+            return None
+        # Ghi thẳng vào file Excel kết quả
+        table_file = self._save_page_table(excel_data, page_number)
+        print(f"  ✅ Đã lưu trang {page_number}")
+        return table_file
+    
+    def _prepare_page_image(self, page_pdf, page_number, image, provider, tiles=1):
+        """Render (nếu chưa có ảnh) và mã hóa ảnh trang; trả về (bytes, mime type) hoặc None.
+        
+        `tiles` > 1 (--tiles): cắt ảnh thành tối đa `tiles` dải ngang, trả về danh sách
+        (bytes, mime type) của từng dải từ trên xuống.
+        """
+        if self.budget.exhausted:
+            # Hết ngân sách: không render/gửi thêm, trang để lại cho lần chạy --resume sau
+            print(f"  ⛔ Đã hết ngân sách ({self.budget.describe()}), bỏ qua trang {page_number}")
+            self._release_image(image)
+            return None
+        images = []
+        try:
+            if isinstance(image, RenderedPage):
+                if tiles == 1 and (image.provider == provider.name
+                                   or (image.provider is None and not self.optimize_payload)):
+                    # Ảnh đã được pool render mã hóa sẵn cho đúng provider
+                    if image.provider is not None:
+                        self._report_payload(page_number, image)
+                    return self._keep_payload(page_number, image.data, image.mime_type)
+                # Trang được chia cho provider khác: mã hóa lại từ PNG gốc
+                image = decode_page(image)
+            
+            if image is None and page_number in self.render_failed:
+                print(f"  ❌ Trang {page_number} không render được, bỏ qua")
+                return None
+            if image is None:
+                # Chuyển PDF sang ảnh
+                dpi = self.page_dpi.get(page_number, self.provider.default_dpi)
+                with self.metrics.stage(page_number, "render"):
+                    images = convert_from_path(str(page_pdf), dpi=dpi, fmt='png')
+                if not images:
+                    print(f"  ⚠️  Không thể chuyển trang {page_number} sang ảnh")
+                    return None
+                
+                # Lấy ảnh đầu tiên
+                image = images[0]
+            
+            # Mã hóa ảnh trong bộ nhớ, không cần đọc lại từ đĩa
+            with self.metrics.stage(page_number, "encode"):
+                if tiles > 1:
+                    return self._encode_page_tiles(image, page_number, provider, tiles)
+                img_bytes, media_type = self._encode_page_image(image, page_number, provider)
+            return self._keep_payload(page_number, img_bytes, media_type)
+        
+        except Exception as e:
+            print(f"  ⚠️  Lỗi khi chuyển PDF sang ảnh: {e}")
+            print("      (Hãy chắc chắn đã cài poppler-utils)")
+            return None
+        finally:
+            # Giải phóng điểm ảnh ngay sau khi mã hóa (kể cả khi nơi khác còn giữ đối tượng ảnh):
+            # trong lúc chờ API chỉ còn giữ bytes đã nén
+            for rendered in images:
+                rendered.close()
+            self._release_image(image)
+    
+    def _keep_payload(self, page_number, img_bytes, media_type, suffix=""):
+        """Ghi nhận dung lượng ảnh sẽ gửi (và lưu ảnh tạm để kiểm tra), trả về (bytes, mime type)"""
+        self.metrics.count(page_number, image_bytes=len(img_bytes))
+        if not self.stream:
+            # Lưu ảnh tạm để kiểm tra
+            img_path = self.temp_dir / f"page_{page_number:03d}{suffix}.{media_type.split('/')[1]}"
+            img_path.write_bytes(img_bytes)
+        return img_bytes, media_type
+    
+    @staticmethod
+    def _release_image(image):
+        """Đóng ảnh PIL (ảnh từ pool render chỉ là bytes đã mã hóa, không cần đóng)"""
+        if image is not None and not isinstance(image, RenderedPage):
+            image.close()
+    
+    def _pick_provider(self):
+        """Chọn provider cho trang tiếp theo: provider sẵn sàng phải chờ quota ít nhất,
+        hòa thì theo thứ tự ưu tiên trong danh sách"""
+        ready = [p for p in self.providers if p.is_ready()] or self.providers[:1]
+        if len(ready) == 1:
+            return ready[0]
+        return min(ready, key=lambda p: self.rate_limiters[p.name].wait_time(p.estimate_tokens()))
+    
+    def _encode_page_image(self, image, page_number, provider):
+        """Mã hóa ảnh trang để gửi AI; trả về (bytes, mime type)
+        
+        Mặc định thu nhỏ/chọn định dạng theo đặc điểm ảnh (--no-optimize: PNG gốc như cũ).
+        """
+        if not self.optimize_payload:
+            return encode_image(image, "PNG"), "image/png"
+        
+        optimized = optimize_image(image, provider.name, grayscale=self.grayscale,
+                                   dense=self.page_dense.get(page_number, False))
+        self._report_payload(page_number, optimized)
+        return optimized.data, optimized.mime_type
+    
+    def _encode_page_tiles(self, image, page_number, provider, tiles):
+        """Cắt ảnh trang thành các dải ngang gối lên nhau và mã hóa từng dải; trả về [(bytes, mime type)]"""
+        boxes = tile_boxes(image, tiles)
+        if len(boxes) == 1:
+            img_bytes, media_type = self._encode_page_image(image, page_number, provider)
+            return [self._keep_payload(page_number, img_bytes, media_type)]
+        
+        encoded, baseline = [], 0
+        for i, box in enumerate(boxes, 1):
+            tile = image.crop(box)
+            try:
+                if self.optimize_payload:
+                    optimized = optimize_image(tile, provider.name, grayscale=self.grayscale,
+                                               dense=self.page_dense.get(page_number, False))
+                    img_bytes, media_type = optimized.data, optimized.mime_type
+                    baseline += optimized.baseline_bytes
+                else:
+                    img_bytes, media_type = encode_image(tile, "PNG"), "image/png"
+            finally:
+                tile.close()
+            encoded.append(self._keep_payload(page_number, img_bytes, media_type, suffix=f"_tile{i}"))
+        sent = sum(len(img_bytes) for img_bytes, _ in encoded)
+        if self.optimize_payload:
+            self.payload_stats[page_number] = (sent, baseline)
+        print(f"  🧩 Cắt trang {image.width}x{image.height} thành {len(encoded)} dải ảnh ngang, "
+              f"tổng {format_bytes(sent)}")
+        return encoded
+    
+    def _report_payload(self, page_number, optimized):
+        """In và ghi nhận dung lượng ảnh đã tối ưu so với PNG gốc (ước tính)"""
+        sent = len(optimized.data)
+        self.payload_stats[page_number] = (sent, optimized.baseline_bytes)
+        print(f"  📦 Ảnh gửi đi: {optimized.format} {optimized.size[0]}x{optimized.size[1]}, "
+              f"{format_bytes(sent)} (PNG gốc ≈{format_bytes(optimized.baseline_bytes)}, "
+              f"giảm {optimized.baseline_bytes / sent:.1f}x)")
+    
+    def _call_provider(self, provider, img_bytes, media_type, page_number, prompt=None):
+        """Gọi provider để OCR bảng (qua cache và rate limiter), trả về {"headers", "rows"}.
+        
+        `prompt` thay prompt của provider; khi đó các hàng không được ghi thẳng vào sheet của trang
+        (dải ảnh --tiles đi qua _call_provider_tiles).
+        """
+        if not self._check_ready(provider):
+            return None
+        cache_key, cached = self._cache_lookup(provider, img_bytes, page_number, prompt)
+        if cached is not None:
+            return cached
+        
+        reserved = self._reserve_budget(provider)
+        if reserved is None:
+            return None
+        return self._request_table(provider, img_bytes, media_type, page_number, prompt, cache_key, reserved)
+    
+    def _request_table(self, provider, img_bytes, media_type, page_number, prompt, cache_key, reserved, pages=1):
+        """Gửi 1 request OCR đã giữ chỗ ngân sách (`pages` trang, chi phí `reserved`), gọi tiếp nếu bị cắt.
+        
+        Request lỗi thì trả lại phần đã giữ chỗ; dải ảnh --tiles giữ chỗ trang ở _call_provider_tiles
+        nên chỉ trả lại chi phí (`pages`=0).
+        """
+        estimated = provider.estimate_tokens()
+        streamed = None
+        live = prompt is None
+        
+        try:
+            if self._streams(provider):
+                response = self._send_request(provider, page_number,
+                                              lambda: provider.send_stream(img_bytes, media_type, prompt), estimated)
+                content, streamed = self._read_stream(provider, response, page_number, estimated, reserved, live)
+            else:
+                # Rate limiter lo phần giãn cách request và retry 429/5xx
+                response = self._send_request(provider, page_number,
+                                              lambda: provider.send(img_bytes, media_type, prompt), estimated)
+                content = self._read_response(provider, response, page_number, estimated, reserved)
+                streamed = self._truncated_table(provider, response, content, page_number)
+        except Exception as e:
+            self.budget.release(pages, reserved)
+            self._report_call_error(provider, e)
+            return None
+        
+        data = self._finish_response(content, page_number, cache_key, streamed)
+        if streamed is not None and streamed.truncated:
+            data = self._continue_table(provider, img_bytes, media_type, page_number, data, cache_key, live=live)
+        return data
+    
+    async def _call_provider_async(self, provider, img_bytes, media_type, page_number, prompt=None):
+        """Bản async của _call_provider (chế độ --async)"""
+        if not self._check_ready(provider):
+            return None
+        cache_key, cached = self._cache_lookup(provider, img_bytes, page_number, prompt)
+        if cached is not None:
+            return cached
+        
+        reserved = self._reserve_budget(provider)
+        if reserved is None:
+            return None
+        return await self._request_table_async(provider, img_bytes, media_type, page_number, prompt, cache_key,
+                                               reserved)
+    
+    async def _request_table_async(self, provider, img_bytes, media_type, page_number, prompt, cache_key,
+                                   reserved, pages=1):
+        """Bản async của _request_table"""
+        estimated = provider.estimate_tokens()
+        streamed = None
+        live = prompt is None
+        
+        try:
+            if self._streams(provider):
+                response = await self._send_request_async(
+                    provider, page_number, lambda: provider.send_stream_async(img_bytes, media_type, prompt),
+                    estimated
+                )
+                content, streamed = await self._read_stream_async(provider, response, page_number, estimated,
+                                                                  reserved, live)
+            else:
+                response = await self._send_request_async(
+                    provider, page_number, lambda: provider.send_async(img_bytes, media_type, prompt), estimated
+                )
+                content = self._read_response(provider, response, page_number, estimated, reserved)
+                streamed = self._truncated_table(provider, response, content, page_number)
+        except Exception as e:
+            self.budget.release(pages, reserved)
+            self._report_call_error(provider, e)
+            return None
+        
+        data = self._finish_response(content, page_number, cache_key, streamed)
+        if streamed is not None and streamed.truncated:
+            data = await self._continue_table_async(provider, img_bytes, media_type, page_number, data, cache_key,
+                                                    live=live)
+        return data
+    
+    def _truncated_table(self, provider, response, content, page_number):
+        """Response không stream bị cắt do max_tokens: đọc các hàng đã đủ bằng TableStreamParser
+        (JSON dở dang không parse được); None nếu response không bị cắt"""
+        if not provider.is_truncated(response):
+            return None
+        parser = TableStreamParser()
+        parser.feed(content)
+        parser.truncated = True
+        self._report_truncated(page_number, parser)
+        return parser
+    
+    def _report_truncated(self, page_number, parser):
+        print(f"  ✂️  Response trang {page_number} bị cắt do giới hạn max_tokens: "
+              f"đã nhận đủ {len(parser.rows)} hàng")
+    
+    def _continue_table(self, provider, img_bytes, media_type, page_number, data, cache_key, live=True):
+        """Gọi tiếp bảng bị cắt do max_tokens: mỗi request chỉ xin các hàng sau hàng cuối đã nhận,
+        ghép vào `data` tới khi model trả hết bảng (tối đa MAX_CONTINUATIONS lần).
+        
+        Không lấy đủ bảng (hết ngân sách, lỗi, vẫn bị cắt) thì trang bị đánh dấu chưa xong
+        (xem _incomplete_table).
+        """
+        for attempt in range(1, MAX_CONTINUATIONS + 1):
+            reserved = self._reserve_continuation(provider)
+            if reserved is None:
+                break
+            prompt = provider.continuation_prompt(data)
+            estimated = provider.estimate_tokens()
+            print(f"  ➕ Trang {page_number}: gọi tiếp lần {attempt} từ sau hàng {len(data['rows'])}")
+            try:
+                response = self._send_request(provider, page_number,
+                                              lambda: provider.send(img_bytes, media_type, prompt=prompt), estimated)
+                content = self._read_response(provider, response, page_number, estimated, reserved)
+                truncated = provider.is_truncated(response)
+            except Exception as e:
+                self.budget.release(0, reserved)
+                self._report_call_error(provider, e)
+                break
+            complete = self._stitch_continuation(data, content, truncated, page_number, attempt, cache_key, live)
+            if complete:
+                return data
+            if complete is not None:
+                break
+        else:
+            print(f"  ⚠️  Trang {page_number} vẫn bị cắt sau {MAX_CONTINUATIONS} lần gọi tiếp")
+        return self._incomplete_table(data, page_number)
+    
+    async def _continue_table_async(self, provider, img_bytes, media_type, page_number, data, cache_key,
+                                    live=True):
+        """Bản async của _continue_table"""
+        for attempt in range(1, MAX_CONTINUATIONS + 1):
+            reserved = self._reserve_continuation(provider)
+            if reserved is None:
+                break
+            prompt = provider.continuation_prompt(data)
+            estimated = provider.estimate_tokens()
+            print(f"  ➕ Trang {page_number}: gọi tiếp lần {attempt} từ sau hàng {len(data['rows'])}")
+            try:
+                response = await self._send_request_async(
+                    provider, page_number, lambda: provider.send_async(img_bytes, media_type, prompt=prompt),
+                    estimated
+                )
+                content = self._read_response(provider, response, page_number, estimated, reserved)
+                truncated = provider.is_truncated(response)
+            except Exception as e:
+                self.budget.release(0, reserved)
+                self._report_call_error(provider, e)
+                break
+            complete = self._stitch_continuation(data, content, truncated, page_number, attempt, cache_key, live)
+            if complete:
+                return data
+            if complete is not None:
+                break
+        else:
+            print(f"  ⚠️  Trang {page_number} vẫn bị cắt sau {MAX_CONTINUATIONS} lần gọi tiếp")
+        return self._incomplete_table(data, page_number)
+    
+    def _incomplete_table(self, data, page_number):
+        """Bảng bị cắt không gọi tiếp được hết: trang bị đánh dấu lỗi trong manifest để --resume
+        gọi lại, các hàng đã nhận (nếu có) vẫn được ghi vào sheet; bảng rỗng thì không ghi"""
+        self.incomplete_pages.add(page_number)
+        if not data["rows"]:
+            print(f"  ❌ Trang {page_number}: chưa nhận được hàng nào của bảng bị cắt, chạy lại bằng --resume")
+            return None
+        print(f"  ⚠️  Trang {page_number} chưa đủ bảng: ghi {len(data['rows'])} hàng đã nhận, "
+              f"chạy lại bằng --resume để lấy đủ")
+        return data
+    
+    def _reserve_continuation(self, provider):
+        """Giữ chỗ chi phí của 1 request gọi tiếp (trang đã được tính vào --max-pages)"""
+        cost = provider.estimate_cost(1)
+        if self.budget.reserve(0, cost):
+            return cost
+        print(f"  ⛔ Đã hết ngân sách ({self.budget.describe()}), không gọi tiếp bảng bị cắt")
+        return None
+    
+    def _stitch_continuation(self, data, content, truncated, page_number, attempt, cache_key, live=True):
+        """Ghép các hàng của response gọi tiếp vào `data`.
+        
+        Trả về True khi model đã trả hết bảng (response không bị cắt, JSON đóng đủ; bảng được cache),
+        None nếu cần gọi tiếp, False nếu lần gọi tiếp không trả thêm được gì (dừng, bảng chưa đủ).
+        """
+        if not self.stream:
+            debug_file = self.temp_dir / f"response_page_{page_number:03d}_cont{attempt}.txt"
+            with open(debug_file, "w", encoding="utf-8") as f:
+                f.write(content)
+        
+        with self.metrics.stage(page_number, "parse"):
+            parser = TableStreamParser()
+            parser.feed(content)
+            rows = skip_repeated_rows(data["rows"], parser.rows)
+        if not data["headers"] and parser.headers:
+            # Lần gọi tiếp từ đầu (bảng bị cắt trước khi có hàng nào) trả cả tiêu đề
+            data["headers"] = parser.headers
+        data["rows"].extend(rows)
+        self.metrics.count(page_number, continuations=1)
+        if live:
+            # Trang đang tới lượt ghi thì ghi luôn các hàng mới (như response stream)
+            self.writer.stream_rows(page_number, data["headers"], data["rows"])
+        
+        if truncated and rows:
+            print(f"  ✂️  Lần gọi tiếp {attempt} vẫn bị cắt: đã có {len(data['rows'])} hàng")
+            return None
+        if truncated or not parser.complete:
+            print(f"  ⚠️  Trang {page_number}: lần gọi tiếp {attempt} không trả thêm được bảng hợp lệ")
+            return False
+        print(f"  ✓ Đã ghép bảng trang {page_number} sau {attempt} lần gọi tiếp: "
+              f"{len(data['headers'])} cột, {len(data['rows'])} hàng")
+        if self.cache and cache_key:
+            self.cache.put(cache_key, data)
+        return True
+    
+    def _call_provider_tiles(self, provider, tiles, page_number):
+        """Gửi song song các dải ảnh [(bytes, mime type)] của 1 trang (--tiles) rồi ghép bảng.
+        
+        Cả trang chỉ giữ chỗ ngân sách 1 lần (1 trang trong --max-pages), chi phí của từng dải tính lại
+        theo token thực tế. Trang chỉ thành công khi mọi dải đều có kết quả; các dải đã xong nằm trong
+        cache nên lần chạy --resume chỉ gọi lại dải bị lỗi.
+        """
+        if len(tiles) == 1:
+            return self._call_provider(provider, *tiles[0], page_number)
+        tables, missing, share = self._begin_tiles(provider, tiles, page_number)
+        if missing:
+            print(f"  🧩 Gửi song song {len(missing)}/{len(tiles)} dải ảnh của trang {page_number}")
+            with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                futures = {i: executor.submit(self._request_table, provider, img_bytes, media_type, page_number,
+                                              prompt, cache_key, share, 0)
+                           for i, (img_bytes, media_type, prompt, cache_key) in missing.items()}
+                for i, future in futures.items():
+                    tables[i] = future.result()
+            self._settle_tiles(tables, missing)
+        return self._merge_tiles(tables, page_number)
+    
+    async def _call_provider_tiles_async(self, provider, tiles, page_number):
+        """Bản async của _call_provider_tiles"""
+        if len(tiles) == 1:
+            return await self._call_provider_async(provider, *tiles[0], page_number)
+        tables, missing, share = self._begin_tiles(provider, tiles, page_number)
+        if missing:
+            print(f"  🧩 Gửi song song {len(missing)}/{len(tiles)} dải ảnh của trang {page_number}")
+            results = await asyncio.gather(*(
+                self._request_table_async(provider, img_bytes, media_type, page_number, prompt, cache_key, share, 0)
+                for img_bytes, media_type, prompt, cache_key in missing.values()
+            ))
+            tables.update(zip(missing, results))
+            self._settle_tiles(tables, missing)
+        return self._merge_tiles(tables, page_number)
+    
+    def _begin_tiles(self, provider, tiles, page_number):
+        """Tra cache từng dải rồi giữ chỗ ngân sách 1 lần cho cả trang (--max-pages tính 1 trang).
+        
+        Trả về ({số dải: bảng}, {số dải: (bytes, mime type, prompt, cache key)} các dải còn phải gọi,
+        chi phí đã giữ chỗ cho mỗi dải); dải không gọi được có bảng None.
+        """
+        tables = dict.fromkeys(range(1, len(tiles) + 1))
+        if not self._check_ready(provider):
+            return tables, {}, 0.0
+        missing = {}
+        for i, (img_bytes, media_type) in enumerate(tiles, 1):
+            prompt = provider.tile_prompt(i, len(tiles))
+            cache_key, tables[i] = self._cache_lookup(provider, img_bytes, page_number, prompt)
+            if tables[i] is None:
+                missing[i] = (img_bytes, media_type, prompt, cache_key)
+        if not missing:
+            return tables, {}, 0.0
+        # Mỗi dải là 1 request: giữ chỗ chi phí theo số dải, _read_response tính lại theo token thực tế
+        reserved = self._reserve_budget(provider, cost=provider.estimate_cost(1) * len(missing))
+        if reserved is None:
+            return tables, {}, 0.0
+        return tables, missing, reserved / len(missing)
+    
+    def _settle_tiles(self, tables, missing):
+        """Mọi dải phải gọi đều lỗi (không request nào tốn phí): trả lại chỗ của trang trong --max-pages"""
+        if all(tables[i] is None for i in missing):
+            self.budget.release(1, 0.0)
+    
+    def _merge_tiles(self, tables, page_number):
+        failed = [i for i, table in sorted(tables.items()) if not table]
+        if failed:
+            print(f"  ❌ Trang {page_number}: {len(failed)}/{len(tables)} dải ảnh lỗi "
+                  f"(dải {', '.join(map(str, failed))}), chạy lại bằng --resume")
+            return None
+        with self.metrics.stage(page_number, "parse"):
+            data = merge_tiles([table for _, table in sorted(tables.items())])
+        print(f"  ✓ Đã ghép {len(tables)} dải: {len(data['headers'])} cột, {len(data['rows'])} hàng")
+        return data
+    
+    def _call_provider_batch(self, provider, batch):
+        """Gọi provider cho nhiều trang trong 1 request (--batch-pages).
+        
+        `batch` là danh sách (số trang, bytes ảnh, mime type); trả về {số trang: bảng}.
+        Response gộp hỏng (không phải mảng đúng số bảng) thì tách ra gọi lại từng trang.
+        """
+        results, missing = self._batch_cache_lookup(provider, batch)
+        if results is None:
+            return {}
+        if len(missing) < 2:
+            for page_number, img_bytes, media_type in missing:
+                results[page_number] = self._call_provider(provider, img_bytes, media_type, page_number)
+            return results
+        
+        reserved = self._reserve_budget(provider, len(missing))
+        if reserved is None:
+            return results
+        
+        estimated = provider.estimate_tokens(len(missing))
+        images = [(img_bytes, media_type) for _, img_bytes, media_type in missing]
+        pages = [page_number for page_number, _, _ in missing]
+        print(f"  🤖 Đang gọi {provider.label} cho {len(missing)} trang trong 1 request...")
+        
+        content = None
+        try:
+            response = self._send_request(provider, pages, lambda: provider.send_batch(images), estimated)
+            content = self._read_response(provider, response, pages, estimated, reserved)
+            tables = self._finish_batch_response(provider, content, missing)
+        except Exception as e:
+            self._report_call_error(provider, e)
+            tables = None
+        
+        if tables is None:
+            # Từng trang sẽ giữ chỗ lại khi gọi riêng: trả chỗ của request gộp; request đã có response
+            # thì giữ chi phí đã tính theo usage, chưa có thì trả cả chi phí ước tính
+            self.budget.release(len(missing), reserved if content is None else 0.0)
+            print(f"  🔁 Tách {len(missing)} trang ra gọi lại từng trang")
+            for page_number, img_bytes, media_type in missing:
+                results[page_number] = self._call_provider(provider, img_bytes, media_type, page_number)
+        else:
+            results.update(tables)
+        return results
+    
+    async def _call_provider_batch_async(self, provider, batch):
+        """Bản async của _call_provider_batch"""
+        results, missing = self._batch_cache_lookup(provider, batch)
+        if results is None:
+            return {}
+        if len(missing) < 2:
+            for page_number, img_bytes, media_type in missing:
+                results[page_number] = await self._call_provider_async(provider, img_bytes, media_type, page_number)
+            return results
+        
+        reserved = self._reserve_budget(provider, len(missing))
+        if reserved is None:
+            return results
+        
+        estimated = provider.estimate_tokens(len(missing))
+        images = [(img_bytes, media_type) for _, img_bytes, media_type in missing]
+        pages = [page_number for page_number, _, _ in missing]
+        print(f"  🤖 Đang gọi {provider.label} cho {len(missing)} trang trong 1 request...")
+        
+        content = None
+        try:
+            response = await self._send_request_async(provider, pages, lambda: provider.send_batch_async(images),
+                                                      estimated)
+            content = self._read_response(provider, response, pages, estimated, reserved)
+            tables = self._finish_batch_response(provider, content, missing)
+        except Exception as e:
+            self._report_call_error(provider, e)
+            tables = None
+        
+        if tables is None:
+            # Từng trang sẽ giữ chỗ lại khi gọi riêng: trả chỗ của request gộp; request đã có response
+            # thì giữ chi phí đã tính theo usage, chưa có thì trả cả chi phí ước tính
+            self.budget.release(len(missing), reserved if content is None else 0.0)
+            print(f"  🔁 Tách {len(missing)} trang ra gọi lại từng trang")
+            calls = [self._call_provider_async(provider, img_bytes, media_type, page_number)
+                     for page_number, img_bytes, media_type in missing]
+            for (page_number, _, _), data in zip(missing, await asyncio.gather(*calls)):
+                results[page_number] = data
+        else:
+            results.update(tables)
+        return results
+    
+    def _send_request(self, provider, pages, send, estimated):
+        """Gửi request qua rate limiter của provider, ghi nhận thời gian chờ quota / gọi API / thử lại"""
+        stats = {}
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            return self.rate_limiters[provider.name].call(send, estimated_tokens=estimated, stats=stats)
+        finally:
+            self._record_request(pages, stats, wall, cpu)
+    
+    async def _send_request_async(self, provider, pages, send, estimated):
+        """Bản async của _send_request (CPU đo theo luồng event loop nên chỉ mang tính tham khảo)"""
+        stats = {}
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            return await self.rate_limiters[provider.name].call_async(send, estimated_tokens=estimated, stats=stats)
+        finally:
+            self._record_request(pages, stats, wall, cpu)
+    
+    def _record_request(self, pages, stats, wall, cpu):
+        wait = stats.get("wait", 0.0)
+        self.metrics.add_time(pages, "rate_wait", wait)
+        self.metrics.add_time(pages, "request", max(time.perf_counter() - wall - wait, 0.0), time.thread_time() - cpu)
+        self.metrics.count(pages, requests=1, retries=stats.get("retries", 0))
+    
+    def _read_response(self, provider, response, pages, estimated, reserved):
+        """Đọc nội dung model trả về; cập nhật quota token, ngân sách và số liệu byte/token"""
+        with self.metrics.stage(pages, "parse"):
+            content, input_tokens, output_tokens = provider.parse_response(response)
+        tokens = input_tokens + output_tokens
+        self.rate_limiters[provider.name].record_usage(tokens, estimated)
+        # Response không có usage: giữ chi phí ước tính
+        count = 1 if isinstance(pages, int) else len(pages)
+        self.budget.settle(reserved, provider.estimate_cost(count, (input_tokens, output_tokens) if tokens else None))
+        sent, received = message_sizes(response, content)
+        self.metrics.count(pages, input_tokens=input_tokens, output_tokens=output_tokens,
+                           request_bytes=sent, response_bytes=received)
+        return content
+    
+    def _streams(self, provider):
+        return self.stream_response and provider.supports_streaming
+    
+    def _read_stream(self, provider, response, page_number, estimated, reserved, live=True):
+        """Đọc response stream: mỗi hàng đóng ngoặc xong được ghi ngay vào sheet (nếu trang đã tới lượt).
+        
+        `live`=False (dải ảnh --tiles): chỉ là 1 phần của bảng nên không ghi thẳng vào sheet.
+        Trả về (nội dung text đầy đủ, TableStreamParser với các hàng đã đọc được).
+        """
+        usage, parser, chunks = {}, TableStreamParser(), []
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            for text in provider.iter_stream(response, usage):
+                self._stream_chunk(parser, chunks, text, page_number, wall, live)
+        finally:
+            self.metrics.add_time(page_number, "request", time.perf_counter() - wall, time.thread_time() - cpu)
+        return self._finish_stream(provider, response, page_number, estimated, reserved, usage, parser, chunks)
+    
+    async def _read_stream_async(self, provider, response, page_number, estimated, reserved, live=True):
+        """Bản async của _read_stream"""
+        usage, parser, chunks = {}, TableStreamParser(), []
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            async for text in provider.iter_stream_async(response, usage):
+                self._stream_chunk(parser, chunks, text, page_number, wall, live)
+        finally:
+            self.metrics.add_time(page_number, "request", time.perf_counter() - wall, time.thread_time() - cpu)
+        return self._finish_stream(provider, response, page_number, estimated, reserved, usage, parser, chunks)
+    
+    def _stream_chunk(self, parser, chunks, text, page_number, started, live=True):
+        chunks.append(text)
+        had_rows = bool(parser.rows)
+        if parser.feed(text) and live:
+            if not had_rows:
+                print(f"  ⚡ Trang {page_number}: hàng đầu tiên sau {time.perf_counter() - started:.2f}s")
+            self.writer.stream_rows(page_number, parser.headers, parser.rows)
+    
+    def _finish_stream(self, provider, response, page_number, estimated, reserved, usage, parser, chunks):
+        """Cập nhật quota token, ngân sách, số liệu của request stream đã đọc xong"""
+        input_tokens, output_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        tokens = input_tokens + output_tokens
+        self.rate_limiters[provider.name].record_usage(tokens, estimated)
+        self.budget.settle(reserved, provider.estimate_cost(1, (input_tokens, output_tokens) if tokens else None))
+        content = "".join(chunks)
+        # Thân response stream đã được iter_stream đọc hết (requests/httpx không cho đọc lại .content):
+        # số byte nhận lấy theo dữ liệu SSE đã đếm trong lúc đọc
+        self.metrics.count(page_number, input_tokens=input_tokens, output_tokens=output_tokens,
+                           request_bytes=request_size(response),
+                           response_bytes=usage.get("received", len(content.encode("utf-8"))))
+        if usage.get("truncated"):
+            self._report_truncated(page_number, parser)
+        parser.truncated = bool(usage.get("truncated"))
+        return content, parser
+    
+    def _batch_cache_lookup(self, provider, batch):
+        """Tra cache từng trang của nhóm; trả về ({trang: bảng đã cache}, các trang còn phải gọi)
+        hoặc (None, None) nếu provider chưa sẵn sàng"""
+        if not self._check_ready(provider):
+            return None, None
+        results, missing = {}, []
+        for page_number, img_bytes, media_type in batch:
+            _, cached = self._cache_lookup(provider, img_bytes, page_number)
+            if cached is not None:
+                results[page_number] = cached
+            else:
+                missing.append((page_number, img_bytes, media_type))
+        return results, missing
+    
+    def _finish_batch_response(self, provider, content, batch):
+        """Tách mảng bảng của request gộp; trả về {số trang: bảng} hoặc None nếu response hỏng"""
+        first, last = batch[0][0], batch[-1][0]
+        if not self.stream:
+            debug_file = self.temp_dir / f"response_pages_{first:03d}-{last:03d}.txt"
+            with open(debug_file, "w", encoding="utf-8") as f:
+                f.write(content)
+        
+        with self.metrics.stage([page_number for page_number, _, _ in batch], "parse"):
+            tables = self._parse_table_batch(content, len(batch))
+        if tables is None:
+            return None
+        
+        results = {}
+        for (page_number, img_bytes, _), data in zip(batch, tables):
+            print(f"  ✓ Trang {page_number}: {len(data['headers'])} cột, {len(data['rows'])} hàng")
+            # Cache theo từng ảnh như khi gọi 1 trang, lần chạy sau dùng lại được ở cả 2 chế độ
+            if self.cache:
+                self.cache.put(self._cache_key(provider, img_bytes), data)
+            results[page_number] = data
+        return results
+    
+    def _parse_table_batch(self, content, count):
+        """Parse {"tables": [...]} (hoặc mảng JSON) gồm đúng `count` bảng theo schema; None nếu sai cấu trúc"""
+        data = extract_json(content, "{[", accept=lambda value: "tables" in value if isinstance(value, dict)
+                            else all(isinstance(t, dict) for t in value))
+        tables = data.get("tables") if isinstance(data, dict) else data
+        if not isinstance(tables, list):
+            print("  ⚠️  Không tìm thấy danh sách bảng hợp lệ trong response gộp")
+            return None
+        
+        if len(tables) != count:
+            print(f"  ⚠️  Response gộp có {len(tables)} bảng, cần {count}")
+            return None
+        for i, data in enumerate(tables, 1):
+            errors = table_errors(data)
+            if errors:
+                print(f"  ⚠️  Bảng {i} của response gộp không đúng schema: {errors[0]}")
+                return None
+        return order_tables(tables)
+    
+    def _check_ready(self, provider):
+        if provider.is_ready():
+            return True
+        print(f"  ❌ Lỗi: Chưa thiết lập API key cho {provider.label}.")
+        if provider.key_url:
+            print(f"  ℹ️  Lấy API key tại: {provider.key_url}")
+        return False
+    
+    def _reserve_budget(self, provider, pages=1, cost=None):
+        """Giữ chỗ ngân sách cho 1 request `pages` trang (chi phí ước tính, hoặc `cost` nếu có);
+        trả về chi phí đã giữ, None nếu hết ngân sách"""
+        if cost is None:
+            cost = provider.estimate_cost(pages)
+        if self.budget.reserve(pages, cost):
+            return cost
+        print(f"  ⛔ Đã hết ngân sách ({self.budget.describe()}), không gọi {provider.label}")
+        return None
+    
+    def _cache_key(self, provider, img_bytes, prompt=None):
+        """Key cache của 1 ảnh: ảnh + model + prompt + version schema bảng"""
+        return ResponseCache.make_key(img_bytes, provider.model, prompt or provider.prompt, SCHEMA_VERSION)
+    
+    def _cache_lookup(self, provider, img_bytes, page_number, prompt=None):
+        """Tra cache trước khi gọi API (key theo ảnh + model + prompt + schema); trả về (key, kết quả)"""
+        if not self.cache:
+            return None, None
+        with self.metrics.stage(page_number, "cache"):
+            cache_key = self._cache_key(provider, img_bytes, prompt)
+            cached = self.cache.get(cache_key)
+        if cached is not None:
+            self.metrics.count(page_number, cache_hits=1)
+            print(f"  💾 Dùng kết quả đã cache cho trang {page_number}")
+        return cache_key, cached
+    
+    def _report_call_error(self, provider, error):
+        print(f"  ❌ Lỗi khi gọi API ({provider.label}): {type(error).__name__}: {error}")
+        error_response = getattr(error, "response", None)
+        if getattr(error_response, "text", None):
+            print(f"  Response text: {error_response.text[:500]}")
+    
+    def _finish_response(self, content, page_number, cache_key, streamed=None):
+        """Lưu response debug, parse bảng và cache kết quả hợp lệ.
+        
+        `streamed` (TableStreamParser của response stream hoặc response bị cắt): response bị cắt
+        hoặc parse lỗi thì dùng các hàng đã đọc đủ thay cho bảng dự phòng.
+        """
+        # Debug: Lưu response raw để kiểm tra (bỏ qua ở chế độ --stream)
+        if not self.stream:
+            debug_file = self.temp_dir / f"response_page_{page_number:03d}.txt"
+            with open(debug_file, "w", encoding="utf-8") as f:
+                f.write(content)
+        
+        if streamed is not None and streamed.truncated:
+            # Bảng bị cắt không được cache/ghi ở đây: _continue_table gọi tiếp tới khi đủ hàng.
+            # Chưa có hàng nào (vd. input tool_use của Claude bị cắt không giữ lại được): gọi tiếp từ đầu
+            return streamed.table() or {"headers": [], "rows": []}
+        with self.metrics.stage(page_number, "parse"):
+            data, valid = self._parse_table(content, page_number)
+        if streamed is not None and streamed.table() is not None and not valid:
+            data = streamed.table()
+        # Chỉ cache kết quả parse đúng cấu trúc, không cache bảng dự phòng
+        if valid and self.cache and cache_key:
+            self.cache.put(cache_key, data)
+        return data
+    
+    def _parse_table(self, content, page_number):
+        """Tách JSON bảng khỏi nội dung model trả về.
+        
+        extract_json quét 1 lượt, bỏ qua text/markdown quanh JSON và tự sửa các lỗi JSON hay gặp.
+        Trả về (data, valid); valid=False khi phải dùng bảng cứu được/dự phòng.
+        """
+        content = content.strip()
+        
+        if "{" not in content:
+            print("  ⚠️  Không tìm thấy JSON trong response")
+            print(f"  Response preview: {content[:200]}...")
+            
+            # Thử tìm bảng theo format khác
+            return self._extract_table_from_text(content, page_number), False
+        
+        data = extract_json(content, "{")
+        if data is None:
+            print("  ❌ Lỗi parse JSON: JSON hỏng hoặc chưa đóng đủ ngoặc")
+            print(f"  JSON string preview: {content[:200]}...")
+            return self._salvage_table(content, page_number), False
+        
+        # Kiểm tra theo schema bảng chung (table_schema.py)
+        errors = table_errors(data)
+        if errors:
+            print(f"  ⚠️  JSON không đúng schema bảng: {'; '.join(errors)}")
+            return {
+                "headers": [f"Trang {page_number}"],
+                "rows": [["Không thể phân tích cấu trúc bảng"]]
+            }, False
+        
+        print(f"  ✓ Đã phân tích: {len(data['headers'])} cột, {len(data['rows'])} hàng")
+        return data, True
+    
+    def _salvage_table(self, content, page_number):
+        """Giữ các hàng đọc được trước chỗ JSON hỏng (vd. response bị cắt mà API không báo), nếu có"""
+        parser = TableStreamParser()
+        parser.feed(content)
+        table = parser.table()
+        if table is not None and table["rows"]:
+            print(f"  ⚠️  Giữ {len(table['rows'])} hàng đọc được trước chỗ lỗi")
+            return table
+        # Fallback: tạo bảng đơn giản
+        return {
+            "headers": [f"Trang {page_number}"],
+            "rows": [["Lỗi phân tích JSON"]]
+        }
+    
+    def _extract_table_from_text(self, text, page_number):
+        """Trích xuất bảng từ text response nếu không có JSON"""
+        try:
+            lines = text.strip().split('\n')
+            headers = []
+            rows = []
+            
+            # Tìm headers (dòng đầu tiên có nhiều cột)
+            for i, line in enumerate(lines):
+                # Kiểm tra xem dòng có phải là header không (có nhiều cột)
+                parts = re.split(r'\t|,\s*|\s\s+', line.strip())
+                if len(parts) > 1 and all(len(p.strip()) > 0 for p in parts):
+                    headers = [h.strip() for h in parts]
+                    # Lấy các dòng tiếp theo làm rows
+                    for row_line in lines[i+1:]:
+                        row_line = row_line.strip()
+                        if row_line:
+                            row_parts = re.split(r'\t|,\s*|\s\s+', row_line)
+                            if len(row_parts) >= len(headers):
+                                rows.append(row_parts[:len(headers)])
+                            elif len(row_parts) > 0:
+                                # Pad với empty strings nếu thiếu
+                                row = row_parts + [''] * (len(headers) - len(row_parts))
+                                rows.append(row)
+                    break
+            
+            if headers:
+                print(f"  ⚠️  Đã trích xuất bảng từ text: {len(headers)} cột, {len(rows)} hàng")
+                return {"headers": headers, "rows": rows}
+            else:
+                return {
+                    "headers": [f"Trang {page_number}"],
+                    "rows": [["Không tìm thấy bảng dữ liệu trong response"]]
+                }
+        except:
+            return {
+                "headers": [f"Trang {page_number}"],
+                "rows": [["Lỗi xử lý response"]]
+            }
+    
+    def _save_page_table(self, data, page_number):
+        """Lưu bảng của 1 trang (JSON, để --resume dùng lại) và ghi ngay vào file Excel kết quả"""
+        with self.metrics.stage(page_number, "write"):
+            table_file = self.tables_dir / f"page_{page_number:03d}.json"
+            with open(table_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            self.writer.add_page(page_number, data)
+        return table_file
+    
+    def _load_page_table(self, table_file):
+        """Đọc lại bảng đã lưu của lần chạy trước, None nếu không đọc được"""
+        try:
+            with open(table_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def step3_save_excel(self):
+        """Bước 3: Hoàn tất file Excel (các sheet đã được ghi dần ở bước 2)"""
+        print("\n" + "=" * 60)
+        print("BƯỚC 3: LƯU FILE EXCEL")
+        print("=" * 60)
+        
+        with self.metrics.stage(None, "save"):
+            output_file = self.writer.close()
+        if output_file is None:
+            print("❌ Không có sheet nào được thêm vào file cuối")
+            return None
+        
+        print("\n✅ Hoàn thành! File Excel đã được lưu tại:")
+        print(f"   📂 {output_file.absolute()}")
+        print(f"   📊 Tổng số sheet: {self.writer.sheet_count}")
+        
+        return output_file
+    
+    def run_full_process(self):
+        """Chạy toàn bộ quy trình"""
+        print("\n" + "🚀" * 30)
+        print("CÔNG CỤ CHUYỂN ĐỔI PDF SANG EXCEL BẰNG AI")
+        print("🚀" * 30)
+        print(f"\n📄 File đầu vào: {self.input_pdf}")
+        print(f"📁 Thư mục output: {self.output_dir.absolute()}")
+        print(f"🤖 AI sử dụng: {', '.join(p.label for p in self.providers)}\n")
+        
+        try:
+            page_items = self.prepare_run()
+            
+            if self.batch_submit:
+                self._convert_pages_batch_job(page_items)
+            elif self.async_mode:
+                asyncio.run(self._convert_pages_async(page_items))
+            elif self.workers > 1:
+                self._convert_pages_concurrently(page_items)
+            else:
+                # Tốc độ gọi API do rate limiter điều phối, không cần sleep cố định
+                for item in page_items:
+                    self.convert_item(item)
+            
+            return self.finish_run()
+        finally:
+            if self.render_pool is not None and self.owns_render_pool:
+                self.render_pool.close()
+    
+    def prepare_run(self):
+        """Mở manifest, tách/render trang (bước 1) và tạo file kết quả.
+        
+        Trả về iterator các mục cần xử lý bằng convert_item (1 trang, hoặc 1 nhóm khi --batch-pages).
+        """
+        # Manifest tiến độ, nằm ngoài thư mục temp để không bị xóa
+        self.manifest = JobManifest(
+            self.output_dir / "jobs" / f"{self.input_pdf.stem}.json",
+            self.input_pdf, resume=self.resume
+        )
+        
+        # Bước 1: Tách PDF (hoặc render trực tiếp nếu --stream)
+        self.total_pages, page_items = self._page_items()
+        if self.render_pool is not None:
+            page_items = self._render_ahead(page_items)
+        
+        # File kết quả được ghi dần theo thứ tự trang trong lúc xử lý
+        self.run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.writer = StreamingWorkbookWriter(
+            self.output_dir / f"merged_excel_{self.run_id}.xlsx", self.page_numbers
+        )
+        
+        # Bước 2: Chuyển từng trang sang Excel
+        print("\n" + "=" * 60)
+        print("BƯỚC 2: CHUYỂN ĐỔI TỪNG TRANG SANG EXCEL BẰNG AI")
+        print("=" * 60)
+        
+        if self.batch_pages > 1 and not self.batch_submit:
+            print(f"📦 Gộp tối đa {self.batch_pages} trang vào mỗi request AI")
+            page_items = self._group_pages(page_items)
+        return page_items
+    
+    def convert_item(self, item):
+        """Xử lý 1 mục do prepare_run trả về"""
+        if self.batch_pages > 1:
+            return self._convert_batch_tracked(*item)
+        return self._convert_page_tracked(*item)
+    
+    def finish_run(self):
+        """Bước 3: lưu file Excel, in báo cáo, dọn thư mục tạm nếu mọi trang thành công"""
+        final_file = self.step3_save_excel()
+        self._print_path_report()
+        self._write_run_report(final_file)
+        
+        # Dọn dẹp thư mục temp - chỉ khi mọi trang đều thành công,
+        # nếu không giữ lại để --resume dùng tiếp các trang đã xong
+        if self.budget.limited:
+            print(f"\n💰 Ngân sách đã dùng: {self.budget.describe()}")
+        if self.manifest.all_done(self.page_numbers):
+            if not self.keep_temp:
+                self._cleanup_temp()
+        else:
+            counts = self.manifest.summary(self.page_numbers)
+            if self.budget.exhausted:
+                print(f"\n⛔ Dừng do hết ngân sách: {counts['failed']} trang chưa xử lý - "
+                      f"chạy lại với --resume (và ngân sách mới) để xử lý tiếp")
+            else:
+                print(f"\n⚠️  {counts['failed']} trang lỗi - giữ thư mục tạm, chạy lại với --resume để thử lại")
+        
+        return final_file
+    
+    def _write_run_report(self, final_file):
+        """Ghi báo cáo số liệu của lần chạy (JSON/CSV) và file bộ đếm Prometheus nếu có --metrics-file"""
+        print(f"\n⏱️  Thời gian theo bước: {self.metrics.stage_summary()}")
+        try:
+            json_file, csv_file = self.metrics.write_reports(
+                self.output_dir / "reports", f"run_{self.run_id}",
+                input=str(self.input_pdf), output=str(final_file) if final_file else None,
+                providers=[p.name for p in self.providers], workers=self.workers,
+                async_mode=self.async_mode, batch_pages=self.batch_pages, batch_submit=self.batch_submit,
+                stream=self.stream, stream_response=self.stream_response, tiles=self.tiles,
+                render_workers=self.render_pool.workers if self.render_pool else 0,
+                total_pages=self.total_pages, selected_pages=len(self.page_numbers),
+                budget=self.budget.describe() if self.budget.limited else None
+            )
+            print(f"📈 Báo cáo số liệu: {json_file} (.csv)")
+            if self.metrics_file:
+                self.metrics.write_prometheus(self.metrics_file)
+        except OSError as e:
+            print(f"⚠️  Không ghi được báo cáo số liệu: {e}")
+    
+    def _print_path_report(self):
+        """In báo cáo từng trang đã đi theo đường nào (lớp text hay AI)"""
+        text_pages = sorted(p for p, m in self.page_methods.items() if m == "text")
+        ai_pages = sorted(p for p, m in self.page_methods.items() if m == "ai")
+        print(f"\n📋 Cách xử lý: 📝 lớp text {len(text_pages)} trang, 🤖 AI {len(ai_pages)} trang")
+        if text_pages:
+            print(f"   📝 Lớp text: trang {', '.join(map(str, text_pages))}")
+        if ai_pages:
+            print(f"   🤖 AI: trang {', '.join(map(str, ai_pages))}")
+        if len(self.providers) > 1:
+            for provider in self.providers:
+                pages = sorted(p for p, name in self.page_providers.items() if name == provider.name)
+                print(f"      • {provider.label}: {len(pages)} trang")
+        if self.payload_stats:
+            sent = sum(s for s, _ in self.payload_stats.values())
+            baseline = sum(b for _, b in self.payload_stats.values())
+            print(f"   📦 Ảnh gửi AI: {format_bytes(sent)} (PNG gốc ≈{format_bytes(baseline)}, "
+                  f"tiết kiệm {format_bytes(baseline - sent)})")
+    
+    def _page_items(self):
+        """Trả về (tổng số trang, iterator các bộ (file trang, số trang, ảnh))
+        
+        Chế độ thường: tách file từng trang, ảnh render sau ở bước 2.
+        Chế độ --stream: render theo lô từ file gốc, không ghi file trung gian.
+        Trang chỉ được tách/render khi bước 2 lấy tới (xem _iter_page_items).
+        """
+        if self.stream:
+            total_pages = self._open_pdf("BƯỚC 1: RENDER TRỰC TIẾP TỪ FILE PDF (--stream)")
+        else:
+            total_pages = self._open_pdf("BƯỚC 1: TÁCH PDF THÀNH TỪNG TRANG (tách dần trong lúc xử lý)")
+        return total_pages, self._iter_page_items(split=not self.stream)
+    
+    def _render_ahead(self, page_items):
+        """Bước render riêng (--render-workers): render trước các trang cần AI trên pool tiến trình
+        trong lúc các trang trước đang gọi API; trả lại các mục theo thứ tự trang, ảnh là RenderedPage"""
+        lookahead = self.max_in_memory or self.render_pool.workers * 2
+        print(f"🖼️  Render trước tối đa {lookahead} trang trên {self.render_pool.workers} tiến trình")
+        for (page_file, page_number, image), future in render_ahead(page_items, self._submit_render, lookahead):
+            if future is not None:
+                try:
+                    image = future.result()
+                    self.metrics.add_time(page_number, "render", image.wall, image.cpu)
+                except Exception as e:
+                    print(f"  ⚠️  Lỗi khi render trang {page_number} trên pool: {type(e).__name__}: {e}")
+                    if page_file is None:
+                        # --stream không có file trang để bước 2 render lại: thử lại ngay trong luồng này
+                        try:
+                            with self.metrics.stage(page_number, "render"):
+                                _, image = next(iter_page_images(self.input_pdf, dpi=self.provider.default_dpi,
+                                                                 page_numbers=[page_number],
+                                                                 page_dpi=self.page_dpi))
+                        except Exception as e:
+                            print(f"  ⚠️  Lỗi khi render trang {page_number}: {type(e).__name__}: {e}")
+                            self.render_failed.add(page_number)
+            yield page_file, page_number, image
+    
+    def _submit_render(self, item):
+        """Đưa 1 trang vào pool render; None nếu trang không cần ảnh (lớp text, đã xong, hết ngân sách)"""
+        page_file, page_number, _ = item
+        if page_number in self.text_tables:
+            return None
+        if page_file is not None and (self.budget.exhausted or (
+                self.resume and self.manifest.completed_output(page_number, hash_file(page_file)))):
+            return None
+        # Một provider: tối ưu ảnh luôn trong pool; nhiều provider: PNG gốc, tối ưu khi đã biết provider;
+        # --tiles: PNG gốc để cắt dải ở độ phân giải đầy đủ
+        provider = self.provider.name if (self.optimize_payload and len(self.providers) == 1
+                                          and self.tiles == 1) else None
+        source, source_page = (page_file, 1) if page_file is not None else (self.input_pdf, page_number)
+        dpi = self.page_dpi.get(page_number, self.provider.default_dpi)
+        return self.render_pool.submit(str(source), source_page, dpi, provider, grayscale=self.grayscale,
+                                       dense=self.page_dense.get(page_number, False))
+    
+    def _convert_page_tracked(self, page_file, page_number, image=None):
+        """Xử lý 1 trang và ghi nhận vào manifest; bỏ qua trang đã xong khi --resume"""
+        done_file = self._begin_page(page_file, page_number, image)
+        if done_file:
+            return done_file
+        
+        table_file = None
+        try:
+            table_file = self.step2_convert_page_to_excel(page_file, page_number, image)
+        finally:
+            self._finish_page(page_number, table_file)
+        return table_file
+    
+    def _begin_page(self, page_file, page_number, image):
+        """Trả về file kết quả cũ nếu trang đã xong (--resume), ngược lại đánh dấu bắt đầu"""
+        with self.metrics.stage(page_number, "hash"):
+            if page_file is not None:
+                page_hash = hash_file(page_file)
+            elif isinstance(image, RenderedPage):
+                page_hash = hash_bytes(image.data)
+            elif image is not None:
+                page_hash = hash_image(image)
+            elif page_number in self.render_failed:
+                page_hash = None
+            else:
+                # Trang dùng lớp text ở chế độ --stream: hash theo nội dung bảng
+                page_hash = hash_bytes(json.dumps(self.text_tables[page_number], ensure_ascii=False).encode())
+        if self.resume:
+            done_file = self.manifest.completed_output(page_number, page_hash)
+            data = self._load_page_table(done_file) if done_file else None
+            if data is not None:
+                print(f"\n⏭️  Trang {page_number} đã xử lý xong trước đó: {done_file.name}")
+                self.text_tables.pop(page_number, None)
+                self._release_image(image)
+                with self.metrics.stage(page_number, "write"):
+                    self.writer.add_page(page_number, data)
+                self.metrics.finish_page(page_number, "resumed")
+                return done_file
+        
+        self.manifest.mark_started(page_number, page_hash)
+        return None
+    
+    def _finish_page(self, page_number, table_file):
+        method = self.page_methods.get(page_number)
+        complete = page_number not in self.incomplete_pages
+        self.manifest.mark_finished(page_number, table_file, method, complete)
+        status = ("done" if complete else "partial") if table_file else "failed"
+        self.metrics.finish_page(page_number, status, method, self.page_providers.get(page_number))
+        if table_file is None:
+            # Trang lỗi: báo cho writer để các trang sau không phải chờ
+            self.writer.add_page(page_number, None)
+    
+    def _convert_pages_concurrently(self, page_items):
+        """Xử lý nhiều trang song song, giữ nguyên thứ tự trang trong kết quả"""
+        max_queued = self._items_in_memory(self.workers * 2)
+        print(f"⚡ Chế độ song song: {self.workers} luồng, tối đa {max_queued * self.batch_pages} trang trong bộ nhớ")
+        
+        results = {}
+        futures = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Trang (hoặc nhóm trang khi --batch-pages) được đưa vào pool ngay khi tách/render xong,
+            # nhưng chỉ lấy trang tiếp theo khi số mục chưa xong dưới giới hạn (backpressure)
+            for position, item in enumerate(page_items):
+                futures[executor.submit(self.convert_item, item)] = position
+                item = None
+                while len(futures) >= max_queued:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[futures.pop(future)] = future.result()
+            for future in futures:
+                results[futures[future]] = future.result()
+        return [results[position] for position in sorted(results)]
+    
+    def _items_in_memory(self, default):
+        """Số mục (1 trang, hoặc 1 nhóm khi --batch-pages) được tách/render trước tối đa"""
+        if self.max_in_memory is None:
+            return default
+        return max(1, self.max_in_memory // self.batch_pages)
+    
+    async def _convert_pages_async(self, page_items):
+        """Chế độ --async: giữ tối đa `in_flight` trang đang gọi API trong 1 event loop.
+        
+        Việc nặng CPU (render, mã hóa ảnh, hash) chạy trong pool `workers` luồng;
+        gọi API không chiếm luồng nào. Trang mới chỉ được lấy khi còn chỗ (backpressure).
+        """
+        in_flight = min(self.in_flight, self._items_in_memory(self.in_flight))
+        print(f"⚡ Chế độ asyncio: tối đa {in_flight} request đồng thời, {self.workers} luồng render")
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(in_flight)
+        for p in self.providers:
+            p.open_async(self.in_flight)
+        
+        convert = self._convert_batch_async if self.batch_pages > 1 else self._convert_page_async
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            tasks = []
+            iterator = iter(page_items)
+            while True:
+                await slots.acquire()
+                # Ở chế độ --stream, lấy trang tiếp theo nghĩa là render nó: chạy ngoài event loop
+                item = await loop.run_in_executor(executor, next, iterator, None)
+                if item is None:
+                    slots.release()
+                    break
+                tasks.append(asyncio.create_task(convert(executor, slots, *item)))
+                item = None
+                # Task đã xong thì bỏ khỏi danh sách, chỉ giữ lỗi (nếu có) để báo ra ngoài
+                tasks = [task for task in tasks if not task.done() or task.exception()]
+            await asyncio.gather(*tasks)
+        finally:
+            executor.shutdown(wait=True)
+            for p in self.providers:
+                await p.close_async()
+    
+    async def _convert_page_async(self, executor, slots, page_file, page_number, image=None):
+        """Bản async của _convert_page_tracked, nhả chỗ trong `slots` khi xong.
+        
+        Ghi sheet Excel và manifest (ghi đĩa) chạy trong pool luồng để không chặn event loop.
+        """
+        loop = asyncio.get_running_loop()
+        table_file = None
+        try:
+            done_file = await loop.run_in_executor(executor, self._begin_page, page_file, page_number, image)
+            if done_file:
+                table_file = done_file
+                return done_file
+            try:
+                print(f"\n📊 Xử lý trang {page_number}...")
+                if page_number in self.text_tables:
+                    table_file = await loop.run_in_executor(executor, self._save_text_table, page_number)
+                    return table_file
+                
+                provider = self._start_ai_page(page_number)
+                prepared = await loop.run_in_executor(
+                    executor, self._prepare_page_image, page_file, page_number, image, provider, self.tiles
+                )
+                if prepared is None:
+                    return None
+                image = None  # Ảnh đã mã hóa xong, không giữ lại trong lúc chờ API
+                
+                print(f"  🤖 Đang gọi {provider.label} để phân tích bảng...")
+                if self.tiles > 1:
+                    excel_data = await self._call_provider_tiles_async(provider, prepared, page_number)
+                else:
+                    img_bytes, media_type = prepared
+                    excel_data = await self._call_provider_async(provider, img_bytes, media_type, page_number)
+                prepared = None
+                table_file = await loop.run_in_executor(executor, self._save_ai_table, excel_data, page_number)
+                return table_file
+            finally:
+                await loop.run_in_executor(executor, self._finish_page, page_number, table_file)
+        finally:
+            slots.release()
+    
+    def _group_pages(self, page_items):
+        """Gom các trang liên tiếp thành nhóm có tối đa `batch_pages` trang cần gọi AI
+        (trang dùng lớp text đi cùng nhóm nhưng không tính vào giới hạn)"""
+        group, ai_count = [], 0
+        for item in page_items:
+            group.append(item)
+            if item[1] not in self.text_tables:
+                ai_count += 1
+            if ai_count >= self.batch_pages:
+                yield tuple(group)
+                group, ai_count = [], 0
+        if group:
+            yield tuple(group)
+    
+    def _convert_batch_tracked(self, *items):
+        """Xử lý 1 nhóm trang (--batch-pages): các trang cần AI được gộp vào ít request nhất"""
+        page_numbers, provider, prepared = self._begin_batch(items)
+        tables = {}
+        try:
+            for batch in self._split_batch(provider, prepared):
+                tables.update(self._call_provider_batch(provider, batch))
+        finally:
+            table_files = self._finish_batch(page_numbers, tables)
+        return table_files
+    
+    async def _convert_batch_async(self, executor, slots, *items):
+        """Bản async của _convert_batch_tracked; các request gộp của nhóm chạy đồng thời"""
+        loop = asyncio.get_running_loop()
+        try:
+            page_numbers, provider, prepared = await loop.run_in_executor(executor, self._begin_batch, items)
+            tables = {}
+            try:
+                calls = [self._call_provider_batch_async(provider, batch)
+                         for batch in self._split_batch(provider, prepared)]
+                for result in await asyncio.gather(*calls):
+                    tables.update(result)
+            finally:
+                await loop.run_in_executor(executor, self._finish_batch, page_numbers, tables)
+        finally:
+            slots.release()
+    
+    def _begin_batch(self, items):
+        """Bắt đầu 1 nhóm trang: bỏ qua trang đã xong (--resume), lưu ngay trang có lớp text,
+        chọn provider và chuẩn bị ảnh cho các trang còn lại.
+        
+        Trả về (các trang AI, provider, [(số trang, bytes ảnh, mime type)] của trang chuẩn bị được).
+        """
+        pending = []
+        for page_file, page_number, image in items:
+            if self._begin_page(page_file, page_number, image):
+                continue
+            print(f"\n📊 Xử lý trang {page_number}...")
+            if page_number in self.text_tables:
+                table_file = None
+                try:
+                    table_file = self._save_text_table(page_number)
+                finally:
+                    self._finish_page(page_number, table_file)
+                continue
+            pending.append((page_file, page_number, image))
+        
+        page_numbers = [page_number for _, page_number, _ in pending]
+        if not pending:
+            return page_numbers, None, []
+        provider = self._start_ai_page(*page_numbers)
+        prepared = []
+        for page_file, page_number, image in pending:
+            result = self._prepare_page_image(page_file, page_number, image, provider)
+            if result is not None:
+                prepared.append((page_number,) + result)
+        return page_numbers, provider, prepared
+    
+    def _split_batch(self, provider, prepared):
+        """Chia các trang đã chuẩn bị thành các request gộp vừa giới hạn của provider
+        (số ảnh, tổng dung lượng ảnh); trang dày chữ cho kết quả dài nên gửi riêng"""
+        batches, current, size = [], [], 0
+        for entry in prepared:
+            page_number, img_bytes, _ = entry
+            if self.page_dense.get(page_number):
+                batches.append([entry])
+                continue
+            if current and (len(current) >= provider.max_batch_images
+                            or size + len(img_bytes) > provider.max_batch_bytes):
+                batches.append(current)
+                current, size = [], 0
+            current.append(entry)
+            size += len(img_bytes)
+        if current:
+            batches.append(current)
+        return batches
+    
+    def _finish_batch(self, page_numbers, tables):
+        """Lưu bảng và ghi nhận manifest cho từng trang AI của nhóm"""
+        table_files = []
+        for page_number in page_numbers:
+            table_file = None
+            try:
+                table_file = self._save_ai_table(tables.get(page_number), page_number)
+            finally:
+                self._finish_page(page_number, table_file)
+            table_files.append(table_file)
+        return table_files
+    
+    def _convert_pages_batch_job(self, page_items):
+        """Chế độ --batch-submit: gửi mọi trang cần AI thành job batch của provider chính
+        (rẻ hơn, không cần kết quả ngay), chờ job xong rồi ghi kết quả như chế độ thường.
+        
+        Id job được lưu trong manifest: chạy lại với --resume sẽ chờ tiếp job cũ thay vì gửi lại.
+        """
+        provider = self.provider
+        if not provider.supports_batch_jobs:
+            print(f"❌ {provider.label} không hỗ trợ job batch (--batch-submit)")
+            return
+        if not self._check_ready(provider):
+            return
+        
+        # Job đã gửi ở lần chạy trước, hoặc job chỉ định bằng --batch-job (gồm mọi trang còn chờ;
+        # không biết ảnh và thứ tự đã gửi nên kết quả không được cache, chỉ đối chiếu theo custom_id)
+        if self.batch_job is not None:
+            jobs = [{"id": self.batch_job, "pages": [], "ordered": False}]
+        else:
+            jobs = self.manifest.batch_jobs(provider.name) if self.resume else []
+        submitted = {page for job in jobs for page in job["pages"]}
+        
+        new_pages = []
+        # Trang chờ kết quả job trong lần chạy này (trang đã xong hoặc không được chọn thì bỏ qua)
+        waiting, finished = set(), set()
+        cache_keys, reserved = {}, {}
+        for page_file, page_number, image in page_items:
+            if self._begin_page(page_file, page_number, image):
+                finished.add(page_number)
+                continue
+            if page_number in self.text_tables:
+                print(f"\n📊 Xử lý trang {page_number}...")
+                self._finish_page(page_number, self._save_text_table(page_number))
+                continue
+            self.page_methods[page_number] = "ai"
+            self.page_providers[page_number] = provider.name
+            if self.batch_job is not None:
+                jobs[0]["pages"].append(page_number)
+            if page_number in submitted or self.batch_job is not None:
+                waiting.add(page_number)
+                continue
+            
+            print(f"\n📊 Chuẩn bị trang {page_number}...")
+            prepared = self._prepare_page_image(page_file, page_number, image, provider)
+            if prepared is None:
+                self._finish_page(page_number, None)
+                continue
+            img_bytes, media_type = prepared
+            cache_keys[page_number], cached = self._cache_lookup(provider, img_bytes, page_number)
+            if cached is not None:
+                self._finish_page(page_number, self._save_ai_table(cached, page_number))
+                continue
+            cost = self._reserve_budget(provider, cost=provider.estimate_cost(1) * provider.batch_job_price_factor)
+            if cost is None:
+                self._finish_page(page_number, None)
+                continue
+            reserved[page_number] = cost
+            new_pages.append((page_number, img_bytes, media_type))
+        
+        with self.metrics.stage(None, "batch_submit"):
+            new_jobs = self._submit_batch_jobs(provider, new_pages, cache_keys, reserved)
+        del new_pages
+        for job in new_jobs:
+            waiting.update(job["pages"])
+        
+        for job in jobs + new_jobs:
+            self._collect_batch_job(provider, job, waiting, finished, reserved)
+    
+    def _submit_batch_jobs(self, provider, pages, cache_keys, reserved):
+        """Gửi các trang thành job batch (chia nhiều job nếu vượt dung lượng), trả về danh sách job"""
+        chunks, current, size = [], [], 0
+        for entry in pages:
+            if current and size + len(entry[1]) > provider.max_batch_job_bytes:
+                chunks.append(current)
+                current, size = [], 0
+            current.append(entry)
+            size += len(entry[1])
+        if current:
+            chunks.append(current)
+        
+        jobs = []
+        for chunk in chunks:
+            page_numbers = [page_number for page_number, _, _ in chunk]
+            try:
+                job_id = provider.submit_batch_job(
+                    [(f"page-{page_number:03d}", img_bytes, media_type) for page_number, img_bytes, media_type in chunk]
+                )
+            except Exception as e:
+                self._report_call_error(provider, e)
+                for page_number in page_numbers:
+                    self.budget.release(1, reserved.pop(page_number, 0.0))
+                    self._finish_page(page_number, None)
+                continue
+            self.manifest.add_batch_job(provider.name, job_id, page_numbers, cache_keys)
+            print(f"\n📮 Đã gửi job batch {job_id} ({len(chunk)} trang) tới {provider.label}")
+            jobs.append({"id": job_id, "pages": page_numbers,
+                         "cache_keys": {str(page): cache_keys.get(page) for page in page_numbers}})
+        if jobs:
+            print("ℹ️  Nếu bị gián đoạn, chạy lại với --resume (hoặc --batch-job ID) để chờ tiếp, không gửi lại")
+        return jobs
+    
+    def _collect_batch_job(self, provider, job, waiting, finished, reserved):
+        """Chờ 1 job batch kết thúc, lưu bảng các trang đang chờ (`waiting`) và quyết toán ngân sách
+        theo usage thực tế; job bị xóa khỏi manifest khi mọi trang của job đã có kết quả (`finished`)"""
+        job_id = job["id"]
+        page_numbers = [page_number for page_number in job["pages"] if page_number in waiting]
+        if not page_numbers:
+            if set(job["pages"]) <= finished:
+                self.manifest.remove_batch_job(job_id)
+            return
+        cache_keys = job.get("cache_keys") or {}
+        # Provider ghép kết quả theo vị trí cần đủ thứ tự trang lúc gửi, không chỉ các trang đang chờ
+        job_ids = [f"page-{page_number:03d}" for page_number in job["pages"]] if job.get("ordered", True) else None
+        try:
+            with self.metrics.stage(None, "batch_wait"):
+                self._wait_batch_job(provider, job_id)
+                results = provider.batch_job_results(job_id, job_ids)
+        except Exception as e:
+            # Lỗi mạng khi chờ/lấy kết quả: giữ job trong manifest để --resume thử lại
+            self._report_call_error(provider, e)
+            for page_number in page_numbers:
+                self._finish_page(page_number, None)
+            return
+        
+        print(f"\n📥 Job {job_id}: nhận {len(results)}/{len(page_numbers)} kết quả")
+        for page_number in page_numbers:
+            content, error, usage = results.get(f"page-{page_number:03d}",
+                                                (None, "không có kết quả trong job", None))
+            # Trang gửi ở lần chạy trước không giữ chỗ trong ngân sách lần này
+            if page_number in reserved:
+                if content is None:
+                    self.budget.release(1, reserved.pop(page_number))
+                else:
+                    self.budget.settle(reserved.pop(page_number),
+                                       provider.estimate_cost(1, usage) * provider.batch_job_price_factor)
+            if usage:
+                self.metrics.count(page_number, input_tokens=usage[0], output_tokens=usage[1])
+            table_file = None
+            try:
+                print(f"\n📊 Xử lý trang {page_number}...")
+                if content is None:
+                    print(f"  ❌ Trang {page_number} lỗi trong job batch: {error}")
+                else:
+                    data = self._finish_response(content, page_number, cache_keys.get(str(page_number)))
+                    table_file = self._save_ai_table(data, page_number)
+            finally:
+                self._finish_page(page_number, table_file)
+            finished.add(page_number)
+        if set(job["pages"]) <= finished:
+            self.manifest.remove_batch_job(job_id)
+    
+    def _wait_batch_job(self, provider, job_id, max_errors=5):
+        """Hỏi trạng thái job mỗi `batch_poll` giây tới khi kết thúc; bỏ qua lỗi mạng tạm thời"""
+        errors = 0
+        while True:
+            try:
+                done, status = provider.poll_batch_job(job_id)
+                errors = 0
+            except Exception as e:
+                errors += 1
+                if errors >= max_errors:
+                    raise
+                print(f"  ⚠️  Lỗi khi hỏi trạng thái job {job_id} ({type(e).__name__}: {e}), thử lại...")
+                done, status = False, None
+            if status:
+                print(f"  ⏳ Job {job_id}: {status}")
+            if done:
+                return
+            time.sleep(self.batch_poll)
+    
+    def _cleanup_temp(self):
+        """Dọn dẹp thư mục tạm"""
+        try:
+            if self.temp_dir.exists():
+                shutil.rmtree(self.temp_dir)
+                print("\n🧹 Đã dọn dẹp thư mục tạm")
+        except Exception as e:
+            print(f"⚠️  Không thể dọn dẹp thư mục tạm: {e}")
+
+
+def main(provider="anthropic", keep_temp=False):
+    """Hàm chính dùng chung; các script theo nhà cung cấp chỉ đổi giá trị mặc định"""
+    
+    parser = argparse.ArgumentParser(
+        description="Chuyển đổi PDF sang Excel bằng AI",
+        epilog="Ví dụ: python pipeline.py input.pdf --provider gemini,anthropic --workers 4"
+    )
+    parser.add_argument("input_pdf",
+                        help="File PDF đầu vào; hoặc thư mục, mẫu glob (đặt trong ngoặc kép, vd. \"hoadon/*.pdf\"), "
+                             "file danh sách .txt (mỗi dòng 1 file) để xử lý nhiều tài liệu")
+    parser.add_argument("api_key", nargs="?", default=None,
+                        help="API key của nhà cung cấp đầu tiên (tùy chọn, mặc định đọc biến môi trường)")
+    parser.add_argument("--provider", default=provider,
+                        help=f"Nhà cung cấp AI ({', '.join(PROVIDERS)}); nhiều nhà cung cấp cách nhau "
+                             f"dấu phẩy để chia trang, theo thứ tự ưu tiên (mặc định: {provider})")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Số trang xử lý song song (mặc định: 1 - tuần tự)")
+    parser.add_argument("--rpm", type=int, default=None,
+                        help="Giới hạn số request/phút (mặc định theo nhà cung cấp)")
+    parser.add_argument("--tpm", type=int, default=None,
+                        help="Giới hạn số token/phút (mặc định theo nhà cung cấp)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bỏ qua cache, luôn gọi lại API")
+    parser.add_argument("--cache-size-mb", type=int, default=500,
+                        help="Dung lượng tối đa của cache (MB, mặc định: 500)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Chạy tiếp lần trước: bỏ qua các trang đã xử lý xong")
+    parser.add_argument("--no-text-layer", action="store_true",
+                        help="Luôn gọi AI, không dùng lớp text có sẵn của PDF")
+    parser.add_argument("--no-optimize", action="store_true",
+                        help="Gửi ảnh PNG gốc như cũ, không thu nhỏ/nén ảnh")
+    parser.add_argument("--grayscale", action="store_true",
+                        help="Chuyển ảnh sang xám trước khi gửi AI")
+    parser.add_argument("--stream", action="store_true",
+                        help="Render trực tiếp từ PDF gốc, không tạo file trang/ảnh trung gian")
+    parser.add_argument("--render-workers", type=int, nargs="?", const=os.cpu_count() or 1, default=0,
+                        help="Render trước các trang trên N tiến trình riêng, song song với bước gọi API "
+                             "(không ghi N: bằng số nhân CPU; mặc định: 0 - render ngay trước khi gọi API)")
+    parser.add_argument("--async", dest="async_mode", action="store_true",
+                        help="Dùng asyncio: nhiều request cùng lúc mà không cần 1 luồng mỗi request")
+    parser.add_argument("--in-flight", type=int, default=16,
+                        help="Số request đồng thời ở chế độ --async (mặc định: 16); --workers là số luồng render")
+    parser.add_argument("--stream-response", action="store_true",
+                        help="Đọc response của AI dạng stream: hàng nào xong ghi ngay vào Excel, "
+                             "response bị cắt vẫn giữ các hàng đã nhận (không áp dụng cho --batch-pages)")
+    parser.add_argument("--tiles", type=int, default=1,
+                        help="Cắt mỗi trang gửi AI thành tối đa N dải ảnh ngang, gửi song song rồi ghép bảng "
+                             "(cho trang dài/dày đặc; mặc định: 1 - gửi cả trang)")
+    parser.add_argument("--batch-pages", type=int, default=1,
+                        help="Gộp tối đa K trang vào 1 request AI (mặc định: 1 - không gộp); "
+                             "số trang thực tế tự giảm theo dung lượng ảnh và giới hạn của model")
+    parser.add_argument("--batch-submit", action="store_true",
+                        help="Gửi mọi trang thành 1 job batch của nhà cung cấp (Claude, Gemini; rẻ hơn, "
+                             "chậm hơn) và chờ kết quả; --resume chờ tiếp job đã gửi")
+    parser.add_argument("--batch-job", default=None,
+                        help="Chờ và lấy kết quả của job batch có id này thay vì gửi job mới")
+    parser.add_argument("--batch-poll", type=float, default=60,
+                        help="Chu kỳ hỏi trạng thái job batch (giây, mặc định: 60)")
+    parser.add_argument("--pages", default=None,
+                        help="Chỉ xử lý các trang này, vd. 1-50,80 (mặc định: mọi trang)")
+    parser.add_argument("--max-pages", type=int, default=None,
+                        help="Ngân sách: số trang gửi AI tối đa trong lần chạy (trang lớp text/cache không tính)")
+    parser.add_argument("--max-cost", type=float, default=None,
+                        help="Ngân sách: chi phí API ước tính tối đa (USD) theo giá niêm yết của model")
+    parser.add_argument("--max-in-memory", type=int, default=None,
+                        help="Số trang tối đa nằm trong bộ nhớ cùng lúc (đã tách/render, chờ AI, chờ ghi); "
+                             "mặc định: gấp đôi --workers, hoặc --in-flight ở chế độ --async")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Ghi bộ đếm dạng Prometheus vào file này khi xong (vd. cho textfile collector)")
+    parser.add_argument("--open-docs", type=int, default=None,
+                        help="Chế độ nhiều tài liệu: số tài liệu mở cùng lúc (mặc định: bằng --workers)")
+    parser.add_argument("--connect-timeout", type=float, default=DEFAULT_CONNECT_TIMEOUT,
+                        help=f"Thời gian chờ kết nối API (giây, mặc định: {DEFAULT_CONNECT_TIMEOUT})")
+    parser.add_argument("--read-timeout", type=float, default=DEFAULT_READ_TIMEOUT,
+                        help=f"Thời gian chờ response API (giây, mặc định: {DEFAULT_READ_TIMEOUT})")
+    parser.add_argument("--gzip", action="store_true",
+                        help="Nén gzip thân request (chỉ dùng khi API/proxy chấp nhận Content-Encoding: gzip)")
+    args = parser.parse_args()
+    
+    input_pdf = args.input_pdf
+    
+    # Nhiều tài liệu: thư mục / glob / file danh sách
+    from multi_document import MultiDocumentRunner, collect_pdf_files, is_multi_document
+    pdf_files = None
+    if is_multi_document(input_pdf):
+        pdf_files = collect_pdf_files(input_pdf)
+        if not pdf_files:
+            print(f"❌ Không tìm thấy file PDF nào: {input_pdf}")
+            sys.exit(1)
+        if args.async_mode or args.batch_submit or args.batch_job:
+            print("❌ Chế độ nhiều tài liệu chưa hỗ trợ --async / --batch-submit, hãy dùng --workers")
+            sys.exit(1)
+    elif not os.path.exists(input_pdf):
+        print(f"❌ File không tồn tại: {input_pdf}")
+        sys.exit(1)
+    
+    try:
+        names = [name for name in args.provider.split(",") if name.strip()]
+        providers = [create_provider(name, args.api_key if i == 0 else None)
+                     for i, name in enumerate(names)]
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    
+    if (args.batch_submit or args.batch_job) and not providers[0].supports_batch_jobs:
+        print(f"❌ {providers[0].label} không hỗ trợ job batch (--batch-submit), chọn anthropic hoặc gemini")
+        sys.exit(1)
+    
+    if args.pages:
+        try:
+            args.pages = parse_page_ranges(args.pages)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+    
+    # Kiểm tra API key: không hỏi lại, dừng luôn để chạy tự động không bị treo chờ nhập
+    if not any(p.is_ready() for p in providers):
+        print("❌ Chưa có API key!")
+        print(f"ℹ️  Cách 1: Đặt biến môi trường: export {providers[0].key_env}='your_key'")
+        print("ℹ️  Cách 2: Truyền trực tiếp: python script.py input.pdf your_key")
+        sys.exit(1)
+    
+    options = dict(rpm=args.rpm, tpm=args.tpm,
+                   use_cache=not args.no_cache,
+                   cache_max_mb=args.cache_size_mb,
+                   resume=args.resume, stream=args.stream,
+                   use_text_layer=not args.no_text_layer,
+                   optimize_payload=not args.no_optimize,
+                   grayscale=args.grayscale,
+                   connect_timeout=args.connect_timeout,
+                   read_timeout=args.read_timeout, gzip_body=args.gzip,
+                   batch_pages=args.batch_pages, pages=args.pages,
+                   max_pages=args.max_pages, max_cost=args.max_cost,
+                   max_in_memory=args.max_in_memory, render_workers=args.render_workers,
+                   stream_response=args.stream_response, tiles=args.tiles)
+    
+    # Chạy converter
+    try:
+        if pdf_files is not None:
+            # --pages áp dụng cho từng tài liệu, ngân sách tính chung cho cả lần chạy
+            runner = MultiDocumentRunner(pdf_files, workers=args.workers, open_documents=args.open_docs,
+                                         metrics_file=args.metrics_file, provider=providers,
+                                         keep_temp=keep_temp, **options)
+            runner.run()
+            return
+        converter = PDFToExcelConverter(input_pdf, providers, workers=args.workers,
+                                        keep_temp=keep_temp,
+                                        async_mode=args.async_mode, in_flight=args.in_flight,
+                                        batch_submit=args.batch_submit, batch_job=args.batch_job,
+                                        batch_poll=args.batch_poll, metrics_file=args.metrics_file, **options)
+        converter.run_full_process()
+    except KeyboardInterrupt:
+        print("\n\n⚠️  Đã dừng bởi người dùng")
+
+
+if __name__ == "__main__":
+    main()
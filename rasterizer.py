@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Chuyển trang PDF sang ảnh trực tiếp từ file gốc, không qua file trung gian
+- Render theo lô trang bằng first_page/last_page (1 tiến trình poppler cho mỗi lô)
+- Mã hóa ảnh trong bộ nhớ (BytesIO) thay vì lưu PNG rồi đọc lại
+- Đọc trang PDF theo từng cửa sổ, bộ nhớ không tăng theo số trang của file
+"""
+
+import io
+import gc
+
+from pypdf import PdfReader
+from pdf2image import convert_from_path
+
+# Số trang render trong một lần gọi poppler
+DEFAULT_BATCH_SIZE = 8
+# Số trang đọc bằng cùng 1 PdfReader trước khi mở lại (bỏ cache object của pypdf)
+DEFAULT_WINDOW = 32
+
+
+def count_pages(pdf_path):
+    """Số trang của file PDF"""
+    # Truyền file handle: PdfReader(đường dẫn) đọc cả file vào bộ nhớ
+    with open(pdf_path, "rb") as f:
+        return len(PdfReader(f).pages)
+
+
+def iter_page_windows(pdf_path, page_numbers, window=DEFAULT_WINDOW):
+    """Sinh lần lượt danh sách [(số trang, trang pypdf)] của từng cửa sổ tối đa `window` trang.
+
+    pypdf giữ lại mọi object đã đọc (kể cả ảnh của trang scan) tới khi đóng reader,
+    nên mỗi cửa sổ mở 1 reader mới trên file handle và bỏ reader cũ. Người gọi phải
+    bỏ tham chiếu tới danh sách của cửa sổ trước khi lấy cửa sổ tiếp theo.
+    """
+    page_numbers = list(page_numbers)
+    for start in range(0, len(page_numbers), window):
+        with open(pdf_path, "rb") as f:
+            reader = PdfReader(f)
+            yield [(n, reader.pages[n - 1]) for n in page_numbers[start:start + window]]
+        # Trang và reader của pypdf tham chiếu vòng lẫn nhau, phải gom rác mới giải phóng được
+        del reader
+        gc.collect()
+
+
+def _page_runs(page_numbers, batch_size, key=None):
+    """Gom các số trang liên tiếp thành các đoạn (first, last) dài tối đa batch_size.
+
+    Nếu có `key`, chỉ gom các trang có cùng key (vd. cùng DPI).
+    """
+    runs = []
+    for n in sorted(page_numbers):
+        if (runs and n == runs[-1][1] + 1 and n - runs[-1][0] < batch_size
+                and (key is None or key(n) == key(runs[-1][0]))):
+            runs[-1][1] = n
+        else:
+            runs.append([n, n])
+    return runs
+
+
+def iter_page_images(pdf_path, dpi=200, batch_size=DEFAULT_BATCH_SIZE, total_pages=None,
+                     page_numbers=None, page_dpi=None):
+    """Sinh lần lượt (số trang, ảnh PIL) theo thứ tự trang.
+
+    Mỗi đoạn tối đa `batch_size` trang liên tiếp được render bằng một lệnh
+    pdftoppm duy nhất; ảnh được truyền qua pipe nên không ghi file nào ra đĩa.
+    `page_numbers` giới hạn các trang cần render (mặc định: tất cả),
+    `page_dpi` là dict {số trang: DPI} để render mỗi trang một DPI riêng.
+    """
+    page_dpi = page_dpi or {}
+    if page_numbers is None:
+        if total_pages is None:
+            total_pages = count_pages(pdf_path)
+        page_numbers = range(1, total_pages + 1)
+
+    def dpi_of(n):
+        return page_dpi.get(n, dpi)
+
+    for first, last in _page_runs(page_numbers, batch_size, key=dpi_of):
+        images = convert_from_path(str(pdf_path), dpi=dpi_of(first), first_page=first, last_page=last)
+        images.reverse()
+        n = first
+        while images:
+            # Lấy ảnh ra khỏi danh sách: ảnh đã giao cho người gọi không còn bị lô giữ lại
+            yield n, images.pop()
+            n += 1
+
+
+def encode_image(image, fmt="PNG", **save_kwargs):
+    """Mã hóa ảnh PIL thành bytes trong bộ nhớ"""
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **save_kwargs)
+    return buffer.getvalue()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Bộ giới hạn tốc độ gọi API dùng chung cho các converter
+- Token bucket cho số request/phút và số token/phút của từng nhà cung cấp
+- Retry với exponential backoff có jitter khi gặp 429/5xx
+- Tôn trọng header Retry-After do server trả về
+- Có bản async (call_async) chờ bằng asyncio.sleep, không chặn event loop
+"""
+
+import time
+import random
+import asyncio
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+
+# Lỗi mạng nên thử lại; thêm lỗi của httpx (SDK Gemini dùng httpx) nếu có cài
+RETRY_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+try:
+    import httpx
+    RETRY_EXCEPTIONS += (httpx.TransportError,)
+except ImportError:
+    pass
+
+# Giới hạn mặc định theo nhà cung cấp: (requests/phút, tokens/phút)
+# None = không giới hạn. Có thể ghi đè bằng --rpm / --tpm
+PROVIDER_LIMITS = {
+    "anthropic": (50, 30000),
+    "deepseek": (60, None),
+    "gemini": (30, 250000),
+    "mock": (None, None),
+}
+
+# Các mã HTTP nên thử lại
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504, 529}
+
+
+class TokenBucket:
+    """Token bucket an toàn đa luồng, nạp lại liên tục theo thời gian"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        # Mặc định chỉ cho phép "burst" tương đương 1 giây để không vượt quota
+        # khi server đo theo cửa sổ trượt
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """Chờ tới khi đủ token rồi trừ đi `amount`.
+
+        Yêu cầu lớn hơn capacity vẫn được phép (bucket bị âm) để không
+        bị treo vĩnh viễn; các lần gọi sau sẽ phải chờ bù lại.
+        """
+        needed = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.level >= needed:
+                    self.level -= amount
+                    return
+                wait = (needed - self.level) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self, amount=1):
+        """Lấy `amount` token nếu đủ ngay, không chờ; trả về True nếu lấy được"""
+        needed = min(amount, self.capacity)
+        with self.lock:
+            self._refill()
+            if self.level >= needed:
+                self.level -= amount
+                return True
+            return False
+
+    def wait_time(self, amount=1):
+        """Số giây phải chờ nếu lấy `amount` token ngay bây giờ (0 = không phải chờ)"""
+        needed = min(amount, self.capacity)
+        with self.lock:
+            self._refill()
+            return max(0.0, (needed - self.level) / self.rate)
+
+    def adjust(self, delta):
+        """Điều chỉnh mức token (dương = hoàn lại, âm = trừ thêm)"""
+        with self.lock:
+            self._refill()
+            self.level = min(self.capacity, self.level + delta)
+
+
+class RateLimiter:
+    """Giới hạn requests/phút, tokens/phút và xử lý retry cho một nhà cung cấp"""
+
+    def __init__(self, provider, rpm=None, tpm=None, max_retries=5,
+                 base_delay=1.0, max_delay=60.0, utilization=0.95):
+        default_rpm, default_tpm = PROVIDER_LIMITS.get(provider, (None, None))
+        rpm = rpm or default_rpm
+        tpm = tpm or default_tpm
+
+        self.provider = provider
+        self.rpm = rpm
+        self.tpm = tpm
+        # Chỉ dùng ~95% quota để chừa chỗ cho sai số ước lượng token
+        self.request_bucket = TokenBucket(rpm * utilization) if rpm else None
+        self.token_bucket = TokenBucket(tpm * utilization) if tpm else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        # Khi bị 429, tất cả các luồng cùng tạm dừng tới thời điểm này
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _wait_if_blocked(self):
+        with self._lock:
+            wait = self._blocked_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _block_for(self, seconds):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def acquire(self, estimated_tokens=0):
+        """Chờ tới khi được phép gửi 1 request ước tính `estimated_tokens` token"""
+        self._wait_if_blocked()
+        if self.request_bucket:
+            self.request_bucket.acquire(1)
+        if self.token_bucket and estimated_tokens:
+            self.token_bucket.acquire(estimated_tokens)
+
+    async def acquire_async(self, estimated_tokens=0):
+        """Bản async của acquire: chờ bằng asyncio.sleep thay vì chặn cả luồng"""
+        while True:
+            wait = self.wait_time(estimated_tokens)
+            if wait <= 0 and self._try_acquire(estimated_tokens):
+                return
+            await asyncio.sleep(max(wait, 0.01))
+
+    def _try_acquire(self, estimated_tokens):
+        if self.request_bucket and not self.request_bucket.try_acquire(1):
+            return False
+        if self.token_bucket and estimated_tokens and not self.token_bucket.try_acquire(estimated_tokens):
+            # Không đủ token: trả lại lượt request vừa lấy
+            if self.request_bucket:
+                self.request_bucket.adjust(1)
+            return False
+        return True
+
+    def wait_time(self, estimated_tokens=0):
+        """Ước tính số giây một request mới phải chờ quota (dùng để chọn provider)"""
+        with self._lock:
+            wait = max(0.0, self._blocked_until - time.monotonic())
+        if self.request_bucket:
+            wait = max(wait, self.request_bucket.wait_time(1))
+        if self.token_bucket and estimated_tokens:
+            wait = max(wait, self.token_bucket.wait_time(estimated_tokens))
+        return wait
+
+    def record_usage(self, actual_tokens, estimated_tokens=0):
+        """Bù chênh lệch giữa số token thực tế (từ usage của API) và ước tính"""
+        if self.token_bucket and actual_tokens:
+            self.token_bucket.adjust(estimated_tokens - actual_tokens)
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Thời gian chờ trước lần thử lại thứ `attempt` (bắt đầu từ 0)"""
+        # Full jitter: ngẫu nhiên trong [0, base * 2^attempt]
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(self, send, estimated_tokens=0, stats=None):
+        """Gọi `send()` (trả về requests.Response) có giới hạn tốc độ và retry.
+
+        Trả về response cuối cùng; người gọi vẫn tự raise_for_status().
+        `stats` (dict, tùy chọn) được cộng thêm "retries" và "wait" (giây chờ quota/backoff).
+        """
+        stats = {} if stats is None else stats
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            self.acquire(estimated_tokens)
+            _add_stat(stats, "wait", time.perf_counter() - start)
+            try:
+                response = send()
+            except RETRY_EXCEPTIONS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                print(f"  🔁 Lỗi kết nối ({type(e).__name__}), thử lại sau {delay:.1f}s...")
+                self._sleep_retry(stats, delay)
+                continue
+            except Exception as e:
+                # Lỗi từ SDK (vd. google.genai.errors.APIError) có thuộc tính code
+                status = getattr(e, "code", None)
+                if status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    raise
+                self._sleep_retry(stats, self._retry_delay(status, attempt,
+                                                           _retry_after_from(getattr(e, "response", None))))
+                continue
+
+            status = getattr(response, "status_code", None)
+            if status not in RETRY_STATUSES or attempt >= self.max_retries:
+                return response
+            delay = self._retry_delay(status, attempt, _retry_after_from(response))
+            # Response stream chưa đọc thân: đóng để trả kết nối về pool
+            close = getattr(response, "close", None)
+            if callable(close):
+                close()
+            self._sleep_retry(stats, delay)
+
+    async def call_async(self, send, estimated_tokens=0, stats=None):
+        """Bản async của call: `send()` trả về coroutine (httpx / client.aio của Gemini)"""
+        stats = {} if stats is None else stats
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            await self.acquire_async(estimated_tokens)
+            _add_stat(stats, "wait", time.perf_counter() - start)
+            try:
+                response = await send()
+            except RETRY_EXCEPTIONS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                print(f"  🔁 Lỗi kết nối ({type(e).__name__}), thử lại sau {delay:.1f}s...")
+                await self._sleep_retry_async(stats, delay)
+                continue
+            except Exception as e:
+                status = getattr(e, "code", None)
+                if status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    raise
+                await self._sleep_retry_async(stats, self._retry_delay(
+                    status, attempt, _retry_after_from(getattr(e, "response", None))))
+                continue
+
+            status = getattr(response, "status_code", None)
+            if status not in RETRY_STATUSES or attempt >= self.max_retries:
+                return response
+            delay = self._retry_delay(status, attempt, _retry_after_from(response))
+            aclose = getattr(response, "aclose", None)
+            if callable(aclose):
+                await aclose()
+            await self._sleep_retry_async(stats, delay)
+
+    def _sleep_retry(self, stats, delay):
+        _add_stat(stats, "retries", 1)
+        _add_stat(stats, "wait", delay)
+        time.sleep(delay)
+
+    async def _sleep_retry_async(self, stats, delay):
+        _add_stat(stats, "retries", 1)
+        _add_stat(stats, "wait", delay)
+        await asyncio.sleep(delay)
+
+    def _retry_delay(self, status, attempt, retry_after):
+        """Tính thời gian chờ trước lần thử lại (429 thì chặn mọi luồng trong thời gian đó)"""
+        delay = self.backoff_delay(attempt, retry_after)
+        if status == 429:
+            # Dừng toàn bộ các luồng, tránh tiếp tục dội request vào quota đã cạn
+            self._block_for(delay)
+        print(f"  🔁 API trả về {status}, thử lại sau {delay:.1f}s "
+              f"(lần {attempt + 1}/{self.max_retries})...")
+        return delay
+
+
+def _add_stat(stats, key, value):
+    stats[key] = stats.get(key, 0) + value
+
+
+def _retry_after_from(response):
+    """Đọc header Retry-After (số giây hoặc HTTP date), trả về số giây hoặc None"""
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(text="", images=0, tokens_per_image=1600):
+    """Ước lượng thô số token đầu vào: ~4 ký tự/token + chi phí cố định mỗi ảnh"""
+    return len(text) // 4 + images * tokens_per_image
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Bước render chạy riêng trên pool tiến trình, tách khỏi bước gọi API (--render-workers)
+- Mỗi tiến trình render 1 trang (pdftoppm) rồi thu nhỏ/mã hóa ảnh luôn,
+  chỉ bytes ảnh đã nén được gửi về tiến trình chính
+- Các trang sắp tới được render trước qua hàng đợi có giới hạn: luồng gọi API
+  không phải chờ render, CPU không rảnh trong lúc chờ mạng
+"""
+
+import io
+import time
+import multiprocessing
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+from pdf2image import convert_from_path
+
+from rasterizer import encode_image
+from payload_optimizer import optimize_image
+
+# Ảnh trang đã render và mã hóa trong pool; `provider` là provider đã tối ưu ảnh cho,
+# None = PNG gốc không tối ưu (dùng được cho mọi provider, hoặc tối ưu lại sau)
+RenderedPage = namedtuple(
+    "RenderedPage", ["provider", "data", "mime_type", "format", "size", "baseline_bytes", "wall", "cpu"]
+)
+
+
+def render_page(pdf_path, page_number, dpi, provider=None, grayscale=False, dense=False):
+    """Render 1 trang và mã hóa ảnh (chạy trong tiến trình của pool), trả về RenderedPage"""
+    wall, cpu = time.perf_counter(), time.process_time()
+    images = convert_from_path(str(pdf_path), dpi=dpi, first_page=page_number, last_page=page_number)
+    if not images:
+        raise ValueError(f"Không thể chuyển trang {page_number} sang ảnh")
+    image = images[0]
+    try:
+        if provider is None:
+            data = encode_image(image, "PNG")
+            rendered = (data, "image/png", "PNG", image.size, len(data))
+        else:
+            optimized = optimize_image(image, provider, grayscale=grayscale, dense=dense)
+            rendered = (optimized.data, optimized.mime_type, optimized.format, optimized.size,
+                        optimized.baseline_bytes)
+    finally:
+        image.close()
+    return RenderedPage(provider, *rendered, time.perf_counter() - wall, time.process_time() - cpu)
+
+
+def decode_page(rendered):
+    """Mở lại ảnh PIL từ bytes của RenderedPage (khi cần mã hóa lại cho provider khác)"""
+    return Image.open(io.BytesIO(rendered.data))
+
+
+class RenderPool:
+    """Pool tiến trình render, chỉ khởi động khi có trang đầu tiên cần render.
+
+    Dùng chung được cho nhiều converter (nhiều tài liệu, dịch vụ); close() dừng các
+    tiến trình, lần submit sau sẽ khởi động lại.
+    """
+
+    def __init__(self, workers):
+        self.workers = max(1, int(workers))
+        self.executor = None
+
+    def submit(self, *args, **kwargs):
+        """Render trang trong pool (tham số như render_page), trả về Future"""
+        if self.executor is None:
+            # spawn: tiến trình con không kế thừa luồng/kết nối HTTP của tiến trình chính
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return self.executor.submit(render_page, *args, **kwargs)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+
+def render_ahead(items, submit, lookahead):
+    """Sinh lại các mục của `items` theo đúng thứ tự, kèm Future render (hoặc None) của mục.
+
+    `submit(mục)` được gọi trước khi mục tới lượt, tối đa `lookahead` mục đi trước
+    mục đang được lấy (hàng đợi có giới hạn: người gọi lấy chậm thì render cũng dừng).
+    """
+    pending = deque()
+    for item in items:
+        pending.append((item, submit(item)))
+        if len(pending) > lookahead:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
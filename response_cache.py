@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Cache kết quả OCR của AI trên đĩa, định danh theo nội dung
+Key = SHA-256(ảnh trang + model id + prompt + version schema bảng), value = JSON {"headers", "rows"}
+Tự xóa các mục ít dùng nhất (LRU) khi vượt quá dung lượng cho phép: thứ tự dùng và tổng dung lượng
+giữ trong bộ nhớ, chỉ quét thư mục 1 lần lúc khởi tạo
+"""
+
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """Cache JSON trả về từ AI, an toàn khi dùng từ nhiều luồng"""
+
+    def __init__(self, cache_dir, max_bytes=500 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Chỉ mục LRU {key: dung lượng file}, mục dùng lâu nhất ở đầu; tổng dung lượng các mục
+        self.index = OrderedDict()
+        self.total = 0
+        self._scan()
+
+    def _scan(self):
+        """Dựng chỉ mục từ các file cache có sẵn, theo thời gian dùng gần nhất (mtime)"""
+        entries = []
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        entries.sort()
+        for _, key, size in entries:
+            self.index[key] = size
+            self.total += size
+
+    @staticmethod
+    def make_key(image_bytes, model, prompt, schema_version):
+        """Tạo key từ nội dung ảnh, model, prompt và version schema bảng (table_schema.SCHEMA_VERSION)"""
+        h = hashlib.sha256()
+        h.update(image_bytes)
+        h.update(b"\0" + model.encode("utf-8"))
+        h.update(b"\0" + prompt.encode("utf-8"))
+        h.update(b"\0" + schema_version.encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key):
+        """Trả về dữ liệu đã cache hoặc None"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        # Cập nhật thời gian truy cập để giữ thứ tự LRU cho lần khởi tạo sau
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+            if key in self.index:
+                self.index.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        """Lưu dữ liệu vào cache (ghi file tạm rồi rename để tránh file hỏng)"""
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"  ⚠️  Không thể ghi cache: {e}")
+            return
+        with self.lock:
+            self.total += size - self.index.pop(key, 0)
+            self.index[key] = size
+            self._evict()
+
+    def _evict(self):
+        """Xóa các mục lâu không dùng nhất khi tổng dung lượng vượt max_bytes (gọi khi đang giữ lock)"""
+        while self.total > self.max_bytes and self.index:
+            key, size = self.index.popitem(last=False)
+            self.total -= size
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
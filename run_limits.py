@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Giới hạn của một lần chạy không cần người trông
+- Chọn trang cần xử lý: --pages 1-50,80
+- Ngân sách: số trang gửi AI tối đa (--max-pages), chi phí ước tính tối đa (--max-cost, USD)
+Trang vượt ngân sách được đánh dấu lỗi để chạy tiếp bằng --resume
+"""
+
+import threading
+
+
+def parse_page_ranges(spec):
+    """Chuỗi dạng "1-50,80" → danh sách số trang tăng dần, không trùng"""
+    pages = set()
+    for part in str(spec).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, sep, end = part.partition("-")
+        try:
+            start = int(start)
+            end = int(end) if sep else start
+        except ValueError:
+            raise ValueError(f"Khoảng trang không hợp lệ: '{part}' (ví dụ đúng: 1-50,80)")
+        if start < 1:
+            raise ValueError(f"Khoảng trang không hợp lệ: '{part}' (trang bắt đầu từ 1)")
+        if end < start:
+            raise ValueError(f"Khoảng trang không hợp lệ: '{part}' (trang cuối nhỏ hơn trang đầu)")
+        pages.update(range(start, end + 1))
+    if not pages:
+        raise ValueError(f"Không có trang nào trong '{spec}'")
+    return sorted(pages)
+
+
+class RunBudget:
+    """Ngân sách dùng chung cho mọi luồng / request của 1 lần chạy.
+
+    Mỗi lần gọi AI giữ chỗ trước (reserve) theo số trang và chi phí ước tính,
+    sau khi có response thì tính lại theo số token thực tế (settle).
+    Hết ngân sách thì mọi lần giữ chỗ sau đó đều bị từ chối.
+    """
+
+    def __init__(self, max_pages=None, max_cost=None):
+        self.max_pages = max_pages
+        self.max_cost = max_cost
+        self.pages = 0
+        self.cost = 0.0
+        self.exhausted = False
+        self.lock = threading.Lock()
+
+    @property
+    def limited(self):
+        return self.max_pages is not None or self.max_cost is not None
+
+    def reserve(self, pages, cost):
+        """Giữ chỗ cho `pages` trang với chi phí ước tính `cost`; False nếu vượt ngân sách"""
+        with self.lock:
+            if self.exhausted:
+                return False
+            if (self.max_pages is not None and self.pages + pages > self.max_pages) or \
+                    (self.max_cost is not None and self.cost + cost > self.max_cost):
+                self.exhausted = True
+                return False
+            self.pages += pages
+            self.cost += cost
+            return True
+
+    def settle(self, reserved_cost, actual_cost):
+        """Thay chi phí ước tính bằng chi phí theo token thực tế"""
+        with self.lock:
+            self.cost += actual_cost - reserved_cost
+
+    def release(self, pages, cost):
+        """Trả lại phần đã giữ chỗ khi request không thành công"""
+        with self.lock:
+            self.pages -= pages
+            self.cost -= cost
+
+    def describe(self):
+        """Mô tả ngắn mức đã dùng / giới hạn"""
+        parts = [f"{self.pages} trang AI" + (f"/{self.max_pages}" if self.max_pages is not None else "")]
+        cost = f"~${self.cost:.4f}"
+        if self.max_cost is not None:
+            cost += f"/${self.max_cost:g}"
+        parts.append(cost)
+        return ", ".join(parts)
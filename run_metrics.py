@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Đo thời gian và số liệu của 1 lần chạy, theo từng trang và từng bước
+- Bước: tách trang, lớp text, render, mã hóa ảnh, băm, cache, chờ quota, gọi API, parse, ghi Excel...
+- Mỗi bước ghi thời gian thực (wall) và CPU của luồng đang chạy
+- Bộ đếm: số request, số lần thử lại, số lần gọi tiếp bảng bị cắt, cache hit, byte gửi/nhận, token vào/ra
+- Xuất báo cáo JSON/CSV và bộ đếm dạng Prometheus (text exposition)
+"""
+
+import csv
+import json
+import time
+import threading
+from copy import deepcopy
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+# Thứ tự cột trong báo cáo CSV
+STAGES = ("split", "prepass", "hash", "render", "encode", "cache", "rate_wait", "request",
+          "parse", "write")
+COUNTERS = ("requests", "retries", "continuations", "cache_hits", "image_bytes", "request_bytes",
+            "response_bytes", "input_tokens", "output_tokens")
+
+
+def _pages(pages):
+    return (pages,) if isinstance(pages, int) else tuple(pages)
+
+
+class RunMetrics:
+    """Số liệu của 1 lần chạy, an toàn khi ghi từ nhiều luồng.
+
+    Việc của nhiều trang cùng lúc (request gộp --batch-pages) được chia đều cho các trang.
+    `keep_pages=False` chỉ giữ tổng (dùng cho số liệu cộng dồn của dịch vụ / nhiều tài liệu).
+    """
+
+    def __init__(self, keep_pages=True):
+        self.keep_pages = keep_pages
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.pages = {}
+        # Bước không thuộc trang nào (vd. đóng file Excel, chờ job batch)
+        self.run_stages = {}
+        self.totals = {"stages": {}, "counters": dict.fromkeys(COUNTERS, 0), "methods": {}, "pages": 0}
+
+    def _page(self, page_number):
+        page = self.pages.get(page_number)
+        if page is None:
+            page = self.pages[page_number] = {"stages": {}, "counters": dict.fromkeys(COUNTERS, 0),
+                                              "method": None, "provider": None, "status": None}
+        return page
+
+    @contextmanager
+    def stage(self, pages, name):
+        """Đo 1 bước cho 1 trang (số trang) hoặc nhiều trang (danh sách), None = cả lần chạy"""
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.add_time(pages, name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def add_time(self, pages, name, wall, cpu=0.0):
+        with self.lock:
+            _add_stage(self.totals["stages"], name, wall, cpu)
+            if pages is None:
+                _add_stage(self.run_stages, name, wall, cpu)
+                return
+            if not self.keep_pages:
+                return
+            pages = _pages(pages)
+            for page_number in pages:
+                _add_stage(self._page(page_number)["stages"], name, wall / len(pages), cpu / len(pages))
+
+    def count(self, pages, **counters):
+        """Cộng bộ đếm (requests, retries, ..., output_tokens) cho 1 hoặc nhiều trang"""
+        with self.lock:
+            for key, value in counters.items():
+                self.totals["counters"][key] = self.totals["counters"].get(key, 0) + value
+            if not self.keep_pages or pages is None:
+                return
+            pages = _pages(pages)
+            for page_number in pages:
+                page_counters = self._page(page_number)["counters"]
+                for key, value in counters.items():
+                    page_counters[key] = page_counters.get(key, 0) + value / len(pages)
+
+    def finish_page(self, page_number, status, method=None, provider=None):
+        """Ghi nhận kết quả cuối của 1 trang (done/partial/failed/resumed) và đường xử lý (text/ai)"""
+        with self.lock:
+            self.totals["pages"] += 1
+            key = f"{method or 'none'}:{status}"
+            self.totals["methods"][key] = self.totals["methods"].get(key, 0) + 1
+            if self.keep_pages:
+                self._page(page_number).update(status=status, method=method, provider=provider)
+
+    def merge(self, other):
+        """Cộng dồn tổng của 1 lần chạy khác (vd. 1 job của dịch vụ)"""
+        with other.lock:
+            totals = deepcopy(other.totals)
+        with self.lock:
+            for name, stage in totals["stages"].items():
+                _add_stage(self.totals["stages"], name, stage["wall"], stage["cpu"], stage["calls"])
+            for key, value in totals["counters"].items():
+                self.totals["counters"][key] = self.totals["counters"].get(key, 0) + value
+            for key, value in totals["methods"].items():
+                self.totals["methods"][key] = self.totals["methods"].get(key, 0) + value
+            self.totals["pages"] += totals["pages"]
+
+    def report(self, **info):
+        """Báo cáo dạng dict (JSON được): thông tin lần chạy, tổng, từng trang"""
+        with self.lock:
+            return {
+                **info,
+                "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                "elapsed_seconds": round(time.time() - self.started, 3),
+                "totals": deepcopy(self.totals),
+                "run_stages": deepcopy(self.run_stages),
+                "pages": {str(p): deepcopy(self.pages[p]) for p in sorted(self.pages)}
+            }
+
+    def write_reports(self, directory, stem, **info):
+        """Ghi báo cáo <stem>.json và <stem>.csv (1 dòng mỗi trang); trả về (file json, file csv)"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        report = self.report(**info)
+        json_file = directory / f"{stem}.json"
+        with open(json_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        csv_file = directory / f"{stem}.csv"
+        with open(csv_file, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["page", "status", "method", "provider"]
+                            + [f"{s}_{kind}" for s in STAGES for kind in ("wall", "cpu")] + list(COUNTERS))
+            for page_number, page in report["pages"].items():
+                stages = page["stages"]
+                writer.writerow(
+                    [page_number, page["status"], page["method"], page["provider"]]
+                    + [round(stages.get(s, {}).get(kind, 0.0), 6) for s in STAGES for kind in ("wall", "cpu")]
+                    + [round(page["counters"].get(c, 0), 3) for c in COUNTERS]
+                )
+        return json_file, csv_file
+
+    def prometheus_text(self, prefix="pdf2excel"):
+        """Bộ đếm cộng dồn theo định dạng text của Prometheus"""
+        with self.lock:
+            totals = deepcopy(self.totals)
+        lines = [
+            f"# HELP {prefix}_stage_seconds_total Thời gian theo bước xử lý",
+            f"# TYPE {prefix}_stage_seconds_total counter",
+        ]
+        for name, stage in sorted(totals["stages"].items()):
+            for kind in ("wall", "cpu"):
+                lines.append(f'{prefix}_stage_seconds_total{{stage="{name}",clock="{kind}"}} {stage[kind]:.6f}')
+        lines += [f"# TYPE {prefix}_stage_calls_total counter"]
+        for name, stage in sorted(totals["stages"].items()):
+            lines.append(f'{prefix}_stage_calls_total{{stage="{name}"}} {stage["calls"]}')
+        lines += [f"# TYPE {prefix}_pages_total counter"]
+        for key, value in sorted(totals["methods"].items()):
+            method, status = key.split(":")
+            lines.append(f'{prefix}_pages_total{{method="{method}",status="{status}"}} {value}')
+        for key in COUNTERS:
+            lines += [f"# TYPE {prefix}_{key}_total counter",
+                      f"{prefix}_{key}_total {totals['counters'].get(key, 0)}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix="pdf2excel"):
+        """Ghi file bộ đếm (vd. cho textfile collector của node_exporter)"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_text(self.prometheus_text(prefix), encoding="utf-8")
+        tmp_path.replace(path)
+        return path
+
+    def stage_summary(self):
+        """Chuỗi ngắn: tổng thời gian thực theo bước, bước tốn nhiều nhất đứng trước"""
+        with self.lock:
+            stages = sorted(self.totals["stages"].items(), key=lambda item: -item[1]["wall"])
+        return ", ".join(f"{name} {stage['wall']:.2f}s" for name, stage in stages if stage["wall"] >= 0.005)
+
+
+def message_sizes(response, content=""):
+    """(byte gửi đi, byte nhận về) của 1 request.
+
+    Đọc thân request/response thật của requests/httpx (sau gzip nếu có); SDK không lộ
+    thân request (Gemini) thì byte gửi là 0 và byte nhận ước tính theo text model trả về.
+    """
+    sent = request_size(response)
+    received = getattr(response, "content", None)
+    if not isinstance(received, (bytes, str)):
+        received = content or ""
+    if isinstance(received, str):
+        received = received.encode("utf-8")
+    return sent, len(received)
+
+
+def request_size(response):
+    """Số byte thân request của `response` (requests/httpx, sau gzip nếu có); 0 nếu SDK không lộ thân request.
+
+    Không đọc thân response nên dùng được cho response stream đã đọc hết bằng iter_stream.
+    """
+    request = getattr(response, "request", None)
+    body = getattr(request, "body", None)
+    if body is None and request is not None:
+        try:
+            body = request.content
+        except Exception:
+            body = None
+    return len(body) if isinstance(body, (bytes, str)) else 0
+
+
+def _add_stage(stages, name, wall, cpu, calls=1):
+    stage = stages.get(name)
+    if stage is None:
+        stage = stages[name] = {"wall": 0.0, "cpu": 0.0, "calls": 0}
+    stage["wall"] += wall
+    stage["cpu"] += cpu
+    stage["calls"] += calls
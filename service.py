@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Chạy công cụ chuyển đổi PDF sang Excel như 1 dịch vụ thường trực (HTTP)
+- Import thư viện, tạo client/pool kết nối AI, rate limiter và cache 1 lần khi khởi động
+- Mỗi job chỉ còn chi phí tạo converter, không phải khởi động lại Python
+- API: gửi file (submit), xem trạng thái (status), tải file Excel kết quả (download)
+
+Cách dùng:
+    python service.py --provider gemini --port 8080 --jobs 2 --workers 4
+    curl --data-binary @input.pdf "http://127.0.0.1:8080/jobs?name=input.pdf"
+    curl http://127.0.0.1:8080/jobs/<id>
+    curl -o ketqua.xlsx http://127.0.0.1:8080/jobs/<id>/result
+"""
+
+import re
+import json
+import time
+import uuid
+import queue
+import shutil
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from pipeline import PDFToExcelConverter
+from providers import create_provider, PROVIDERS
+from http_session import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from rate_limiter import RateLimiter
+from response_cache import ResponseCache
+from run_limits import parse_page_ranges
+from run_metrics import RunMetrics
+from render_pool import RenderPool
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+class ConversionService:
+    """Hàng đợi job chuyển đổi dùng chung provider, rate limiter và cache giữa các job.
+
+    `job_slots` job chạy cùng lúc, mỗi job xử lý `workers` trang song song.
+    Có thể dùng trực tiếp trong Python (submit/status/result_path) hoặc qua HTTP (serve).
+    """
+
+    def __init__(self, provider="anthropic", output_dir="service_output", job_slots=2, workers=4,
+                 rpm=None, tpm=None, use_cache=True, cache_max_mb=500, max_pages=None, max_cost=None,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 gzip_body=False, render_workers=0, **converter_kwargs):
+        self.output_dir = Path(output_dir)
+        self.jobs_dir = self.output_dir / "jobs"
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.job_slots = max(1, int(job_slots))
+        self.workers = max(1, int(workers))
+        self.converter_kwargs = converter_kwargs
+
+        # Trạng thái "nóng" dùng chung mọi job (converter đọc qua share_from=self)
+        if not isinstance(provider, (list, tuple)):
+            provider = [provider]
+        self.providers = [create_provider(p) if isinstance(p, str) else p for p in provider]
+        # Mỗi trang đang xử lý giữ 1 kết nối, --tiles: mỗi dải 1 kết nối (như pipeline.py)
+        pool_size = self.job_slots * self.workers * max(1, int(converter_kwargs.get("tiles", 1)))
+        for p in self.providers:
+            p.configure_http(pool_size=pool_size, connect_timeout=connect_timeout,
+                             read_timeout=read_timeout, gzip_body=gzip_body)
+        self.rate_limiters = {p.name: RateLimiter(p.name, rpm=rpm, tpm=tpm) for p in self.providers}
+        self.cache = ResponseCache(self.output_dir / "cache", max_bytes=cache_max_mb * 1024 * 1024) \
+            if use_cache else None
+        # Ngân sách của từng job (mặc định không giới hạn): mỗi job có RunBudget riêng,
+        # job hết ngân sách không chặn các job sau
+        self.max_pages = max_pages
+        self.max_cost = max_cost
+        # Pool tiến trình render dùng chung mọi job (--render-workers), chạy tới khi tắt dịch vụ
+        self.render_pool = RenderPool(render_workers) if render_workers else None
+        # Số liệu cộng dồn mọi job, xem qua GET /metrics (báo cáo từng job nằm trong thư mục job)
+        self.metrics = RunMetrics(keep_pages=False)
+
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.threads = []
+
+    def start(self):
+        """Khởi động các luồng chạy job"""
+        for i in range(self.job_slots):
+            thread = threading.Thread(target=self._worker, name=f"job-{i + 1}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, pdf_bytes, filename="input.pdf", pages=None):
+        """Nhận nội dung file PDF, xếp vào hàng đợi và trả về id job
+
+        `pages`: chỉ xử lý các trang này (chuỗi "1-50,80" hoặc danh sách số trang).
+        """
+        if isinstance(pages, str):
+            pages = parse_page_ranges(pages)
+        job_id = uuid.uuid4().hex[:12]
+        job_dir = self.jobs_dir / job_id
+        job_dir.mkdir(parents=True)
+        # Chỉ giữ phần tên file an toàn, dùng làm tên file PDF và thư mục kết quả
+        name = re.sub(r"[^\w.\-]", "_", Path(filename).name) or "input.pdf"
+        if not name.lower().endswith(".pdf"):
+            name += ".pdf"
+        input_pdf = job_dir / name
+        input_pdf.write_bytes(pdf_bytes)
+
+        with self.lock:
+            self.jobs[job_id] = {
+                "id": job_id,
+                "name": name,
+                "input": input_pdf,
+                "pages_selected": pages,
+                "status": STATUS_QUEUED,
+                "submitted": datetime.now().isoformat(timespec="seconds"),
+                "started": None,
+                "finished": None,
+                "seconds": None,
+                "result": None,
+                "error": None,
+                "converter": None,
+            }
+        self.queue.put(job_id)
+        print(f"📥 Job {job_id}: {name} ({len(pdf_bytes)} bytes), hàng đợi {self.queue.qsize()}")
+        return job_id
+
+    def status(self, job_id):
+        """Trạng thái job (dict JSON được), None nếu không có job"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            info = {key: value for key, value in job.items()
+                    if key not in ("input", "converter", "result", "pages_selected")}
+            info["has_result"] = job["result"] is not None
+            converter = job["converter"]
+        if converter is not None and converter.manifest is not None:
+            info["pages"] = dict(converter.manifest.summary(converter.page_numbers),
+                                 total=len(converter.page_numbers))
+        return info
+
+    def prometheus_text(self):
+        """Bộ đếm của dịch vụ (số job theo trạng thái, hàng đợi) và số liệu cộng dồn các job"""
+        with self.lock:
+            statuses = [job["status"] for job in self.jobs.values()]
+        lines = ["# TYPE pdf2excel_jobs gauge"]
+        for status in (STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED):
+            lines.append(f'pdf2excel_jobs{{status="{status}"}} {statuses.count(status)}')
+        return "\n".join(lines) + "\n" + self.metrics.prometheus_text()
+
+    def list_jobs(self):
+        with self.lock:
+            job_ids = list(self.jobs)
+        return [self.status(job_id) for job_id in job_ids]
+
+    def result_path(self, job_id):
+        """File Excel kết quả của job đã xong, None nếu chưa có"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job["result"] if job else None
+
+    def delete(self, job_id):
+        """Xóa job đã kết thúc cùng các file của nó; False nếu job không có hoặc đang chạy"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] in (STATUS_QUEUED, STATUS_RUNNING):
+                return False
+            del self.jobs[job_id]
+        shutil.rmtree(self.jobs_dir / job_id, ignore_errors=True)
+        return True
+
+    def _worker(self):
+        while True:
+            job_id = self.queue.get()
+            try:
+                self._run_job(job_id)
+            finally:
+                self.queue.task_done()
+
+    def _run_job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            job["status"] = STATUS_RUNNING
+            job["started"] = datetime.now().isoformat(timespec="seconds")
+        start = time.time()
+        try:
+            converter = PDFToExcelConverter(job["input"], output_dir=self.jobs_dir / job_id / "output",
+                                            workers=self.workers, share_from=self, pages=job["pages_selected"],
+                                            max_pages=self.max_pages, max_cost=self.max_cost,
+                                            **self.converter_kwargs)
+            with self.lock:
+                job["converter"] = converter
+            result = converter.run_full_process()
+            failed = converter.manifest.summary(converter.page_numbers)["failed"]
+            with self.lock:
+                job["result"] = result
+                if result is None:
+                    job["status"], job["error"] = STATUS_FAILED, "Không có sheet nào được tạo"
+                else:
+                    job["status"] = STATUS_DONE
+                    if failed:
+                        job["error"] = f"{failed} trang lỗi"
+        except Exception as e:
+            with self.lock:
+                job["status"], job["error"] = STATUS_FAILED, f"{type(e).__name__}: {e}"
+            print(f"❌ Job {job_id} lỗi: {job['error']}")
+        finally:
+            with self.lock:
+                job["finished"] = datetime.now().isoformat(timespec="seconds")
+                job["seconds"] = round(time.time() - start, 3)
+                # Giữ lại số trang cho status, bỏ converter để giải phóng bộ nhớ
+                converter = job["converter"]
+                if converter is not None and converter.manifest is not None:
+                    job["pages"] = dict(converter.manifest.summary(converter.page_numbers),
+                                        total=len(converter.page_numbers))
+                job["converter"] = None
+            if converter is not None:
+                self.metrics.merge(converter.metrics)
+            print(f"📤 Job {job_id}: {job['status']} sau {job['seconds']}s")
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """API HTTP:
+    POST /jobs?name=x.pdf[&pages=1-50,80] (thân request là file PDF) → {"id", "status"}
+    GET /jobs, GET /jobs/{id}, GET /jobs/{id}/result (file .xlsx), DELETE /jobs/{id}, GET /health,
+    GET /metrics (bộ đếm Prometheus)
+    """
+
+    protocol_version = "HTTP/1.1"
+    service = None
+    max_upload_bytes = 100 * 1024 * 1024
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, data):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+    def _error(self, status, message):
+        self._send_json(status, {"error": message})
+
+    def _route(self):
+        parts = [p for p in urlparse(self.path).path.split("/") if p]
+        return parts
+
+    def do_POST(self):
+        parts = self._route()
+        if parts != ["jobs"]:
+            return self._error(404, "Không tìm thấy")
+        length = int(self.headers.get("Content-Length", 0))
+        if not length:
+            return self._error(400, "Thân request phải là nội dung file PDF")
+        if length > self.max_upload_bytes:
+            return self._error(413, f"File quá lớn (tối đa {self.max_upload_bytes // (1024 * 1024)}MB)")
+        body = self.rfile.read(length)
+        if not body.startswith(b"%PDF"):
+            return self._error(400, "Nội dung không phải file PDF")
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            job_id = self.service.submit(body, query.get("name", ["input.pdf"])[0], query.get("pages", [None])[0])
+        except ValueError as e:
+            return self._error(400, str(e))
+        self._send_json(202, {"id": job_id, "status": STATUS_QUEUED,
+                              "status_url": f"/jobs/{job_id}", "result_url": f"/jobs/{job_id}/result"})
+
+    def do_GET(self):
+        parts = self._route()
+        if parts == ["health"]:
+            return self._send_json(200, {"status": "ok", "queued": self.service.queue.qsize(),
+                                         "providers": [p.name for p in self.service.providers]})
+        if parts == ["metrics"]:
+            return self._send(200, self.service.prometheus_text().encode("utf-8"), "text/plain; version=0.0.4")
+        if parts == ["jobs"]:
+            return self._send_json(200, {"jobs": self.service.list_jobs()})
+        if len(parts) == 2 and parts[0] == "jobs":
+            info = self.service.status(parts[1])
+            if info is None:
+                return self._error(404, "Không có job này")
+            return self._send_json(200, info)
+        if len(parts) == 3 and parts[0] == "jobs" and parts[2] == "result":
+            info = self.service.status(parts[1])
+            if info is None:
+                return self._error(404, "Không có job này")
+            result = self.service.result_path(parts[1])
+            if result is None:
+                return self._error(409, f"Job chưa có kết quả (trạng thái: {info['status']})")
+            body = Path(result).read_bytes()
+            filename = Path(info["name"]).stem + ".xlsx"
+            return self._send(200, body, XLSX_MIME,
+                              {"Content-Disposition": f'attachment; filename="{filename}"'})
+        self._error(404, "Không tìm thấy")
+
+    def do_DELETE(self):
+        parts = self._route()
+        if len(parts) == 2 and parts[0] == "jobs":
+            if self.service.delete(parts[1]):
+                return self._send_json(200, {"deleted": parts[1]})
+            return self._error(409, "Job không tồn tại hoặc chưa kết thúc")
+        self._error(404, "Không tìm thấy")
+
+
+def serve(service, host="127.0.0.1", port=8080, max_upload_mb=100):
+    """Chạy HTTP server cho service (chặn tới khi Ctrl+C)"""
+    handler = type("Handler", (ServiceHandler,), {
+        "service": service,
+        "max_upload_bytes": max_upload_mb * 1024 * 1024
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    service.start()
+    print(f"🌐 Dịch vụ PDF → Excel: http://{host}:{server.server_address[1]}")
+    print(f"   {service.job_slots} job cùng lúc × {service.workers} trang song song, "
+          f"AI: {', '.join(p.label for p in service.providers)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹️  Đã dừng dịch vụ")
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dịch vụ HTTP chuyển đổi PDF sang Excel bằng AI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--provider", default="anthropic",
+                        help=f"Nhà cung cấp AI ({', '.join(PROVIDERS)}), nhiều nhà cung cấp cách nhau dấu phẩy")
+    parser.add_argument("--output-dir", default="service_output",
+                        help="Thư mục lưu file nhận được, kết quả và cache (mặc định: service_output)")
+    parser.add_argument("--jobs", type=int, default=2, help="Số job chạy cùng lúc (mặc định: 2)")
+    parser.add_argument("--workers", type=int, default=4, help="Số trang song song mỗi job (mặc định: 4)")
+    parser.add_argument("--rpm", type=int, default=None, help="Giới hạn số request/phút (dùng chung mọi job)")
+    parser.add_argument("--tpm", type=int, default=None, help="Giới hạn số token/phút (dùng chung mọi job)")
+    parser.add_argument("--no-cache", action="store_true", help="Không dùng cache kết quả AI")
+    parser.add_argument("--stream", action="store_true", help="Render trực tiếp, không tạo file trung gian")
+    parser.add_argument("--batch-pages", type=int, default=1, help="Gộp tối đa K trang vào 1 request AI")
+    parser.add_argument("--stream-response", action="store_true",
+                        help="Đọc response AI dạng stream, ghi từng hàng ngay khi nhận")
+    parser.add_argument("--tiles", type=int, default=1,
+                        help="Cắt mỗi trang gửi AI thành tối đa N dải ảnh ngang, gửi song song rồi ghép bảng")
+    parser.add_argument("--max-pages", type=int, default=None,
+                        help="Ngân sách mỗi job: số trang gửi AI tối đa")
+    parser.add_argument("--max-cost", type=float, default=None,
+                        help="Ngân sách mỗi job: chi phí API ước tính tối đa (USD)")
+    parser.add_argument("--max-in-memory", type=int, default=None,
+                        help="Số trang tối đa nằm trong bộ nhớ cùng lúc của mỗi job")
+    parser.add_argument("--render-workers", type=int, default=0,
+                        help="Số tiến trình render trước trang, dùng chung mọi job (mặc định: 0 - không dùng)")
+    parser.add_argument("--max-upload-mb", type=int, default=100, help="Dung lượng file tối đa (MB)")
+    args = parser.parse_args()
+
+    try:
+        providers = [name for name in args.provider.split(",") if name.strip()]
+        service = ConversionService(providers, output_dir=args.output_dir, job_slots=args.jobs,
+                                    workers=args.workers, rpm=args.rpm, tpm=args.tpm,
+                                    use_cache=not args.no_cache, max_pages=args.max_pages,
+                                    max_cost=args.max_cost, stream=args.stream,
+                                    batch_pages=args.batch_pages, max_in_memory=args.max_in_memory,
+                                    render_workers=args.render_workers, stream_response=args.stream_response,
+                                    tiles=args.tiles)
+    except ValueError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    serve(service, args.host, args.port, args.max_upload_mb)
+
+
+if __name__ == "__main__":
+    main()
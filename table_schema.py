@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Schema thống nhất của bảng model trả về, dùng cho structured output của mọi provider
+- TABLE_SCHEMA: 1 bảng {"headers", "rows"}, thêm tùy chọn "cell_types" (kiểu dữ liệu từng cột)
+  và "table_index" (số thứ tự ảnh trong request gộp)
+- BATCH_SCHEMA: request gộp nhiều trang (--batch-pages) {"tables": [bảng, ...]}
+- Gemini ép schema qua response_schema, Claude qua tool bắt buộc gọi (input_schema),
+  DeepSeek qua response_format json_object kèm schema trong prompt
+- table_errors kiểm tra bảng đã parse có đúng schema không (response không đúng thì không cache)
+- SCHEMA_VERSION: dấu vân tay của schema, nằm trong key cache (đổi schema thì không dùng lại kết quả cũ)
+"""
+
+import hashlib
+import json
+
+# Kiểu dữ liệu của 1 cột (cell_types)
+CELL_TYPES = ("text", "number", "date", "currency", "percent")
+
+# Chỉ dùng các từ khóa JSON Schema mà cả 3 nhà cung cấp đều nhận (Gemini chỉ hỗ trợ 1 phần OpenAPI schema)
+TABLE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "headers": {
+            "type": "array",
+            "description": "Tiêu đề các cột, theo thứ tự từ trái sang phải",
+            "items": {"type": "string"},
+        },
+        "rows": {
+            "type": "array",
+            "description": "Các hàng dữ liệu, mỗi hàng là mảng giá trị ô theo thứ tự cột; ô trống là \"\"",
+            "items": {"type": "array", "items": {"type": "string"}},
+        },
+        "cell_types": {
+            "type": "array",
+            "description": "Tùy chọn: kiểu dữ liệu của từng cột",
+            "items": {"type": "string", "enum": list(CELL_TYPES)},
+        },
+        "table_index": {
+            "type": "integer",
+            "description": "Số thứ tự ảnh chứa bảng (chỉ dùng khi có nhiều ảnh, bắt đầu từ 1)",
+        },
+    },
+    "required": ["headers", "rows"],
+}
+
+BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "tables": {
+            "type": "array",
+            "description": "Bảng của từng ảnh, đúng thứ tự ảnh",
+            "items": TABLE_SCHEMA,
+        },
+    },
+    "required": ["tables"],
+}
+
+# Tự tính từ nội dung schema: sửa TABLE_SCHEMA/BATCH_SCHEMA là đổi version, không cần nhớ tăng tay
+SCHEMA_VERSION = hashlib.sha256(
+    json.dumps([TABLE_SCHEMA, BATCH_SCHEMA], sort_keys=True).encode("utf-8")
+).hexdigest()[:12]
+
+# Giá trị 1 ô: chuỗi theo schema, model không ép schema (DeepSeek) có thể trả số/true/null
+_SCALARS = (str, int, float, bool, type(None))
+
+
+def schema_prompt(schema):
+    """Đoạn prompt mô tả schema, cho provider chỉ ép được JSON chứ không ép được schema"""
+    return "\n\nJSON trả về phải đúng JSON Schema sau:\n" + json.dumps(schema, ensure_ascii=False)
+
+
+def table_errors(data):
+    """Các lỗi của bảng `data` so với TABLE_SCHEMA (danh sách rỗng = hợp lệ).
+
+    Số ô mỗi hàng không bắt buộc bằng số cột (bảng có ô gộp). cell_types / table_index chỉ là
+    thông tin thêm: sai kiểu thì bị bỏ khỏi `data` chứ không làm hỏng cả bảng.
+    """
+    if not isinstance(data, dict):
+        return [f"bảng phải là object, nhận được {type(data).__name__}"]
+    errors = []
+    headers, rows = data.get("headers"), data.get("rows")
+    if not isinstance(headers, list):
+        errors.append("thiếu headers hoặc headers không phải mảng")
+    elif not all(isinstance(value, _SCALARS) for value in headers):
+        errors.append("headers chứa giá trị không phải chuỗi")
+    if not isinstance(rows, list):
+        errors.append("thiếu rows hoặc rows không phải mảng")
+    else:
+        for number, row in enumerate(rows, 1):
+            if not isinstance(row, list) or not all(isinstance(value, _SCALARS) for value in row):
+                errors.append(f"hàng {number} không phải mảng giá trị ô")
+                break
+    cell_types = data.get("cell_types")
+    if cell_types is not None and (not isinstance(cell_types, list)
+                                   or not all(value in CELL_TYPES for value in cell_types)):
+        del data["cell_types"]
+    table_index = data.get("table_index")
+    if table_index is not None and (not isinstance(table_index, int) or isinstance(table_index, bool)):
+        del data["table_index"]
+    return errors
+
+
+def order_tables(tables):
+    """Sắp các bảng của response gộp theo table_index nếu model ghi đủ 1..N, không thì giữ thứ tự trả về"""
+    indexes = [table.get("table_index") for table in tables]
+    if not all(isinstance(index, int) for index in indexes) or sorted(indexes) != list(range(1, len(tables) + 1)):
+        return tables
+    return sorted(tables, key=lambda table: table["table_index"])
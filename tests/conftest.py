@@ -0,0 +1,49 @@
+"""Fixture dùng chung cho các bài kiểm tra (chạy: python -m pytest -q)"""
+
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from excel_writer import StreamingWorkbookWriter  # noqa: E402
+from mock_ai_server import MockAIServer  # noqa: E402
+from pipeline import PDFToExcelConverter  # noqa: E402
+from providers import MockProvider  # noqa: E402
+
+
+@pytest.fixture
+def mock_server():
+    """Server AI giả lập (mock_ai_server.py) chạy nền trên cổng ngẫu nhiên"""
+    server = MockAIServer(("127.0.0.1", 0), latency=0.05, rows=12, cols=3)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def make_converter(tmp_path):
+    """Tạo converter không cần file PDF thật: writer ghi vào tmp_path cho các trang `pages`"""
+    converters = []
+
+    def make(provider=None, pages=(1,), **options):
+        options.setdefault("use_cache", False)
+        converter = PDFToExcelConverter(tmp_path / "input.pdf", provider or MockProvider(latency=0),
+                                        output_dir=tmp_path, **options)
+        converter.page_numbers = list(pages)
+        converter.writer = StreamingWorkbookWriter(tmp_path / f"result_{len(converters)}.xlsx",
+                                                   converter.page_numbers)
+        converters.append(converter)
+        return converter
+
+    yield make
+    # Bài kiểm tra đã tự lưu file kết quả thì đặt writer = None
+    for converter in converters:
+        if converter.writer is not None:
+            converter.writer.close()
@@ -0,0 +1,149 @@
+"""--batch-submit: chạy lại job đã gửi không ghi trùng trang, kết quả được cache, ngân sách theo usage"""
+
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+from openpyxl import load_workbook
+from PIL import Image
+
+from fake_batch_server import FakeBatchServer
+from job_manifest import JobManifest
+from providers import AnthropicProvider, GeminiProvider
+
+
+@pytest.fixture
+def batch_server():
+    server = FakeBatchServer(("127.0.0.1", 0), delay=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _provider(server):
+    provider = AnthropicProvider(api_key="test")
+    provider.url = f"http://127.0.0.1:{server.server_address[1]}/v1/messages"
+    provider.batch_url = provider.url + "/batches"
+    return provider
+
+
+def _page_items():
+    return [(None, number, Image.new("RGB", (200, 100), (number * 40, 255, 255))) for number in (1, 2)]
+
+
+def _run(make_converter, tmp_path, server, resume, interrupt=None, **options):
+    """1 lần chạy --batch-submit trên 2 trang; `interrupt` = tên hàm bị tắt để giả lập gián đoạn"""
+    converter = make_converter(_provider(server), pages=(1, 2), batch_submit=True, batch_poll=1,
+                               use_cache=True, resume=resume, **options)
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"%PDF-1.4 gia lap")
+    converter.manifest = JobManifest(tmp_path / "jobs" / "source.json", source, resume=resume)
+    if interrupt:
+        setattr(converter if hasattr(converter, interrupt) else converter.manifest, interrupt,
+                lambda *args: None)
+    converter._convert_pages_batch_job(_page_items())
+    return converter
+
+
+def test_batch_job_cost_settled_by_usage(make_converter, tmp_path, batch_server):
+    converter = _run(make_converter, tmp_path, batch_server, resume=False, max_cost=10)
+    provider = converter.provider
+    assert converter.writer.sheet_count == 2
+    # Chi phí thực tế theo usage của từng kết quả, giá job batch 50%
+    expected = 0
+    for job in batch_server.jobs.values():
+        for text in job["results"]:
+            expected += provider.estimate_cost(1, (1000, len(text) // 4)) * provider.batch_job_price_factor
+    assert converter.budget.pages == 2
+    assert converter.budget.cost == pytest.approx(expected)
+    assert converter.manifest.batch_jobs(provider.name) == []
+
+
+def test_resume_skips_pages_already_done(make_converter, tmp_path, batch_server):
+    # Lần 1 lấy xong kết quả nhưng dừng trước khi xóa job khỏi manifest
+    first = _run(make_converter, tmp_path, batch_server, resume=False, interrupt="remove_batch_job")
+    assert len(first.manifest.batch_jobs(first.provider.name)) == 1
+    second = _run(make_converter, tmp_path, batch_server, resume=True)
+    # Trang đã xong chỉ được nạp lại từ file cũ, không xử lý lại từ kết quả job
+    assert second.metrics.pages[1]["status"] == "resumed"
+    assert second.metrics.pages[2]["status"] == "resumed"
+    assert second.writer.sheet_count == 2
+    assert second.manifest.batch_jobs(second.provider.name) == []
+
+
+def test_resumed_job_results_are_cached(make_converter, tmp_path, batch_server):
+    # Lần 1 gửi job rồi bị gián đoạn trước khi lấy kết quả
+    first = _run(make_converter, tmp_path, batch_server, resume=False, interrupt="_collect_batch_job")
+    [job] = first.manifest.batch_jobs(first.provider.name)
+    assert sorted(job["cache_keys"]) == ["1", "2"]
+    second = _run(make_converter, tmp_path, batch_server, resume=True)
+    assert second.writer.sheet_count == 2
+    for key in job["cache_keys"].values():
+        assert second.cache.get(key) is not None
+    # Trang gửi ở lần trước không tính vào ngân sách lần này
+    assert second.budget.pages == 0
+
+
+class FakeGeminiBatches:
+    """client.batches giả lập: trả kết quả inline theo thứ tự request, có hoặc không kèm metadata"""
+
+    def __init__(self, pages, with_metadata):
+        self.responses = []
+        for page_number in pages:
+            text = json.dumps({"headers": ["Trang"], "rows": [[str(page_number)]]})
+            self.responses.append(SimpleNamespace(
+                metadata={"key": f"page-{page_number:03d}"} if with_metadata else None, error=None,
+                response=SimpleNamespace(text=text, usage_metadata=None),
+            ))
+
+    def get(self, name):
+        return SimpleNamespace(state=SimpleNamespace(name="JOB_STATE_SUCCEEDED"),
+                               dest=SimpleNamespace(inlined_responses=self.responses))
+
+
+def _gemini(pages, with_metadata):
+    provider = GeminiProvider()
+    provider.client = SimpleNamespace(batches=FakeGeminiBatches(pages, with_metadata))
+    return provider
+
+
+@pytest.mark.parametrize("with_metadata", [True, False], ids=["metadata", "order"])
+def test_gemini_results_matched_with_full_job_order(with_metadata):
+    provider = _gemini([1, 2, 3], with_metadata)
+    results = provider.batch_job_results("job", ["page-001", "page-002", "page-003"])
+    assert [json.loads(results[f"page-{n:03d}"][0])["rows"] for n in (1, 2, 3)] == [[["1"]], [["2"]], [["3"]]]
+
+
+def test_gemini_results_without_metadata_need_known_order():
+    provider = _gemini([1, 2, 3], with_metadata=False)
+    # Chỉ biết các trang đang chờ (không đủ thứ tự đã gửi): không ghép bừa theo vị trí
+    with pytest.raises(ValueError):
+        provider.batch_job_results("job", ["page-002", "page-003"])
+    with pytest.raises(ValueError):
+        provider.batch_job_results("job", None)
+
+
+def test_collect_job_with_some_pages_done_keeps_page_order(make_converter, tmp_path):
+    # Trang 1 của job đã xong ở lần trước; trang 2, 3 phải nhận đúng kết quả của mình
+    provider = _gemini([1, 2, 3], with_metadata=False)
+    converter = make_converter(provider, pages=(2, 3), batch_poll=1)
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"%PDF-1.4 gia lap")
+    converter.manifest = JobManifest(tmp_path / "jobs" / "source.json", source)
+    job = {"id": "job", "pages": [1, 2, 3], "cache_keys": {}}
+    for page_number in (2, 3):
+        converter._begin_page(None, page_number, Image.new("RGB", (10, 10)))
+    converter._collect_batch_job(provider, job, {2, 3}, {1}, {})
+    output = converter.writer.close()
+    converter.writer = None
+    workbook = load_workbook(output, read_only=True)
+    try:
+        assert [[list(row) for row in sheet.iter_rows(values_only=True)] for sheet in workbook.worksheets] == \
+            [[["Trang"], ["2"]], [["Trang"], ["3"]]]
+    finally:
+        workbook.close()
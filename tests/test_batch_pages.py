@@ -0,0 +1,81 @@
+"""--batch-pages: response gộp hỏng thì tách ra gọi lại từng trang"""
+
+import asyncio
+import json
+
+import pytest
+from openpyxl import load_workbook
+from PIL import Image
+
+from job_manifest import JobManifest
+from providers import MockProvider
+
+BATCH = [(n, f"anh-trang-{n}".encode(), "image/png") for n in (1, 2, 3, 4)]
+
+
+class BrokenBatchProvider(MockProvider):
+    """Request gộp trả về `reply` thay cho mảng bảng đúng"""
+
+    def __init__(self, reply, **kwargs):
+        super().__init__(latency=0, **kwargs)
+        self.reply = reply
+        self.single_calls = []
+
+    def _batch_response(self, images):
+        text = self.reply if isinstance(self.reply, str) else json.dumps(self.reply, ensure_ascii=False)
+        return {"text": text, "input_tokens": 0, "output_tokens": len(text) // 4}
+
+    def _response(self, img_bytes, prompt=None):
+        self.single_calls.append(img_bytes)
+        return super()._response(img_bytes, prompt)
+
+
+@pytest.mark.parametrize("async_mode", [False, True])
+def test_malformed_batch_releases_pages_before_retry(make_converter, async_mode):
+    provider = BrokenBatchProvider({"tables": []})
+    converter = make_converter(provider, pages=(1, 2, 3, 4), batch_pages=4, max_pages=4, async_mode=async_mode)
+    if async_mode:
+        results = asyncio.run(converter._call_provider_batch_async(provider, BATCH))
+    else:
+        results = converter._call_provider_batch(provider, BATCH)
+    # Mỗi trang chỉ tính 1 lần vào --max-pages: gọi lại từng trang vẫn nằm trong ngân sách
+    assert all(results[n] is not None for n, _, _ in BATCH)
+    assert converter.budget.pages == 4
+    assert not converter.budget.exhausted
+
+
+BROKEN_REPLIES = {
+    "thiếu bảng": {"tables": [{"headers": ["A"], "rows": [["1"]]}] * 3},
+    "thừa bảng": {"tables": [{"headers": ["A"], "rows": [["1"]]}] * 5},
+    "sai schema": {"tables": [{"headers": ["A"]}] * 4},
+    "không phải JSON": "Xin lỗi, tôi không đọc được các bảng này",
+}
+
+
+def _workbook(make_converter, tmp_path, provider, name):
+    """Chạy 1 nhóm 4 trang (--batch-pages 4), trả về nội dung các sheet theo thứ tự"""
+    converter = make_converter(provider, pages=(1, 2, 3, 4), batch_pages=4)
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"%PDF-1.4 gia lap")
+    converter.manifest = JobManifest(tmp_path / "jobs" / f"{name}.json", source)
+    items = [(None, n, Image.new("RGB", (60, 40), (n * 50, 120, 200))) for n in (1, 2, 3, 4)]
+    converter.convert_item(tuple(items))
+    output = converter.writer.close()
+    converter.writer = None
+    workbook = load_workbook(output, read_only=True)
+    try:
+        return [(sheet.title, [list(row) for row in sheet.iter_rows(values_only=True)])
+                for sheet in workbook.worksheets]
+    finally:
+        workbook.close()
+
+
+@pytest.mark.parametrize("reply", BROKEN_REPLIES.values(), ids=BROKEN_REPLIES.keys())
+def test_broken_batch_reply_retries_each_page_once(make_converter, tmp_path, reply):
+    expected = _workbook(make_converter, tmp_path, MockProvider(latency=0), "dung")
+    provider = BrokenBatchProvider(reply)
+    sheets = _workbook(make_converter, tmp_path, provider, "hong")
+    # Mỗi trang được gọi lại đúng 1 lần, bảng nằm đúng sheet của trang
+    assert len(provider.single_calls) == 4 and len(set(provider.single_calls)) == 4
+    assert sheets == expected
+    assert [title for title, _ in sheets] == [f"Trang {n}" for n in (1, 2, 3, 4)]
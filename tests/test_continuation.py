@@ -0,0 +1,108 @@
+"""Gọi tiếp bảng bị cắt do max_tokens và ghép các hàng (_continue_table / _stitch_continuation)"""
+
+import asyncio
+import json
+
+from job_manifest import JobManifest
+from providers import MockProvider
+
+IMAGE = b"trang-dai"
+
+
+def _tracked(converter, tmp_path):
+    """Gắn manifest thật cho converter và đánh dấu trang 1 đang xử lý"""
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"%PDF-1.4 gia lap")
+    converter.manifest = JobManifest(tmp_path / "jobs" / "source.json", source)
+    converter.manifest.mark_started(1, "hash-trang-1")
+
+
+def test_stitch_skips_repeated_rows(make_converter):
+    converter = make_converter()
+    data = {"headers": ["A", "B"], "rows": [["1", "a"], ["2", "b"]]}
+    content = json.dumps({"headers": [], "rows": [["2", "b"], ["3", "c"], ["4", "d"]]})
+    assert converter._stitch_continuation(data, content, False, 1, 1, None, live=False) is True
+    assert data["rows"] == [["1", "a"], ["2", "b"], ["3", "c"], ["4", "d"]]
+
+
+def test_stitch_truncated_continuation_keeps_going(make_converter):
+    converter = make_converter()
+    data = {"headers": ["A"], "rows": [["1"]]}
+    content = '{"headers": [], "rows": [["2"], ["3"], ["4'
+    assert converter._stitch_continuation(data, content, True, 1, 1, None, live=False) is None
+    assert data["rows"] == [["1"], ["2"], ["3"]]
+    # Lần gọi tiếp bị cắt mà không có hàng mới: dừng, bảng chưa đủ
+    assert converter._stitch_continuation(data, '{"headers": [], "rows": [["', True, 1, 2, None,
+                                          live=False) is False
+
+
+def test_restart_fills_headers(make_converter):
+    converter = make_converter()
+    data = {"headers": [], "rows": []}
+    content = json.dumps({"headers": ["A"], "rows": [["1"]]})
+    assert converter._stitch_continuation(data, content, False, 1, 1, None, live=False) is True
+    assert data == {"headers": ["A"], "rows": [["1"]]}
+
+
+def test_continuation_completes_table(make_converter, tmp_path):
+    provider = MockProvider(latency=0, rows=40, cols=3, max_output_tokens=150)
+    converter = make_converter(provider, use_cache=True)
+    _tracked(converter, tmp_path)
+    data = converter._call_provider(provider, IMAGE, "image/png", 1)
+    assert data == provider._table(IMAGE)
+    assert converter.metrics.pages[1]["counters"]["continuations"] >= 1
+    converter._finish_page(1, converter._save_ai_table(data, 1))
+    assert converter.manifest.completed_output(1, "hash-trang-1") is not None
+    # Bảng đủ được cache: lần sau không gọi lại
+    assert converter.cache.get(converter._cache_lookup(provider, IMAGE, 1)[0]) == data
+
+
+def test_continuation_async_completes_table(make_converter):
+    provider = MockProvider(latency=0, rows=40, cols=3, max_output_tokens=150)
+    converter = make_converter(provider, async_mode=True, stream_response=True)
+    data = asyncio.run(converter._call_provider_async(provider, IMAGE, "image/png", 1))
+    assert data == provider._table(IMAGE)
+
+
+def test_still_truncated_marks_page_failed(make_converter, tmp_path):
+    # Mỗi response chỉ đủ vài hàng: 4 lần gọi tiếp không lấy hết 200 hàng
+    provider = MockProvider(latency=0, rows=200, cols=3, max_output_tokens=60)
+    converter = make_converter(provider, use_cache=True)
+    _tracked(converter, tmp_path)
+    data = converter._call_provider(provider, IMAGE, "image/png", 1)
+    assert data is not None and 0 < len(data["rows"]) < 200
+    table_file = converter._save_ai_table(data, 1)
+    converter._finish_page(1, table_file)
+    # Các hàng đã nhận được ghi, nhưng trang là lỗi để --resume gọi lại; bảng thiếu không được cache
+    assert table_file is not None
+    assert converter.manifest.completed_output(1, "hash-trang-1") is None
+    assert converter.manifest.summary([1])["failed"] == 1
+    assert converter.manifest.data["pages"]["1"]["partial"] is True
+    assert converter.metrics.pages[1]["status"] == "partial"
+    assert converter.cache.get(converter._cache_lookup(provider, IMAGE, 1)[0]) is None
+
+
+def test_no_rows_is_not_saved(make_converter, tmp_path):
+    # Response bị cắt trước khi có hàng nào, kể cả khi gọi tiếp từ đầu
+    provider = MockProvider(latency=0, rows=20, cols=3, max_output_tokens=5)
+    converter = make_converter(provider)
+    _tracked(converter, tmp_path)
+    data = converter._call_provider(provider, IMAGE, "image/png", 1)
+    assert data is None
+    converter._finish_page(1, converter._save_ai_table(data, 1))
+    assert converter.manifest.summary([1])["failed"] == 1
+    assert not list(converter.tables_dir.glob("page_*.json"))
+
+
+def test_budget_exhausted_marks_page_failed(make_converter, tmp_path):
+    class PricedMockProvider(MockProvider):
+        price_per_mtok = (1.0, 1.0)
+
+    provider = PricedMockProvider(latency=0, rows=40, cols=3, max_output_tokens=150)
+    # Đủ cho request đầu tiên, không đủ cho lần gọi tiếp
+    converter = make_converter(provider, max_cost=provider.estimate_cost(1) * 1.01)
+    _tracked(converter, tmp_path)
+    data = converter._call_provider(provider, IMAGE, "image/png", 1)
+    assert data is not None and len(data["rows"]) < 40
+    converter._finish_page(1, converter._save_ai_table(data, 1))
+    assert converter.manifest.completed_output(1, "hash-trang-1") is None
@@ -0,0 +1,93 @@
+"""StreamingWorkbookWriter: trang xong không theo thứ tự vẫn được ghi thành sheet đúng thứ tự trang"""
+
+import random
+import threading
+
+from openpyxl import load_workbook
+
+from excel_writer import LIVE_WIDTH_SAMPLE, StreamingWorkbookWriter
+
+
+def _table(page_number, rows=2):
+    return {"headers": ["Trang", "Hàng"], "rows": [[f"trang {page_number}", n] for n in range(rows)]}
+
+
+def _sheets(path):
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return [(sheet.title, [list(row) for row in sheet.iter_rows(values_only=True)])
+                for sheet in workbook.worksheets]
+    finally:
+        workbook.close()
+
+
+def test_out_of_order_pages_are_written_in_page_order(tmp_path):
+    pages = [3, 5, 8, 10]
+    writer = StreamingWorkbookWriter(tmp_path / "out.xlsx", pages)
+    writer.add_page(8, _table(8))
+    writer.add_page(5, _table(5))
+    # Trang đầu chưa xong: chưa ghi sheet nào, các trang sau chờ trong bộ nhớ
+    assert writer.sheet_count == 0 and sorted(writer.pending) == [5, 8]
+    writer.add_page(3, _table(3))
+    assert writer.sheet_count == 3 and not writer.pending
+    writer.add_page(10, _table(10))
+    sheets = _sheets(writer.close())
+    assert [title for title, _ in sheets] == [f"Trang {n}" for n in pages]
+    for (_, rows), page_number in zip(sheets, pages):
+        assert rows == [["Trang", "Hàng"]] + _table(page_number)["rows"]
+
+
+def test_failed_page_is_skipped_without_blocking_later_pages(tmp_path):
+    writer = StreamingWorkbookWriter(tmp_path / "out.xlsx", [1, 2, 3])
+    writer.add_page(3, _table(3))
+    writer.add_page(2, None)
+    writer.add_page(1, _table(1))
+    assert [title for title, _ in _sheets(writer.close())] == ["Trang 1", "Trang 3"]
+
+
+def test_close_writes_pages_still_waiting(tmp_path):
+    # Trang 1 không bao giờ tới (vd. bị dừng giữa chừng): các trang còn chờ vẫn được ghi, đúng thứ tự
+    writer = StreamingWorkbookWriter(tmp_path / "out.xlsx", [1, 2, 3, 4])
+    writer.add_page(4, _table(4))
+    writer.add_page(2, _table(2))
+    assert writer.sheet_count == 0
+    assert [title for title, _ in _sheets(writer.close())] == ["Trang 2", "Trang 4"]
+
+
+def test_close_without_pages_returns_none(tmp_path):
+    writer = StreamingWorkbookWriter(tmp_path / "out.xlsx", [1, 2])
+    writer.add_page(1, None)
+    assert writer.close() is None
+    assert not (tmp_path / "out.xlsx").exists()
+
+
+def test_stream_rows_only_for_page_whose_turn_it_is(tmp_path):
+    writer = StreamingWorkbookWriter(tmp_path / "out.xlsx", [1, 2])
+    table = _table(2, rows=LIVE_WIDTH_SAMPLE)
+    # Trang 2 chưa tới lượt: không tạo sheet sớm
+    writer.stream_rows(2, table["headers"], table["rows"])
+    assert not writer.live
+    writer.add_page(1, _table(1))
+    writer.stream_rows(2, table["headers"], table["rows"])
+    assert writer.live[2][1] == LIVE_WIDTH_SAMPLE
+    table["rows"].append(["trang 2", "cuối"])
+    writer.add_page(2, table)
+    sheets = _sheets(writer.close())
+    assert [title for title, _ in sheets] == ["Trang 1", "Trang 2"]
+    assert sheets[1][1] == [["Trang", "Hàng"]] + table["rows"]
+
+
+def test_concurrent_pages_keep_order(tmp_path):
+    pages = list(range(1, 41))
+    writer = StreamingWorkbookWriter(tmp_path / "out.xlsx", pages)
+    shuffled = pages[:]
+    random.Random(7).shuffle(shuffled)
+    threads = [threading.Thread(target=writer.add_page, args=(n, _table(n))) for n in shuffled]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert writer.sheet_count == len(pages)
+    sheets = _sheets(writer.close())
+    assert [title for title, _ in sheets] == [f"Trang {n}" for n in pages]
+    assert [rows[1][0] for _, rows in sheets] == [f"trang {n}" for n in pages]
@@ -0,0 +1,31 @@
+"""Đọc JSON bảng từ response: extract_json trên bộ response mẫu và response giả lớn"""
+
+import json
+
+import pytest
+
+from json_benchmark import FIXTURES, make_response
+from json_stream import TableStreamParser, extract_json
+
+CASES = json.loads((FIXTURES / "expected.json").read_text(encoding="utf-8"))
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case["file"] for case in CASES])
+def test_extract_json_fixtures(case):
+    text = (FIXTURES / case["file"]).read_text(encoding="utf-8")
+    assert extract_json(text, case["opening"]) == case["expected"]
+    if "salvaged_rows" in case:
+        parser = TableStreamParser()
+        parser.feed(text)
+        assert len(parser.rows) == case["salvaged_rows"]
+
+
+@pytest.mark.parametrize("kind", ["clean", "dirty"])
+def test_extract_json_large_response(kind):
+    text, rows = make_response(64 * 1024, kind)
+    assert len(extract_json(text, "{")["rows"]) == rows
+
+
+def test_extract_json_truncated_is_none():
+    text, _ = make_response(16 * 1024, "truncated")
+    assert extract_json(text, "{") is None
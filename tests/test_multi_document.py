@@ -0,0 +1,31 @@
+"""Nhiều tài liệu: chỉ chia sẻ provider/rate limiter/cache/ngân sách, không giữ converter của file đầu"""
+
+from pypdf import PdfWriter
+
+from multi_document import MultiDocumentRunner, _SharedState
+from providers import MockProvider
+
+
+def _blank_pdf(path):
+    writer = PdfWriter()
+    writer.add_blank_page(width=200, height=200)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return path
+
+
+def test_documents_share_state_not_converter(tmp_path):
+    files = [_blank_pdf(tmp_path / f"{name}.pdf") for name in ("a", "b")]
+    runner = MultiDocumentRunner(files, output_dir=tmp_path / "output", workers=2,
+                                 provider=MockProvider(latency=0), max_in_memory=6, batch_pages=2)
+    first, second = runner.documents
+    try:
+        assert runner._open(first) and runner._open(second)
+        assert isinstance(runner.shared, _SharedState)
+        assert runner.max_queued == first.converter._items_in_memory(runner.workers * 2) == 3
+        for name in ("providers", "rate_limiters", "cache", "budget"):
+            assert getattr(second.converter, name) is getattr(first.converter, name)
+    finally:
+        for document in runner.documents:
+            if document.converter is not None:
+                document.converter.writer.close()
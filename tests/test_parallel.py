@@ -0,0 +1,78 @@
+"""Chạy song song (--workers, --async) cho file Excel giống hệt chạy tuần tự"""
+
+import asyncio
+import threading
+
+import pytest
+from openpyxl import load_workbook
+from PIL import Image
+
+from job_manifest import JobManifest
+from providers import MockProvider
+
+PAGES = tuple(range(1, 9))
+
+
+def _page_items():
+    return [(None, n, Image.new("RGB", (120, 80), (n * 30 % 256, 200, 255 - n * 20))) for n in PAGES]
+
+
+def _convert(make_converter, tmp_path, name, **options):
+    converter = make_converter(MockProvider(latency=0.01, rows=6, cols=3), pages=PAGES, **options)
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"%PDF-1.4 gia lap")
+    converter.manifest = JobManifest(tmp_path / "jobs" / f"{name}.json", source)
+    items = _page_items()
+    if converter.async_mode:
+        asyncio.run(converter._convert_pages_async(iter(items)))
+    elif converter.workers > 1:
+        converter._convert_pages_concurrently(iter(items))
+    else:
+        for item in items:
+            converter.convert_item(item)
+    output = converter.writer.close()
+    converter.writer = None
+    workbook = load_workbook(output, read_only=True)
+    try:
+        return [(sheet.title, [list(row) for row in sheet.iter_rows(values_only=True)])
+                for sheet in workbook.worksheets]
+    finally:
+        workbook.close()
+
+
+@pytest.mark.parametrize("options", [{"workers": 4}, {"workers": 2, "async_mode": True, "in_flight": 4}],
+                         ids=["workers", "async"])
+def test_parallel_matches_sequential(make_converter, tmp_path, options):
+    sequential = _convert(make_converter, tmp_path, "tuan_tu")
+    parallel = _convert(make_converter, tmp_path, "song_song", **options)
+    assert len(sequential) == len(PAGES)
+    assert parallel == sequential
+
+
+@pytest.mark.parametrize("batch_pages", [1, 2], ids=["page", "batch"])
+def test_async_writes_run_off_event_loop(make_converter, tmp_path, batch_pages):
+    converter = make_converter(MockProvider(latency=0.01), pages=PAGES, async_mode=True, batch_pages=batch_pages)
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"%PDF-1.4 gia lap")
+    converter.manifest = JobManifest(tmp_path / "jobs" / "source.json", source)
+    loop_threads, write_threads = set(), []
+    for name in ("_save_ai_table", "_finish_page"):
+        original = getattr(converter, name)
+
+        def record(*args, _original=original):
+            write_threads.append(threading.get_ident())
+            return _original(*args)
+        setattr(converter, name, record)
+
+    async def run():
+        loop_threads.add(threading.get_ident())
+        items = _page_items()
+        if batch_pages > 1:
+            items = converter._group_pages(items)
+        await converter._convert_pages_async(iter(items))
+
+    asyncio.run(run())
+    # Ghi Excel / manifest không chạy trên luồng của event loop
+    assert len(write_threads) == 2 * len(PAGES)
+    assert not loop_threads & set(write_threads)
+    assert converter.writer.sheet_count == len(PAGES)
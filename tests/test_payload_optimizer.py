@@ -0,0 +1,77 @@
+"""Chọn định dạng ảnh bằng ước lượng (payload_optimizer.choose_format) trên ảnh trang mẫu:
+ảnh trang bảng gửi đi phải giống hệt cách cũ (mã hóa thử mọi định dạng, lấy file nhỏ nhất),
+tức kết quả trích xuất của AI không đổi"""
+
+import random
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from benchmark import _scanned_page
+from payload_optimizer import (PROVIDER_PROFILES, choose_format, encode_as, estimate_png_bytes,
+                               optimize_image)
+from rasterizer import encode_image
+
+
+def _digital_page(seed=0, width=1654, height=2339):
+    """Trang bảng render từ PDF có lớp text (chữ khử răng cưa trên nền trắng, có kẻ ô)"""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=22)
+    for r in range(40):
+        for c in range(6):
+            box = [80 + c * 250, 120 + r * 50, 80 + (c + 1) * 250, 120 + (r + 1) * 50]
+            draw.rectangle(box, outline=(0, 0, 0))
+            draw.text((box[0] + 10, box[1] + 10), f"{rng.randint(0, 999999):,}", fill=(0, 0, 0), font=font)
+    return image
+
+
+def _photo(width=1200, height=1600):
+    """Ảnh nhiều màu (không phải trang bảng)"""
+    base = Image.effect_mandelbrot((width, height), (-2, -1.5, 1, 1.5), 100)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    return Image.merge("RGB", [base, base.rotate(90), gradient])
+
+
+PAGES = {
+    "digital": _digital_page,
+    "scanned": lambda: _scanned_page(random.Random(1), 1, 25, 6, 200),
+}
+
+
+def _smallest_encoding(image, provider, dense=False):
+    """Cách chọn cũ: mã hóa thử mọi định dạng của nhà cung cấp, lấy file nhỏ nhất"""
+    profile = PROVIDER_PROFILES[provider]
+    scale = profile["max_long_edge"] / max(image.width, image.height)
+    if scale < 1:
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                             resample=Image.Resampling.LANCZOS)
+    formats = ("PNG",) if dense else profile["formats"]
+    return min((encode_as(image, fmt) for fmt in formats), key=len)
+
+
+@pytest.fixture(scope="module", params=sorted(PAGES))
+def page_image(request):
+    image = PAGES[request.param]()
+    yield image
+    image.close()
+
+
+@pytest.mark.parametrize("provider", ["anthropic", "gemini", "deepseek"])
+@pytest.mark.parametrize("dense", [False, True])
+def test_table_pages_send_same_image(page_image, provider, dense):
+    optimized = optimize_image(page_image, provider, dense=dense)
+    assert optimized.data == _smallest_encoding(page_image, provider, dense)
+
+
+def test_baseline_is_estimated(page_image):
+    actual = len(encode_image(page_image, "PNG"))
+    assert estimate_png_bytes(page_image) == pytest.approx(actual, rel=0.25)
+
+
+def test_format_without_webp():
+    photo = _photo()
+    assert choose_format(photo, ("PNG", "JPEG")) == "JPEG"
+    assert choose_format(_digital_page(), ("PNG", "JPEG")) == "PNG"
+    assert choose_format(photo, ("PNG", "WEBP", "JPEG"), dense=True) == "PNG"
@@ -0,0 +1,112 @@
+"""Rate limiter: token bucket, Retry-After / backoff khi bị 429, dùng ~95% quota của server giả lập"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+from mock_ai_server import MockAIServer
+from rate_limiter import RateLimiter, TokenBucket, _retry_after_from
+
+# Quota của server giả lập: 20 request / 2 giây (= 600 request/phút)
+QUOTA, WINDOW = 20, 2.0
+RPM = int(QUOTA * 60 / WINDOW)
+
+
+@pytest.fixture
+def quota_server():
+    server = MockAIServer(("127.0.0.1", 0), latency=0, rows=2, cols=2, rpm=QUOTA, quota_window=WINDOW)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _run(server, limiter, count, threads=4):
+    """Gửi `count` request qua limiter từ `threads` luồng; trả về (mã HTTP, số lần thử lại, thời gian chạy)"""
+    url = f"http://127.0.0.1:{server.server_address[1]}/chat/completions"
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        stats = {}
+        response = limiter.call(lambda: local.session.post(url, json={"messages": [{"content": "bảng"}]}),
+                                stats=stats)
+        return response.status_code, stats.get("retries", 0)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(one, range(count)))
+    return [status for status, _ in results], sum(retries for _, retries in results), time.monotonic() - start
+
+
+def test_token_bucket_paces_after_burst():
+    bucket = TokenBucket(600)  # 10 token/giây, burst 10
+    start = time.monotonic()
+    for _ in range(15):
+        bucket.acquire()
+    # 10 token đầu lấy ngay, 5 token sau phải chờ ~0.5 giây
+    assert 0.4 <= time.monotonic() - start < 1.0
+    assert not bucket.try_acquire()
+    assert bucket.wait_time() > 0
+
+
+def test_token_bucket_adjust_refunds_tokens():
+    bucket = TokenBucket(60, capacity=10)
+    bucket.acquire(10)
+    assert not bucket.try_acquire(5)
+    bucket.adjust(5)
+    assert bucket.try_acquire(5)
+
+
+def test_retry_after_header_parsing():
+    class Response:
+        def __init__(self, value):
+            self.headers = {"Retry-After": value}
+
+    assert _retry_after_from(Response("3")) == 3.0
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 <= _retry_after_from(Response(later)) <= 30
+    assert _retry_after_from(Response("không phải số")) is None
+    assert _retry_after_from(None) is None
+
+
+def test_backoff_honours_retry_after_and_cap():
+    limiter = RateLimiter("mock", base_delay=1.0, max_delay=4.0)
+    for attempt in range(8):
+        assert 0 <= limiter.backoff_delay(attempt) <= 4.0
+    assert limiter.backoff_delay(0, retry_after=10) >= 10
+
+
+def test_limiter_uses_about_95_percent_of_quota(quota_server):
+    limiter = RateLimiter("mock", rpm=RPM)
+    burst = limiter.request_bucket.capacity
+    count = 40
+    statuses, retries, elapsed = _run(quota_server, limiter, count)
+    assert statuses == [200] * count
+    # Không chạm quota của server: không có 429 nào
+    assert quota_server.counts["throttled"] == 0 and retries == 0
+    # Sau đợt burst ban đầu, tốc độ ổn định ~95% quota
+    rate = (count - burst) / elapsed
+    assert 0.85 * QUOTA / WINDOW <= rate <= QUOTA / WINDOW
+
+
+def test_limiter_backs_off_on_429(quota_server):
+    # Limiter không biết quota: gửi dồn dập, server trả 429 kèm Retry-After
+    limiter = RateLimiter("mock", base_delay=0.05, max_delay=0.5, max_retries=10)
+    count = 30
+    statuses, retries, elapsed = _run(quota_server, limiter, count)
+    assert statuses == [200] * count
+    assert retries == quota_server.counts["throttled"] > 0
+    # Mọi luồng dừng theo Retry-After (>= 1 giây) rồi mới gửi tiếp
+    assert elapsed >= 1.0
+    # Tổng số request thành công không vượt quota của server trong thời gian chạy
+    assert count <= QUOTA + elapsed * QUOTA / WINDOW
@@ -0,0 +1,56 @@
+"""ResponseCache: xóa mục ít dùng nhất theo chỉ mục trong bộ nhớ, không quét thư mục mỗi lần ghi"""
+
+import json
+from pathlib import Path
+
+from response_cache import ResponseCache
+
+ROW = {"headers": ["A"], "rows": [["x" * 80]]}
+# Đủ chỗ cho 3 mục
+LIMIT = len(json.dumps(ROW)) * 7 // 2
+
+
+def test_evicts_least_recently_used(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path, max_bytes=LIMIT)
+    # Sau khi khởi tạo, ghi/đọc cache không được quét lại thư mục
+    monkeypatch.setattr(Path, "glob", lambda *args: (_ for _ in ()).throw(AssertionError("quét thư mục")))
+    cache.put("a", ROW)
+    cache.put("b", ROW)
+    assert cache.get("a") == ROW
+    cache.put("c", ROW)
+    cache.put("d", ROW)
+    assert cache.get("b") is None
+    assert cache.get("a") == ROW
+    assert cache.total == sum(cache.index.values()) <= LIMIT
+    assert cache.total == sum(p.stat().st_size for p in tmp_path.iterdir())
+
+
+def test_startup_scan_restores_index(tmp_path):
+    cache = ResponseCache(tmp_path, max_bytes=10_000)
+    for key in ("a", "b", "c"):
+        cache.put(key, ROW)
+    cache.put("b", {"headers": [], "rows": []})
+    reopened = ResponseCache(tmp_path, max_bytes=10_000)
+    assert set(reopened.index) == {"a", "b", "c"}
+    assert reopened.total == cache.total
+
+
+def test_key_depends_on_schema_version():
+    key = ResponseCache.make_key(b"anh", "model", "prompt", "v1")
+    assert key == ResponseCache.make_key(b"anh", "model", "prompt", "v1")
+    assert key != ResponseCache.make_key(b"anh", "model", "prompt", "v2")
+
+
+def test_schema_change_invalidates_single_and_batch_entries(make_converter, tmp_path, monkeypatch):
+    import pipeline
+    converter = make_converter(use_cache=True)
+    provider = converter.provider
+    batch = [(n, f"anh {n}".encode(), "image/png") for n in (1, 2)]
+    content = json.dumps({"tables": [ROW, ROW]})
+    assert converter._finish_batch_response(provider, content, batch) == {1: ROW, 2: ROW}
+    # Kết quả request gộp dùng lại được khi gọi từng trang: cùng key
+    for page_number, img_bytes, _ in batch:
+        assert converter._cache_lookup(provider, img_bytes, page_number)[1] == ROW
+    monkeypatch.setattr(pipeline, "SCHEMA_VERSION", "schema-moi")
+    for page_number, img_bytes, _ in batch:
+        assert converter._cache_lookup(provider, img_bytes, page_number)[1] is None
@@ -0,0 +1,69 @@
+"""--resume: chạy lại sau khi bị gián đoạn chỉ gửi lại trang lỗi / chưa xong, trang đã xong được bỏ qua"""
+
+import io
+
+from PIL import Image
+
+from job_manifest import JobManifest
+from providers import MockProvider
+
+PAGES = (1, 2, 3, 4, 5, 6)
+
+
+class PageProvider(MockProvider):
+    """Nhận ra số trang qua màu ảnh (trang n tô màu xám n * 30); trang trong `failing` bị lỗi mạng"""
+
+    def __init__(self, failing=()):
+        super().__init__(latency=0)
+        self.failing = set(failing)
+        self.calls = []
+
+    def send(self, img_bytes, media_type, prompt=None):
+        page_number = Image.open(io.BytesIO(img_bytes)).convert("L").getpixel((0, 0)) // 30
+        self.calls.append(page_number)
+        if page_number in self.failing:
+            raise ConnectionError("mất kết nối")
+        return super().send(img_bytes, media_type, prompt)
+
+
+def _item(page_number):
+    return None, page_number, Image.new("RGB", (40, 30), (page_number * 30,) * 3)
+
+
+def _converter(make_converter, tmp_path, provider, resume):
+    converter = make_converter(provider, pages=PAGES, resume=resume, optimize_payload=False)
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"%PDF-1.4 gia lap")
+    converter.manifest = JobManifest(tmp_path / "jobs" / "source.json", source, resume=resume)
+    return converter
+
+
+def test_resume_skips_done_and_resends_failed_and_pending(make_converter, tmp_path):
+    # Lần 1: trang 3 lỗi, bị dừng khi trang 5 đang xử lý (trang 6 chưa bắt đầu)
+    first = _converter(make_converter, tmp_path, PageProvider(failing={3}), resume=False)
+    for page_number in (1, 2, 3, 4):
+        first.convert_item(_item(page_number))
+    first._begin_page(*_item(5))
+    summary = first.manifest.summary(PAGES)
+    assert summary["done"] == 3 and summary["failed"] == 1
+
+    provider = PageProvider()
+    second = _converter(make_converter, tmp_path, provider, resume=True)
+    for page_number in PAGES:
+        second.convert_item(_item(page_number))
+    # Chỉ trang lỗi (3), đang dở (5) và chưa bắt đầu (6) được gửi lại, mỗi trang 1 lần
+    assert sorted(provider.calls) == [3, 5, 6]
+    statuses = {n: second.metrics.pages[n]["status"] for n in PAGES}
+    assert statuses == {1: "resumed", 2: "resumed", 3: "done", 4: "resumed", 5: "done", 6: "done"}
+    assert second.writer.sheet_count == 6
+    assert second.manifest.all_done(PAGES)
+
+
+def test_resume_redoes_page_whose_content_changed(make_converter, tmp_path):
+    first = _converter(make_converter, tmp_path, PageProvider(), resume=False)
+    first.convert_item(_item(1))
+    provider = PageProvider()
+    second = _converter(make_converter, tmp_path, provider, resume=True)
+    # Ảnh trang 1 khác lần trước (hash khác): xử lý lại
+    second.convert_item((None, 1, Image.new("RGB", (40, 31), (30,) * 3)))
+    assert provider.calls == [1]
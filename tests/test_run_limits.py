@@ -0,0 +1,86 @@
+"""--pages / --max-pages / --max-cost: đọc khoảng trang và tính ngân sách giữ chỗ"""
+
+import threading
+
+import pytest
+
+from run_limits import RunBudget, parse_page_ranges
+
+
+@pytest.mark.parametrize("spec, pages", [
+    ("1-5,8", [1, 2, 3, 4, 5, 8]),
+    (" 3 , 1 ", [1, 3]),
+    ("1-4,3-6", [1, 2, 3, 4, 5, 6]),  # khoảng chồng nhau được gộp
+    ("2,2,2-2", [2]),
+    ("5,", [5]),
+    (7, [7]),
+])
+def test_parse_page_ranges(spec, pages):
+    assert parse_page_ranges(spec) == pages
+
+
+@pytest.mark.parametrize("spec", ["5-2", "0", "0-3", "-3", "a-b", "1-", "1-2-3", "", ",", "1.5"])
+def test_parse_page_ranges_rejects_malformed(spec):
+    with pytest.raises(ValueError):
+        parse_page_ranges(spec)
+
+
+def test_budget_reserve_settle_release():
+    budget = RunBudget(max_pages=10, max_cost=1.0)
+    assert budget.limited
+    assert budget.reserve(2, 0.4)
+    # Chi phí thực tế thấp hơn ước tính: phần dư được trả lại
+    budget.settle(0.4, 0.1)
+    assert budget.pages == 2 and budget.cost == pytest.approx(0.1)
+    assert budget.reserve(1, 0.5)
+    budget.release(1, 0.5)
+    assert budget.pages == 2 and budget.cost == pytest.approx(0.1)
+    # Chi phí thực tế cao hơn ước tính
+    assert budget.reserve(1, 0.2)
+    budget.settle(0.2, 0.3)
+    assert budget.pages == 3 and budget.cost == pytest.approx(0.4)
+    assert not budget.exhausted
+
+
+def test_budget_max_cost_exhausts_and_stays_exhausted():
+    budget = RunBudget(max_cost=1.0)
+    assert budget.reserve(1, 0.6)
+    assert not budget.reserve(1, 0.6)  # 1.2 > 1.0
+    assert budget.exhausted
+    assert budget.pages == 1 and budget.cost == pytest.approx(0.6)
+    # Đã hết ngân sách thì không nhận thêm, kể cả sau khi trả lại chỗ
+    budget.release(1, 0.6)
+    assert not budget.reserve(1, 0.1)
+
+
+def test_budget_exact_limit_is_allowed():
+    budget = RunBudget(max_pages=2, max_cost=0.5)
+    assert budget.reserve(1, 0.25) and budget.reserve(1, 0.25)
+    assert not budget.reserve(1, 0.0)
+    assert budget.describe() == "2 trang AI/2, ~$0.5000/$0.5"
+
+
+def test_unlimited_budget():
+    budget = RunBudget()
+    assert not budget.limited
+    assert budget.reserve(1000, 99.0) and not budget.exhausted
+    assert budget.describe() == "1000 trang AI, ~$99.0000"
+
+
+def test_budget_concurrent_reserve_never_overshoots():
+    budget = RunBudget(max_pages=50, max_cost=2.0)
+    accepted = []
+
+    def worker():
+        for _ in range(40):
+            if budget.reserve(1, 0.03):
+                accepted.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 2.0 / 0.03 → tối đa 66 lần theo chi phí, 50 theo số trang
+    assert len(accepted) == budget.pages == 50
+    assert budget.cost <= 2.0
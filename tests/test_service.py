@@ -0,0 +1,24 @@
+"""Dịch vụ: mỗi job có ngân sách riêng, job hết ngân sách không chặn job sau"""
+
+from pipeline import PDFToExcelConverter
+from providers import MockProvider
+from service import ConversionService
+
+
+def test_each_job_has_its_own_budget(tmp_path, monkeypatch):
+    budgets = []
+
+    def run_full_process(converter):
+        budgets.append((converter.budget, converter.budget.reserve(1, 0.0)))
+        return None
+
+    monkeypatch.setattr(PDFToExcelConverter, "run_full_process", run_full_process)
+    service = ConversionService(provider=MockProvider(latency=0), output_dir=tmp_path, max_pages=1)
+    for _ in range(2):
+        job_id = service.submit(b"%PDF-1.4 gia lap")
+        service._run_job(job_id)
+        assert service.status(job_id)["has_result"] is False
+    (first, first_ok), (second, second_ok) = budgets
+    assert first is not second
+    assert first_ok and second_ok
+    assert first.max_pages == second.max_pages == 1
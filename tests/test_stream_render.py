@@ -0,0 +1,30 @@
+"""--stream: trang render lỗi chỉ làm hỏng trang đó, các trang sau vẫn được render"""
+
+from PIL import Image
+from pypdf import PdfWriter
+
+import pipeline
+
+
+def _fake_render(failing):
+    def iter_page_images(pdf_path, dpi=200, batch_size=10, page_numbers=None, page_dpi=None, **kwargs):
+        for n in page_numbers:
+            if n in failing:
+                raise RuntimeError(f"pdftoppm lỗi ở trang {n}")
+            yield n, Image.new("RGB", (50, 50), "white")
+    return iter_page_images
+
+
+def test_stream_render_error_fails_only_that_page(make_converter, tmp_path, monkeypatch):
+    writer = PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(width=200, height=200)
+    with open(tmp_path / "input.pdf", "wb") as f:
+        writer.write(f)
+    monkeypatch.setattr(pipeline, "iter_page_images", _fake_render({2}))
+    converter = make_converter(pages=(1, 2, 3), stream=True, use_text_layer=False)
+    items = list(converter._iter_page_items(split=False))
+    assert [page_number for _, page_number, _ in items] == [1, 2, 3]
+    assert items[1][2] is None and items[0][2] is not None and items[2][2] is not None
+    assert converter.render_failed == {2}
+    assert converter._prepare_page_image(None, 2, None, converter.provider) is None
@@ -0,0 +1,65 @@
+"""--stream-response qua server SSE giả lập (_read_stream / _read_stream_async)"""
+
+import re
+import asyncio
+
+import pytest
+
+from fake_batch_server import fake_table
+from providers import AnthropicProvider, DeepSeekProvider
+
+IMAGE = b"trang-1-anh-png"
+
+
+def _provider(name, server):
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    if name == "anthropic":
+        provider = AnthropicProvider(api_key="test")
+        provider.url = base + "/v1/messages"
+    else:
+        provider = DeepSeekProvider(api_key="test")
+        provider.url = base + "/chat/completions"
+    return provider
+
+
+def _expected(provider, server):
+    # DeepSeek chỉ nhận text: server giả lập dựng bảng theo đoạn base64 trong prompt
+    if provider.name == "deepseek":
+        _, payload = provider.build_request(IMAGE, "image/png")
+        image = re.search(r"\(truncated\):\s*(\S+)", payload["messages"][0]["content"]).group(1).encode()
+        return fake_table(image, server.rows, server.cols)
+    return fake_table(IMAGE, server.rows, server.cols)
+
+
+def _check_counters(converter):
+    counters = converter.metrics.pages[1]["counters"]
+    assert counters["requests"] == 1
+    assert counters["request_bytes"] > 0
+    assert counters["response_bytes"] > 0
+    assert counters["input_tokens"] > 0 and counters["output_tokens"] > 0
+
+
+@pytest.mark.parametrize("name", ["anthropic", "deepseek"])
+def test_read_stream(mock_server, make_converter, name):
+    provider = _provider(name, mock_server)
+    converter = make_converter(provider, stream_response=True)
+    data = converter._call_provider(provider, IMAGE, "image/png", 1)
+    assert data == _expected(provider, mock_server)
+    _check_counters(converter)
+
+
+@pytest.mark.parametrize("name", ["anthropic", "deepseek"])
+def test_read_stream_async(mock_server, make_converter, name):
+    provider = _provider(name, mock_server)
+    converter = make_converter(provider, stream_response=True, async_mode=True)
+
+    async def run():
+        provider.open_async(2)
+        try:
+            return await converter._call_provider_async(provider, IMAGE, "image/png", 1)
+        finally:
+            await provider.close_async()
+
+    data = asyncio.run(run())
+    assert data == _expected(provider, mock_server)
+    _check_counters(converter)
@@ -0,0 +1,81 @@
+"""Schema bảng chung: table_errors và payload structured output của từng provider"""
+
+import json
+
+import pytest
+
+from providers import AnthropicProvider, DeepSeekProvider
+from table_schema import BATCH_SCHEMA, TABLE_SCHEMA, order_tables, table_errors
+
+IMAGE = (b"anh-trang", "image/png")
+
+
+def test_valid_table_has_no_errors():
+    data = {"headers": ["A", "B"], "rows": [["1", 2], [None, True, "ô gộp"]],
+            "cell_types": ["text", "number"], "table_index": 1}
+    assert table_errors(data) == []
+    assert data["cell_types"] == ["text", "number"] and data["table_index"] == 1
+
+
+@pytest.mark.parametrize("data", [
+    [["A"], ["1"]],
+    {"rows": [["1"]]},
+    {"headers": "A", "rows": [["1"]]},
+    {"headers": [{"ten": "A"}], "rows": []},
+    {"headers": ["A"]},
+    {"headers": ["A"], "rows": ["1"]},
+    {"headers": ["A"], "rows": [[["1"]]]},
+])
+def test_invalid_tables(data):
+    assert table_errors(data)
+
+
+def test_bad_optional_fields_are_dropped():
+    data = {"headers": ["A"], "rows": [["1"]], "cell_types": ["chữ"], "table_index": True}
+    assert table_errors(data) == []
+    assert data == {"headers": ["A"], "rows": [["1"]]}
+
+
+def test_order_tables():
+    tables = [{"table_index": 2, "rows": []}, {"table_index": 1, "rows": []}]
+    assert [t["table_index"] for t in order_tables(tables)] == [1, 2]
+    # Thiếu/trùng số thứ tự: giữ thứ tự model trả về
+    tables = [{"table_index": 2}, {"table_index": 2}]
+    assert order_tables(tables) is tables
+
+
+def test_anthropic_payload_forces_tool_with_schema():
+    provider = AnthropicProvider(api_key="test")
+    _, payload = provider.build_request(*IMAGE)
+    [tool] = payload["tools"]
+    assert tool["input_schema"] == TABLE_SCHEMA
+    assert payload["tool_choice"] == {"type": "tool", "name": tool["name"]}
+    _, payload = provider.build_batch_request([IMAGE, IMAGE])
+    assert payload["tools"][0]["input_schema"] == BATCH_SCHEMA
+    # Gọi tiếp bảng bị cắt trả JSON dạng text, không ép tool
+    _, payload = provider.build_request(*IMAGE, prompt=provider.continuation_prompt({"headers": ["A"],
+                                                                                  "rows": [["1"]]}))
+    assert "tools" not in payload and "tool_choice" not in payload
+
+
+def test_anthropic_tool_use_becomes_json_text():
+    content = [{"type": "tool_use", "name": "record_table", "input": {"headers": ["A"], "rows": [["1"]]}}]
+    assert json.loads(AnthropicProvider._message_text(content)) == {"headers": ["A"], "rows": [["1"]]}
+
+
+def test_deepseek_payload_json_mode_with_schema_in_prompt():
+    provider = DeepSeekProvider(api_key="test")
+    _, payload = provider.build_request(*IMAGE)
+    assert payload["response_format"] == {"type": "json_object"}
+    assert json.dumps(TABLE_SCHEMA, ensure_ascii=False) in payload["messages"][0]["content"]
+    _, payload = provider.build_batch_request([IMAGE, IMAGE])
+    assert json.dumps(BATCH_SCHEMA, ensure_ascii=False) in payload["messages"][0]["content"]
+
+
+def test_gemini_payload_response_schema():
+    pytest.importorskip("google.genai")
+    from providers import GeminiProvider
+    provider = GeminiProvider(api_key="test")
+    config = provider._request_args(*IMAGE)["config"]
+    assert config.response_mime_type == "application/json"
+    assert config.response_schema == TABLE_SCHEMA
@@ -0,0 +1,43 @@
+"""TableStreamParser: đọc JSON bảng theo từng đoạn của response stream"""
+
+import json
+
+import pytest
+
+from json_stream import TableStreamParser
+
+TABLE = {"headers": ["STT", "Tên \"hàng\"", "Ghi chú"],
+         "rows": [[str(n), f"Hàng [{n}] {{x}}", "dòng 1\ndòng 2 \\ é"] for n in range(1, 30)]}
+
+
+@pytest.mark.parametrize("chunk", [1, 3, 17, 10 ** 6])
+def test_stream_parser_matches_json(chunk):
+    text = "Bảng:\n```json\n" + json.dumps(TABLE, ensure_ascii=False, indent=1) + "\n```"
+    parser = TableStreamParser()
+    assert parser.table() is None
+    new_rows = 0
+    for i in range(0, len(text), chunk):
+        new_rows += parser.feed(text[i:i + chunk])
+    assert parser.complete
+    assert new_rows == len(TABLE["rows"])
+    assert parser.table() == TABLE
+
+
+def test_stream_parser_rows_arrive_as_they_close():
+    parser = TableStreamParser()
+    parser.feed('{"headers": ["A", "B"], "rows": [["1", "a"], ["2"')
+    assert parser.headers == ["A", "B"]
+    assert parser.rows == [["1", "a"]]
+    assert parser.feed(', "b"]]}') == 1
+    assert parser.complete and parser.rows == [["1", "a"], ["2", "b"]]
+    # Đã đọc xong object bảng: text sau đó bị bỏ qua
+    assert parser.feed('[["3", "c"]]') == 0
+
+
+def test_stream_parser_truncated_keeps_complete_rows():
+    text = json.dumps(TABLE, ensure_ascii=False)
+    parser = TableStreamParser()
+    parser.feed(text[:len(text) // 2])
+    assert not parser.complete
+    assert parser.rows == TABLE["rows"][:len(parser.rows)]
+    assert 0 < len(parser.rows) < len(TABLE["rows"])
@@ -0,0 +1,122 @@
+"""Lớp text của PDF: trang bảng dựng trực tiếp không qua AI, trang không phải bảng quay về đường AI"""
+
+import pytest
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from job_manifest import JobManifest
+from providers import MockProvider
+from text_layer import MIN_CONFIDENCE, extract_table
+
+TABLE = [
+    ["Ma hang", "Ten hang", "So luong"],
+    ["A01", "But bi", "120"],
+    ["A02", "Vo ke ngang", "45"],
+    ["A03", "Thuoc ke", "300"],
+    ["A04", "Tay chi", "18"],
+]
+PROSE = [
+    "Bien ban nay duoc lap de ghi nhan viec ban giao tai san",
+    "giua hai ben vao cuoi quy ba theo dung quy dinh hien hanh",
+    "cac ben da kiem tra va thong nhat noi dung neu tren",
+]
+
+
+def _pdf_page(tmp_path, lines):
+    """Tạo PDF 1 trang; `lines` là danh sách dòng, mỗi dòng là danh sách (x, text)"""
+    writer = PdfWriter()
+    page = writer.add_blank_page(width=595, height=842)
+    font = DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    })
+    page[NameObject("/Resources")] = DictionaryObject({
+        NameObject("/Font"): DictionaryObject({NameObject("/F1"): writer._add_object(font)}),
+    })
+    ops = []
+    for row, cells in enumerate(lines):
+        y = 780 - row * 20
+        for x, text in cells:
+            ops.append(f"BT /F1 10 Tf {x} {y} Td ({text}) Tj ET")
+    stream = DecodedStreamObject()
+    stream.set_data("\n".join(ops).encode("latin-1"))
+    page[NameObject("/Contents")] = writer._add_object(stream)
+    path = tmp_path / f"page_{len(list(tmp_path.glob('page_*.pdf')))}.pdf"
+    with open(path, "wb") as f:
+        writer.write(f)
+    return PdfReader(path).pages[0]
+
+
+def _table_lines(rows):
+    return [[(x, cell) for x, cell in zip((50, 200, 400), row) if cell] for row in rows]
+
+
+def test_table_page_is_extracted(tmp_path):
+    table, confidence = extract_table(_pdf_page(tmp_path, _table_lines(TABLE)))
+    assert confidence >= MIN_CONFIDENCE
+    assert table == {"headers": TABLE[0], "rows": TABLE[1:]}
+
+
+def test_title_above_table_is_skipped(tmp_path):
+    lines = [[(50, "BAO CAO TON KHO THANG 9")]] + _table_lines(TABLE)
+    table, _ = extract_table(_pdf_page(tmp_path, lines))
+    assert table["headers"] == TABLE[0]
+
+
+def test_confidence_threshold(tmp_path):
+    page = _pdf_page(tmp_path, _table_lines(TABLE))
+    _, confidence = extract_table(page)
+    # Ngưỡng cao hơn độ tin cậy thực tế: không dùng bảng, vẫn trả độ tin cậy
+    table, below = extract_table(page, min_confidence=confidence + 0.01)
+    assert table is None and below == confidence
+    table, _ = extract_table(page, min_confidence=confidence)
+    assert table is not None
+
+
+def test_sparse_table_falls_below_threshold(tmp_path):
+    # Nhiều dòng chỉ có 1 ô (ghi chú xen giữa bảng): độ tin cậy thấp
+    rows = TABLE[:2] + [[f"ghi chu dong {n}", "", ""] for n in range(1, 7)] + TABLE[2:3]
+    table, confidence = extract_table(_pdf_page(tmp_path, _table_lines(rows)))
+    assert table is None
+    assert 0 < confidence < MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("lines", [
+    [[(50, text)] for text in PROSE],  # đoạn văn
+    [[(50, "Trang")]],  # gần như không có text (bản scan)
+    [],
+], ids=["prose", "few-chars", "empty"])
+def test_non_table_page_returns_none(tmp_path, lines):
+    stats = {}
+    table, confidence = extract_table(_pdf_page(tmp_path, lines), stats=stats)
+    assert table is None and confidence == 0.0
+    assert stats["text_chars"] == sum(len(text) for line in lines for _, text in line)
+
+
+class CountingProvider(MockProvider):
+    def __init__(self):
+        super().__init__(latency=0)
+        self.calls = 0
+
+    def send(self, img_bytes, media_type, prompt=None):
+        self.calls += 1
+        return super().send(img_bytes, media_type, prompt)
+
+
+def test_pipeline_uses_text_layer_or_falls_back_to_ai(make_converter, tmp_path):
+    provider = CountingProvider()
+    converter = make_converter(provider, pages=(1, 2))
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"%PDF-1.4 gia lap")
+    converter.manifest = JobManifest(tmp_path / "jobs" / "source.json", source)
+    converter._prepass_page(_pdf_page(tmp_path, _table_lines(TABLE)), 1)
+    converter._prepass_page(_pdf_page(tmp_path, [[(50, text)] for text in PROSE]), 2)
+    assert list(converter.text_tables) == [1]
+    for page_number in (1, 2):
+        converter.convert_item((None, page_number, Image.new("RGB", (120, 80), "white")))
+    # Trang bảng không gọi AI; trang văn bản đi đường AI
+    assert converter.page_methods == {1: "text", 2: "ai"}
+    assert provider.calls == 1
+    assert converter.writer.sheet_count == 2
@@ -0,0 +1,47 @@
+"""--tiles: ngân sách giữ chỗ 1 lần cho cả trang, dải ảnh đọc được dạng stream"""
+
+import asyncio
+
+import pytest
+
+from providers import MockProvider
+
+TILES = [(b"dai-1", "image/png"), (b"dai-2", "image/png"), (b"dai-3", "image/png")]
+
+
+class PricedMockProvider(MockProvider):
+    price_per_mtok = (1.0, 1.0)
+
+
+@pytest.mark.parametrize("stream_response", [False, True])
+def test_tiles_reserve_one_page(make_converter, stream_response):
+    provider = PricedMockProvider(latency=0)
+    converter = make_converter(provider, pages=(1, 2), tiles=3, max_pages=1, stream_response=stream_response)
+    data = converter._call_provider_tiles(provider, TILES, 1)
+    assert data is not None and data["rows"]
+    assert converter.budget.pages == 1
+    # Chi phí là tổng chi phí thực tế của 3 dải
+    expected = sum(provider.estimate_cost(1, (len(img) // 1000, provider._response(img)["output_tokens"]))
+                   for img, _ in TILES)
+    assert converter.budget.cost == pytest.approx(expected)
+    # Trang thứ 2 vượt --max-pages 1
+    assert converter._call_provider_tiles(provider, [(b"x", "image/png"), (b"y", "image/png")], 2) is None
+
+
+def test_tiles_async_reserve_one_page(make_converter):
+    provider = MockProvider(latency=0)
+    converter = make_converter(provider, tiles=3, max_pages=1, async_mode=True, stream_response=True)
+    data = asyncio.run(converter._call_provider_tiles_async(provider, TILES, 1))
+    assert data is not None
+    assert converter.budget.pages == 1
+
+
+def test_tiles_failed_strips_release_page(make_converter):
+    class FailingProvider(MockProvider):
+        def send(self, img_bytes, media_type, prompt=None):
+            raise ConnectionError("mất kết nối")
+
+    provider = FailingProvider(latency=0)
+    converter = make_converter(provider, tiles=3, max_pages=1)
+    assert converter._call_provider_tiles(provider, TILES, 1) is None
+    assert converter.budget.pages == 0
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Trích xuất bảng trực tiếp từ lớp text của PDF "gốc số" (không phải bản scan)
+- Lấy vị trí từng đoạn text bằng visitor của pypdf
+- Gom đoạn text thành dòng theo tọa độ y, tìm ranh giới cột theo khoảng trống chung
+- Trả về {"headers", "rows"} như AI; trang scan hoặc độ tin cậy thấp trả về None
+"""
+
+import math
+
+# Trang có ít ký tự hơn mức này coi như không có lớp text (bản scan)
+MIN_TEXT_CHARS = 20
+# Độ tin cậy tối thiểu để bỏ qua AI
+MIN_CONFIDENCE = 0.6
+# Khoảng trống tối thiểu (pt) giữa hai cột
+MIN_COLUMN_GAP = 4.0
+
+
+def _collect_fragments(page):
+    """Danh sách (x, y, độ rộng ước tính, cỡ chữ, text) của các đoạn text trên trang"""
+    fragments = []
+
+    def visitor(text, cm, tm, font_dict, font_size):
+        if not text or not text.strip():
+            return
+        # Vị trí thực = ma trận text (tm) nhân ma trận hiện hành (cm)
+        c = tm[2] * cm[0] + tm[3] * cm[2]
+        d = tm[2] * cm[1] + tm[3] * cm[3]
+        x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+        y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+        size = (font_size or 1) * (math.hypot(c, d) or 1)
+        for line in text.splitlines():
+            line = line.strip()
+            if line:
+                # Không có metric font, ước lượng ~0.5em mỗi ký tự
+                fragments.append((x, y, len(line) * size * 0.5, size, line))
+
+    page.extract_text(visitor_text=visitor)
+    return fragments
+
+
+def _group_rows(fragments):
+    """Gom đoạn text có cùng tọa độ y (trong sai số nửa cỡ chữ) thành dòng, từ trên xuống"""
+    rows = []
+    for frag in sorted(fragments, key=lambda f: (-f[1], f[0])):
+        if rows and abs(rows[-1][0] - frag[1]) <= max(2.0, frag[3] * 0.5):
+            rows[-1][1].append(frag)
+        else:
+            rows.append([frag[1], [frag]])
+    return [sorted(items, key=lambda f: f[0]) for _, items in rows]
+
+
+def _column_boundaries(rows):
+    """Tìm ranh giới cột: các dải x không bị text của dòng nào phủ lên"""
+    spans = [(f[0], f[0] + f[2]) for row in rows for f in row]
+    spans.sort()
+
+    # Gộp các khoảng bị phủ, khoảng trống giữa chúng là ranh giới cột
+    boundaries = []
+    cur_end = spans[0][1]
+    for start, end in spans[1:]:
+        if start - cur_end >= MIN_COLUMN_GAP:
+            boundaries.append((cur_end + start) / 2)
+            cur_end = end
+        else:
+            cur_end = max(cur_end, end)
+    return boundaries
+
+
+def _to_cells(row, boundaries):
+    cells = [[] for _ in range(len(boundaries) + 1)]
+    for x, _, width, _, text in row:
+        center = x + width / 2
+        col = sum(1 for b in boundaries if center > b)
+        cells[col].append(text)
+    return [" ".join(parts) for parts in cells]
+
+
+def extract_table(page, min_confidence=MIN_CONFIDENCE, stats=None):
+    """Dựng bảng từ lớp text của một trang pypdf.
+
+    Trả về (table, confidence); table là None nếu trang không có lớp text
+    hoặc bố cục không đủ giống một bảng để tin cậy. Nếu truyền dict `stats`,
+    số ký tự của lớp text được ghi vào stats["text_chars"].
+    """
+    try:
+        fragments = _collect_fragments(page)
+    except Exception:
+        return None, 0.0
+
+    text_chars = sum(len(f[4]) for f in fragments)
+    if stats is not None:
+        stats["text_chars"] = text_chars
+    if text_chars < MIN_TEXT_CHARS:
+        return None, 0.0
+
+    rows = _group_rows(fragments)
+    # Bỏ tiêu đề/ghi chú phía trên: bảng bắt đầu từ dòng đầu tiên có >= 2 đoạn
+    while rows and len(rows[0]) < 2:
+        rows.pop(0)
+    table_rows = [row for row in rows if len(row) >= 2]
+    if len(table_rows) < 2:
+        return None, 0.0
+
+    boundaries = _column_boundaries(table_rows)
+    n_cols = len(boundaries) + 1
+    if n_cols < 2:
+        return None, 0.0
+
+    grid = [_to_cells(row, boundaries) for row in rows]
+
+    # Độ tin cậy: tỷ lệ dòng có nhiều cột, và mức lấp đầy các ô
+    multi_ratio = len(table_rows) / len(rows)
+    filled = sum(1 for row in grid for cell in row if cell) / (len(grid) * n_cols)
+    confidence = round(min(1.0, 0.5 * multi_ratio + 0.5 * filled / 0.8), 3)
+    if confidence < min_confidence:
+        return None, confidence
+
+    return {"headers": grid[0], "rows": grid[1:]}, confidence